@@ -1,9 +1,10 @@
 import sys
 import threading
 from multiprocessing import freeze_support
+from typing import Any, Callable
 
-from core import Core
 from ui import UI
+from utils.event_bus import ErrorOccurred, EventBus, StatusUpdate, StopRequested, UserRequestSubmitted
 
 
 class App:
@@ -15,7 +16,7 @@ class App:
     |    |  GUI  |                                       |
     |    +-------+                                       |
     |        ^                                           |
-    |        | (via MP Queues)                           |
+    |        | (via EventBus)                            |
     |        v                                           |
     |  +-----------+  (Screenshot + Goal)  +-----------+ |
     |  |           | --------------------> |           | |
@@ -36,37 +37,71 @@ class App:
     """
 
     def __init__(self):
-        self.core = Core()
-        self.ui = UI()
+        # Core and UI talk through events, see utils/event_bus.py
+        self.event_bus = EventBus()
+        self.event_bus.subscribe(StatusUpdate, self.log_status)
+        self.event_bus.subscribe(UserRequestSubmitted, self.send_user_request_to_core)
+        self.event_bus.subscribe(StopRequested, self.stop_request)
 
-        # Create threads to facilitate communication between core and ui through queues
-        self.core_to_ui_connection_thread = threading.Thread(target=self.send_status_from_core_to_ui, daemon=True)
-        self.ui_to_core_connection_thread = threading.Thread(target=self.send_user_request_from_ui_to_core, daemon=True)
+        self.ui = UI(self.event_bus)
 
-    def run(self) -> None:
-        self.core_to_ui_connection_thread.start()
-        self.ui_to_core_connection_thread.start()
+        # Created on a background thread once the window is up, see start_core(). core_ready is set once that's over,
+        # with core still None and the reason in core_error if it failed.
+        self.core = None
+        self.core_error = None
+        self.core_ready = threading.Event()
 
+    def run(self) -> None:
+        # Window first. Core imports the LLM, screen and input modules and builds the LLM's context, which probes the
+        # system; the window needs none of that to show up.
+        self.ui.main_window.after_idle(
+            lambda: threading.Thread(target=self.start_core, name='core-startup', daemon=True).start())
         self.ui.run()
 
-    def send_status_from_core_to_ui(self) -> None:
-        while True:
-            status: str = self.core.status_queue.get()
-            print(f'Sending status: {status}')
-            self.ui.display_current_status(status)
+    def start_core(self) -> None:
+        try:
+            from core import Core
+            self.core = Core(self.event_bus)
+        except Exception as e:
+            print(f'Unable to start core - {e}')
+            self.core_error = e
+            self.event_bus.publish(ErrorOccurred(str(e)))
+        finally:
+            # Also when it failed, so requests waiting for it don't wait forever
+            self.core_ready.set()
+
+    def call_core(self, function: Callable[[Any], None]) -> None:
+        # Requests made while Core is still starting wait for it on a thread of their own, Tk's thread can't block
+        if self.core_ready.is_set():
+            self.call_started_core(function)
+            return
+
+        def call_when_ready() -> None:
+            self.core_ready.wait()
+            self.call_started_core(function)
+        threading.Thread(target=call_when_ready, daemon=True).start()
+
+    def call_started_core(self, function: Callable[[Any], None]) -> None:
+        if self.core is None:
+            self.event_bus.publish(ErrorOccurred(f'Unable to start core - {self.core_error}'))
+            return
+        function(self.core)
+
+    def log_status(self, event: StatusUpdate) -> None:
+        print(f'Sending status: {event.message}')
 
-    def send_user_request_from_ui_to_core(self) -> None:
-        while True:
-            user_request: str = self.ui.main_window.user_request_queue.get()
-            print(f'Sending user request: {user_request}')
+    def send_user_request_to_core(self, event: UserRequestSubmitted) -> None:
+        print(f'Sending user request: {event.user_request}')
+        # Runs on the core's event loop, which stops the previous request first, so the UI isn't held up
+        self.call_core(lambda core: core.submit_user_request(event.user_request))
 
-            if user_request == 'stop':
-                self.core.stop_previous_request()
-            else:
-                threading.Thread(target=self.core.execute_user_request, args=(user_request,), daemon=True).start()
+    def stop_request(self, event: StopRequested) -> None:
+        print('Sending user request: stop')
+        self.call_core(lambda core: core.stop_previous_request())
 
     def cleanup(self):
-        self.core.cleanup()
+        if self.core:
+            self.core.cleanup()
 
 
 if __name__ == '__main__':
@@ -1,91 +1,661 @@
+import asyncio
+import concurrent.futures
+import threading
 import time
-from multiprocessing import Queue
-from typing import Optional, Any
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional, Any, AsyncIterator, Callable, Collection, Iterable, Union
 
 
-from interpreter import Interpreter
-from llm import LLM
+from interpreter import Interpreter, DEFAULT_REPLACE_SLEEPS, DEFAULT_SPEED_PROFILE
+from llm import get_llm
+from models.instructions import Instructions, Usage
+from models.instructions_parser import InstructionStream
+from utils import local_info
+from utils.event_bus import ErrorOccurred, EventBus, RequestFinished, StatusUpdate
+from utils.input_backends import create_input_backend
+from utils.macros import DEFAULT_CHECKPOINT_TOLERANCE, MacroLibrary, MacroPlayer, MacroRecorder
+from utils.plan_cache import DEFAULT_MAX_ENTRIES as DEFAULT_PLAN_CACHE_MAX_ENTRIES
+from utils.plan_cache import DEFAULT_TTL_SECS as DEFAULT_PLAN_CACHE_TTL_SECS
+from utils.plan_cache import PlanCache
+from utils.screen import DEFAULT_SCREENSHOT_FORMAT, DEFAULT_SCREENSHOT_MAX_EDGE, EncodedScreenshot, Screen
+from utils.screen_diff import ScreenChangeDetector, ScreenSignature, hash_distance
+from utils.screen_transitions import ScreenTransitions
 from utils.settings import Settings
+from utils.tracing import save_trace, tracer
+
+DEFAULT_MAX_STEPS = 20
+DEFAULT_REQUEST_TIMEOUT_SECS = 300
+DEFAULT_STEP_TIMEOUT_SECS = 120
+
+# Send only the changed region of the screen if it covers at most this fraction of it
+DEFAULT_SCREENSHOT_CROP_THRESHOLD = 0.25
+
+# Most bits the screen's perceptual hash may differ from the predicted one for a prefetched plan to be used
+DEFAULT_PREFETCH_HASH_TOLERANCE = 6
+
+
+class RequestOutcome(str, Enum):
+    DONE = 'done'
+    INTERRUPTED = 'interrupted'
+    FAILED = 'failed'
+    TIMED_OUT = 'timed_out'
+    MAX_STEPS_REACHED = 'max_steps_reached'
+
+
+STATUS_MESSAGES = {
+    RequestOutcome.INTERRUPTED: 'Interrupted',
+    RequestOutcome.FAILED: 'Unable to execute the request',
+    RequestOutcome.TIMED_OUT: 'Timed out before completing the request',
+}
+
+
+@dataclass
+class RequestResult:
+    """
+    What happened to a single user request, returned by Core.execute().
+    """
+    user_request: str
+    outcome: Optional[RequestOutcome] = None
+    message: Optional[str] = None
+    steps_taken: int = 0  # LLM round trips
+    cached_steps: int = 0  # Round trips replayed from the plan cache instead
+    macro_checkpoints: int = 0  # Round trips replayed from a recorded macro before the loop started
+    prefetched_steps: int = 0  # Round trips answered by a request made while the previous batch was still running
+    duration_secs: float = 0.0
+    # As reported by the server, summed over the round trips that went to the LLM
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    generation_secs: float = 0.0
+    start_time: float = field(default_factory=time.monotonic, repr=False)
+
+    @property
+    def succeeded(self) -> bool:
+        return self.outcome == RequestOutcome.DONE
+
+    def add_usage(self, usage: Optional[Usage]) -> None:
+        if not usage:
+            return
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+        self.generation_secs += (usage.total_ms or 0) / 1000
+
+
+@dataclass
+class SpeculativePrefetch:
+    """
+    A request for step_num made before the previous batch finished, on the bet that the screen ends up matching
+    predicted_screen_hash. See Core.start_speculative_prefetch().
+    """
+    step_num: int
+    predicted_screen_hash: str
+    future: asyncio.Future  # Resolves to the Instructions, or None if the request failed or was stopped
+    stream: InstructionStream  # stop() it to abort the request, see finish_speculative_prefetch()
 
 
 class Core:
-    def __init__(self):
-        self.status_queue = Queue()
-        self.interrupt_execution = False
-        self.settings_dict = Settings().get_dict()
+    def __init__(self, event_bus: Optional[EventBus] = None):
+        # Status updates, steps and finished requests are published here, see utils/event_bus.py
+        self.event_bus = event_bus or EventBus()
+        # Read when needed rather than copied here, so saved changes apply from the next request (or step) on
+        self.settings = Settings()
+
+        # Requests run as tasks on this event loop, on its own thread so callers (the UI) are never blocked.
+        # Stopping a request cancels its task; stop_event tells work already running on other threads (the interpreter
+        # running a step or a macro) to wind down too. Each request gets its own, so work left over from a stopped
+        # request still sees it set once the next one starts.
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name='core-event-loop', daemon=True)
+        self.loop_thread.start()
+        self.current_task: Optional[asyncio.Task] = None
+        self.stop_event = threading.Event()
+
+        self.screen = Screen()
+        self.interpreter = Interpreter(self.event_bus,
+                                       self.settings.get_str('execution_speed', DEFAULT_SPEED_PROFILE),
+                                       create_input_backend(self.settings.get_str('input_backend')),
+                                       self.screen,
+                                       self.settings.get_bool('replace_sleeps_with_stable_screen_wait',
+                                                              DEFAULT_REPLACE_SLEEPS))
+        self.screen_change_detector = ScreenChangeDetector()
+        # Last screenshot actually sent to the LLM for the current request
+        self.last_sent_screen_signature: Optional[ScreenSignature] = None
 
-        self.interpreter = Interpreter(self.status_queue)
+        self.plan_cache: Optional[PlanCache] = None
+        # Recordings of successful requests, replayed without the LLM while the screen and foreground application
+        # match, see utils/macros.py. Off by default, replayed keystrokes go wherever the focus is.
+        self.macro_library: Optional[MacroLibrary] = None
+        # Speculative mode: ask for the next batch while the current one executes, see start_speculative_prefetch()
+        self.screen_transitions: Optional[ScreenTransitions] = None
+        self.speculation: Optional[SpeculativePrefetch] = None
+        self.configure_features()
+        self.unsubscribe_from_settings = self.settings.subscribe(self.apply_settings)
 
         self.llm = None
         try:
-            self.llm = LLM()
+            self.llm = get_llm()
+            # Downloading and loading the model can take minutes, don't hold up the UI for it
+            self.llm.prepare_model_in_background(self.publish_status)
         except Exception as e:
-            self.status_queue.put(f'Error: {e}')
+            self.event_bus.publish(ErrorOccurred(str(e)))
+
+    def submit_user_request(self, user_request: str) -> concurrent.futures.Future:
+        """
+            Starts the request on the core's event loop, stopping the one before it if it's still running, and returns
+            right away. The returned future resolves to the RequestResult.
+        """
+        return asyncio.run_coroutine_threadsafe(self.run_user_request(user_request), self.loop)
 
-    def execute_user_request(self, user_request: str) -> None:
-        self.stop_previous_request()
-        time.sleep(0.1)
-        self.execute(user_request)
+    def execute_user_request(self, user_request: str) -> RequestResult:
+        # Blocking version of submit_user_request()
+        return self.submit_user_request(user_request).result()
 
     def stop_previous_request(self) -> None:
-        self.interrupt_execution = True
+        self.loop.call_soon_threadsafe(self.cancel_current_request)
 
-    def execute(self, user_request: str, step_num: int = 0) -> Optional[str]:
+    def cancel_current_request(self) -> None:
+        # Runs on the event loop
+        self.stop_event.set()
+        if self.current_task and not self.current_task.done():
+            self.current_task.cancel()
+
+    async def run_user_request(self, user_request: str) -> RequestResult:
+        previous_task = self.current_task
+        if previous_task and not previous_task.done():
+            self.cancel_current_request()
+            await asyncio.gather(previous_task, return_exceptions=True)
+
+        self.current_task = asyncio.current_task()
+        return await self.execute(user_request)
+
+    async def execute(self, user_request: str) -> RequestResult:
         """
-            This function might recurse.
+            Runs the request as a loop of LLM round trips until the LLM says it's done or we run out of budget.
 
             user_request: The original user request
-            step_number: the number of times we've called the LLM for this request.
+            step_num (inside the loop): the number of times we've called the LLM for this request.
                 Used to keep track of whether it's a fresh request we're processing (step number 0), or if we're already
                 in the middle of one.
                 Without it the LLM kept looping after finishing the user request.
                 Also, it is needed because the LLM we are using doesn't have a stateful/assistant mode.
+
+            Budgets (from settings):
+                max_steps: most LLM round trips a single request may take.
+                request_timeout_secs: wall-clock deadline for the whole request.
+                step_timeout_secs: wall-clock deadline for one round trip including executing its steps.
+
+            Each round trip is a pipeline of three stages: capturing and encoding the screen, the LLM request and
+            executing the steps. Blocking work in each runs on worker threads, and execution starts on the first step
+            while the LLM is still generating the rest.
         """
-        self.interrupt_execution = False
+        self.stop_event = threading.Event()
+        self.last_sent_screen_signature = None
+        result = RequestResult(user_request)
+        tracer.start_trace(user_request)
+        request_start = time.perf_counter()
+
+        try:
+            return await self.execute_round_trips(user_request, result)
+        except asyncio.CancelledError:
+            # stop_previous_request() or a newer request cancelled us
+            self.stop_event.set()
+            return self.finish_request(result, RequestOutcome.INTERRUPTED, STATUS_MESSAGES[RequestOutcome.INTERRUPTED])
+        finally:
+            if self.speculation:
+                self.speculation.stream.stop()
+                self.speculation = None
+            if self.screen_transitions:
+                self.run_in_background(self.screen_transitions.save)
+            tracer.record('request', request_start, outcome=result.outcome, steps=result.steps_taken)
+            trace = tracer.finish_trace()
+            if trace:
+                self.run_in_background(save_trace, trace)
 
+    async def execute_round_trips(self, user_request: str, result: RequestResult) -> RequestResult:
         if not self.llm:
-            status = 'LLM not running corectly'
-            self.status_queue.put(status)
-            return status
+            return self.finish_request(result, RequestOutcome.FAILED, 'LLM not running corectly')
+
+        max_steps = self.settings.get_int('max_steps', DEFAULT_MAX_STEPS)
+        request_timeout = self.settings.get_float('request_timeout_secs', DEFAULT_REQUEST_TIMEOUT_SECS)
+        step_timeout = self.settings.get_float('step_timeout_secs', DEFAULT_STEP_TIMEOUT_SECS)
+        request_deadline = result.start_time + request_timeout
+
+        recorder = MacroRecorder(user_request)
+        first_step_num = 0
+        macro = self.macro_library.find(user_request) if self.macro_library else None
+        if macro:
+            self.publish_status('Replaying recorded steps')
+            player = MacroPlayer(self.interpreter, lambda: self.get_screen_hash(None),
+                                 self.settings.get_int('macro_checkpoint_tolerance', DEFAULT_CHECKPOINT_TOLERANCE),
+                                 local_info.get_foreground_app)
+            completed, first_step_num = await asyncio.to_thread(player.play, macro, self.stop_event.is_set)
+            result.macro_checkpoints = first_step_num
+            recorder.macro['checkpoints'] = macro['checkpoints'][:first_step_num]
+            for step_num, checkpoint in enumerate(recorder.macro['checkpoints']):
+                self.llm.add_replayed_steps(step_num, checkpoint['steps'], 'recorded macro')
+
+            if completed:
+                self.play_ding_on_completion()
+                return self.finish_request(result, RequestOutcome.DONE, macro['done'])
+            # Otherwise the screen didn't match a checkpoint, the LLM takes over from there
+
+        if not self.llm.wait_until_model_ready(0):
+            self.publish_status('Waiting for the model to finish loading')
+            if not await asyncio.to_thread(self.llm.wait_until_model_ready, request_timeout):
+                return self.finish_request(result, RequestOutcome.TIMED_OUT, 'Timed out waiting for the model to load')
+
+        # Only stored once the request succeeds, so plans that went nowhere aren't replayed
+        plans_to_cache = []
+        # (screen hash, steps) of the last round trip, to learn where its steps led
+        previous_round_trip: Optional[tuple[Optional[str], list[dict[str, Any]]]] = None
+
+        for step_num in range(first_step_num, max_steps):
+            step_start = time.monotonic()
+            step_deadline = min(request_deadline, step_start + step_timeout)
+            round_trip_start = time.perf_counter()
+            result.steps_taken = step_num + 1
+
+            try:
+                previously_sent_signature = self.last_sent_screen_signature
+                screenshot = await asyncio.to_thread(self.capture_screenshot, step_num)
+                screen_hash = None
+                if self.plan_cache or self.macro_library or self.screen_transitions:
+                    screen_hash = await asyncio.to_thread(self.get_screen_hash, screenshot)
+                # Recorded with the macro's checkpoint, replay only goes ahead in the same application
+                foreground_app = await asyncio.to_thread(local_info.get_foreground_app) if self.macro_library else None
+                if self.screen_transitions and previous_round_trip:
+                    self.screen_transitions.record(*previous_round_trip, screen_hash)
+
+                prefetched_instructions = None
+                if self.speculation:
+                    prefetched_instructions = await self.finish_speculative_prefetch(screen_hash, step_deadline)
+                    if prefetched_instructions:
+                        # The LLM never saw this screenshot
+                        self.last_sent_screen_signature = previously_sent_signature
+
+                cached_instructions = None
+                if screen_hash and self.plan_cache:
+                    cached_instructions = self.plan_cache.get(user_request, step_num, self.llm.model_name, screen_hash)
+
+                # Called once the LLM's reply is complete, possibly while its steps are still executing
+                def on_reply_complete(reply: Optional[Instructions], step_num: int = step_num,
+                                      screen_hash: Optional[str] = screen_hash) -> None:
+                    self.start_speculative_prefetch(user_request, step_num + 1, screen_hash, reply)
+
+                if cached_instructions is not None:
+                    # Seen this exact request from this exact screen before, replay without asking the LLM
+                    print(f'Replaying cached plan for step {step_num}')
+                    result.cached_steps += 1
+                    instructions = Instructions.from_dict(cached_instructions)
+                    self.llm.add_replayed_steps(step_num, instructions.steps, 'plan cache')
+                    status = await self.execute_steps(instructions.steps, step_deadline)
+                else:
+                    if prefetched_instructions:
+                        print(f'Using the plan prefetched for step {step_num}')
+                        result.prefetched_steps += 1
+                        instructions = prefetched_instructions
+                        on_reply_complete(instructions)
+                        status = await self.execute_steps(instructions.steps, step_deadline)
+                    else:
+                        instructions, status = await self.get_and_execute_instructions(
+                            user_request, step_num, step_deadline, screenshot, on_reply_complete)
+                    if instructions:
+                        result.add_usage(instructions.usage)
+                    if screen_hash and instructions and self.plan_cache:
+                        plans_to_cache.append((user_request, step_num, self.llm.model_name, screen_hash,
+                                               instructions.to_dict()))
+            except Exception as e:
+                return self.finish_request(result, RequestOutcome.FAILED,
+                                           f'Exception Unable to execute the request - {e}')
+
+            if status:
+                return self.finish_request(result, status, STATUS_MESSAGES[status])
+
+            recorder.record(screen_hash, instructions.steps, time.monotonic() - step_start, foreground_app)
+            tracer.record('round_trip', round_trip_start, step_num=step_num)
+            previous_round_trip = (screen_hash, instructions.steps)
+
+            if instructions.done:
+                # Communicate Results
+                self.play_ding_on_completion()
+                # Both write to disk, which the user doesn't need to wait for
+                if self.plan_cache:
+                    self.run_in_background(self.plan_cache.put_many, plans_to_cache)
+                if self.macro_library:
+                    self.run_in_background(self.macro_library.save, recorder.finish(instructions.done))
+                # Shown to the model as an example for similar requests, see LLM.get_examples()
+                self.run_in_background(self.llm.remember_successful_request, user_request,
+                                       [checkpoint['steps'] for checkpoint in recorder.macro['checkpoints']],
+                                       instructions.done)
+                return self.finish_request(result, RequestOutcome.DONE, instructions.done)
+
+            if time.monotonic() >= request_deadline:
+                return self.finish_request(result, RequestOutcome.TIMED_OUT, STATUS_MESSAGES[RequestOutcome.TIMED_OUT])
+
+            # if not done, continue to next phase
+            self.publish_status('Fetching further instructions based on current state')
+
+        return self.finish_request(result, RequestOutcome.MAX_STEPS_REACHED,
+                                   f'Stopped after {max_steps} steps without completing the request')
+
+    async def get_and_execute_instructions(self, user_request: str, step_num: int, deadline: float,
+                                           screenshot: Optional[EncodedScreenshot],
+                                           on_reply_complete: Optional[Callable[[Optional[Instructions]], None]] = None
+                                           ) -> tuple[Optional[Instructions], Optional[RequestOutcome]]:
+        if self.settings.get_bool('stream_steps', True):
+            return await self.get_and_execute_streamed_instructions(user_request, step_num, deadline, screenshot,
+                                                                    on_reply_complete)
 
         try:
-            instructions: dict[str, Any] = self.llm.get_instructions_for_objective(user_request, step_num)
+            instructions = await asyncio.wait_for(
+                asyncio.to_thread(self.llm.get_instructions_for_objective, user_request, step_num, screenshot),
+                deadline - time.monotonic())
 
-            if instructions == {}:
+            if instructions is None:
                 # Sometimes LLM sends malformed JSON response, in that case retry once more.
-                instructions = self.llm.get_instructions_for_objective(user_request + ' Please reply in valid JSON',
-                                                                       step_num)
+                instructions = await asyncio.wait_for(
+                    asyncio.to_thread(self.llm.get_instructions_for_objective,
+                                      user_request + ' Please reply in valid JSON', step_num, screenshot),
+                    deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            return None, RequestOutcome.TIMED_OUT
+
+        if instructions is None:
+            return None, RequestOutcome.FAILED
+        if on_reply_complete:
+            on_reply_complete(instructions)
+        return instructions, await self.execute_steps(instructions.steps, deadline)
+
+    def finish_request(self, result: RequestResult, outcome: RequestOutcome, message: str) -> RequestResult:
+        result.outcome = outcome
+        result.message = message
+        result.duration_secs = time.monotonic() - result.start_time
+        self.publish_status(message)
+        self.event_bus.publish(RequestFinished(result))
+        print(f'Request finished - {result}')
+        if self.plan_cache:
+            print(f'Plan cache - {self.plan_cache.get_stats()}')
+        if self.llm and result.steps_taken:
+            print(self.llm.get_prompt_size_report())
+        return result
+
+    def publish_status(self, message: str) -> None:
+        self.event_bus.publish(StatusUpdate(message))
 
-            for step in instructions['steps']:
-                if self.interrupt_execution:
-                    self.status_queue.put('Interrupted')
-                    self.interrupt_execution = False
-                    return 'Interrupted'
+    def configure_features(self, changed: Optional[Collection[str]] = None) -> None:
+        """
+            Creates or drops the optional features their settings turn on and off. changed: only reconsider features
+            whose settings are among these, None for all of them.
+        """
+        def affected(*names: str) -> bool:
+            return changed is None or any(name in changed for name in names)
+
+        if affected('plan_cache', 'plan_cache_max_entries', 'plan_cache_ttl_secs'):
+            self.plan_cache = None
+            if self.settings.get_bool('plan_cache', True):
+                self.plan_cache = PlanCache(
+                    max_entries=self.settings.get_int('plan_cache_max_entries', DEFAULT_PLAN_CACHE_MAX_ENTRIES),
+                    ttl_secs=self.settings.get_float('plan_cache_ttl_secs', DEFAULT_PLAN_CACHE_TTL_SECS))
+        if affected('macros'):
+            self.macro_library = MacroLibrary() if self.settings.get_bool('macros', False) else None
+        if affected('speculative_prefetch'):
+            self.screen_transitions = ScreenTransitions() if self.settings.get_bool('speculative_prefetch') else None
+        if affected('tracing'):
+            # Per-stage timings of every request, written to ~/.open-interface/traces/, see utils/tracing.py
+            tracer.enabled = self.settings.get_bool('tracing')
+
+    def apply_settings(self, changed: dict[str, Any]) -> None:
+        # Subscribed to Settings, runs on its notifier thread. Everything else is read per request.
+        self.configure_features(changed)
+        if 'input_backend' in changed:
+            self.interpreter.set_backend(create_input_backend(self.settings.get_str('input_backend')))
+        if 'execution_speed' in changed:
+            self.interpreter.set_speed_profile(self.settings.get_str('execution_speed', DEFAULT_SPEED_PROFILE))
+        if 'replace_sleeps_with_stable_screen_wait' in changed:
+            self.interpreter.replace_sleeps = self.settings.get_bool('replace_sleeps_with_stable_screen_wait',
+                                                                     DEFAULT_REPLACE_SLEEPS)
+
+    def capture_screenshot(self, step_num: int) -> Optional[EncodedScreenshot]:
+        """
+            After step 0 the LLM needs to see where its previous steps got us.
+            Step 0 goes without one, the request alone says what to do and it saves a capture on the first round trip.
 
-                success = self.interpreter.process_command(step)
+            With change detection on (default), a screen identical to the last one we sent isn't sent again, and if
+            only a small part of it changed (a dialog, a text field) only that region is sent.
+        """
+        if step_num == 0 or not self.settings.get_bool('send_screenshots', True):
+            return None
+
+        try:
+            start = time.perf_counter()
+            img = self.screen.get_screenshot()
+            timings_ms = {'capture': (time.perf_counter() - start) * 1000}
 
-                if not success:
-                    return 'Unable to execute the request'
+            signature = None
+            region = None
+            if self.settings.get_bool('screenshot_change_detection', True):
+                signature = self.screen_change_detector.get_signature(img)
+                if self.last_sent_screen_signature is not None:
+                    change = self.screen_change_detector.compare(self.last_sent_screen_signature, signature)
+                    if not change.changed:
+                        print('Screen unchanged since the last screenshot, not sending it again')
+                        return EncodedScreenshot(b'', '', (0, 0), img.size, timings_ms, signature=signature)
+                    crop_threshold = self.settings.get_float('screenshot_crop_threshold',
+                                                             DEFAULT_SCREENSHOT_CROP_THRESHOLD)
+                    if change.changed_fraction <= crop_threshold:
+                        region = change.dirty_region
+                self.last_sent_screen_signature = signature
 
+            return self.screen.encode_for_llm(
+                img,
+                self.settings.get_int('screenshot_max_edge', DEFAULT_SCREENSHOT_MAX_EDGE),
+                self.settings.get_str('screenshot_format', DEFAULT_SCREENSHOT_FORMAT),
+                region=region,
+                timings_ms=timings_ms,
+                signature=signature)
+        except Exception as e:
+            print(f'Unable to capture screenshot, continuing without it - {e}')
+            return None
+
+    def get_screen_hash(self, screenshot: Optional[EncodedScreenshot]) -> Optional[str]:
+        # Perceptual hash of the current screen, reusing the screenshot's signature if we just took one
+        try:
+            if screenshot and screenshot.signature:
+                return screenshot.signature.perceptual_hash()
+            return self.screen_change_detector.get_signature(self.screen.get_screenshot()).perceptual_hash()
         except Exception as e:
-            status = f'Exception Unable to execute the request - {e}'
-            self.status_queue.put(status)
+            print(f'Unable to hash the screen, skipping the plan cache - {e}')
+            return None
+
+    async def get_and_execute_streamed_instructions(
+            self, user_request: str, step_num: int, deadline: float,
+            screenshot: Optional[EncodedScreenshot] = None,
+            on_reply_complete: Optional[Callable[[Optional[Instructions]], None]] = None
+    ) -> tuple[Optional[Instructions], Optional[RequestOutcome]]:
+        """
+            Executes each step as soon as the LLM finishes generating it instead of waiting for the whole reply.
+            Returns the complete instructions and an outcome if execution had to stop early.
+        """
+        instruction_stream = await asyncio.to_thread(self.llm.stream_instructions_for_objective, user_request,
+                                                     step_num, screenshot)
+        status = await self.stream_and_execute_steps(instruction_stream, deadline, on_reply_complete)
+        if status:
+            return None, status
+
+        instructions = instruction_stream.get_instructions()
+        if instructions is None:
+            # Sometimes LLM sends malformed JSON response, in that case retry once more.
+            instruction_stream = await asyncio.to_thread(self.llm.stream_instructions_for_objective,
+                                                         user_request + ' Please reply in valid JSON', step_num,
+                                                         screenshot)
+            status = await self.stream_and_execute_steps(instruction_stream, deadline)
+            instructions = instruction_stream.get_instructions()
+            if instructions is None and not status:
+                status = RequestOutcome.FAILED
+
+        return instructions, status
+
+    async def stream_and_execute_steps(self, instruction_stream: InstructionStream, deadline: float,
+                                       on_reply_complete: Optional[Callable[[Optional[Instructions]], None]] = None
+                                       ) -> Optional[RequestOutcome]:
+        """
+            The LLM stage and the execution stage, connected by a queue. The reply is read on a worker thread that
+            keeps receiving tokens while a step executes, instead of generation stalling on a paused generator.
+        """
+        loop = asyncio.get_running_loop()
+        steps: asyncio.Queue[Optional[dict[str, Any]]] = asyncio.Queue()
+
+        def read_steps() -> None:
+            # Stops at the next chunk once instruction_stream.stop() is called, then closes the connection
+            try:
+                for step in instruction_stream:
+                    loop.call_soon_threadsafe(steps.put_nowait, step)
+            finally:
+                # Closed on the reading thread, a generator can't be closed while another thread is inside it
+                instruction_stream.close()
+                loop.call_soon_threadsafe(steps.put_nowait, None)
+
+        async def iterate_steps() -> AsyncIterator[dict[str, Any]]:
+            while (step := await steps.get()) is not None:
+                yield step
+
+        reader = loop.run_in_executor(None, read_steps)
+        reply_completed = False
+
+        def reply_complete(_=None) -> None:
+            # Runs on the loop as soon as the reply is read, the steps may still be executing
+            nonlocal reply_completed
+            if on_reply_complete and not reply_completed and not instruction_stream.is_stopped():
+                reply_completed = True
+                on_reply_complete(instruction_stream.get_instructions())
+        reader.add_done_callback(reply_complete)
+        try:
+            status = await self.execute_steps(iterate_steps(), deadline)
+        except asyncio.CancelledError:
+            # Whatever the model is still generating for a stopped request is no longer wanted
+            instruction_stream.stop()
+            raise
+        if status is not None:
+            instruction_stream.stop()
             return status
+        # Every step ran, so the reply has been read to the end and get_instructions() is complete
+        await reader
+        # The done callback may not have had its turn yet, it has to run before the next round trip starts
+        reply_complete()
+        return None
 
-        if instructions['done']:
-            # Communicate Results
-            self.status_queue.put(instructions['done'])
-            self.play_ding_on_completion()
-            return instructions['done']
-        else:
-            # if not done, continue to next phase
-            self.status_queue.put('Fetching further instructions based on current state')
-            return self.execute(user_request, step_num + 1)
+    async def execute_steps(self, steps: Union[Iterable[dict[str, Any]], AsyncIterator[dict[str, Any]]],
+                            deadline: float) -> Optional[RequestOutcome]:
+        """
+            Runs steps through the interpreter one at a time, each on a worker thread.
+            Returns None if all of them ran, otherwise the reason we stopped.
+            Stopping the request cancels the await. A step that hasn't started on its worker thread yet is skipped, the
+            one that's already running is left to finish.
+        """
+        if not hasattr(steps, '__aiter__'):
+            steps = iterate_async(steps)
+
+        while True:
+            if time.monotonic() >= deadline:
+                return RequestOutcome.TIMED_OUT
+            try:
+                # Also bounds the wait for a streamed step the model is still generating (or a server that stalled)
+                step = await asyncio.wait_for(steps.__anext__(), deadline - time.monotonic())
+            except StopAsyncIteration:
+                return None
+            except asyncio.TimeoutError:
+                return RequestOutcome.TIMED_OUT
+
+            success = await asyncio.to_thread(self.interpreter.process_command, step, self.stop_event.is_set)
+
+            if not success:
+                return RequestOutcome.FAILED
+
+    def start_speculative_prefetch(self, user_request: str, step_num: int, screen_hash: Optional[str],
+                                   instructions: Optional[Instructions]) -> None:
+        """
+            Speculative mode (the 'speculative_prefetch' setting). Called when the LLM's reply for the previous step is
+            complete but its steps may still be executing; if we've seen where those steps lead from this screen before,
+            ask for step_num right away, on the bet that the screen will end up the same way again.
+            The request goes without a screenshot since the screen isn't there yet. finish_speculative_prefetch()
+            settles the bet once the batch has run.
+        """
+        if not self.screen_transitions or not instructions or instructions.done or self.speculation:
+            return
+        predicted_screen_hash = self.screen_transitions.predict(screen_hash, instructions.steps)
+        if not predicted_screen_hash:
+            return
+
+        # Only formats the request, the stream connects once it's read
+        instruction_stream = self.llm.stream_instructions_for_objective(user_request, step_num, None)
+
+        def prefetch() -> Optional[Instructions]:
+            try:
+                # Stops at the next chunk once the stream is stopped, which closes the connection and makes the server
+                # stop generating
+                for _ in instruction_stream:
+                    pass
+            finally:
+                instruction_stream.close()
+            if instruction_stream.is_stopped():
+                return None
+            return instruction_stream.get_instructions()
+
+        print(f'Prefetching step {step_num}, expecting screen {predicted_screen_hash}')
+        self.speculation = SpeculativePrefetch(step_num, predicted_screen_hash,
+                                               asyncio.get_running_loop().run_in_executor(None, prefetch),
+                                               instruction_stream)
+
+    async def finish_speculative_prefetch(self, screen_hash: Optional[str], deadline: float) -> Optional[Instructions]:
+        """
+            Returns the prefetched instructions if the screen ended up where we predicted. Otherwise stops the request
+            if it's still running and takes it out of the conversation, so the LLM is asked again with a screenshot.
+            Waits for the prefetch until deadline at most. Its reply is left out of the conversation if it arrives
+            after being discarded, see PromptSession.add_assistant_reply().
+        """
+        speculation, self.speculation = self.speculation, None
+        tolerance = self.settings.get_int('prefetch_hash_tolerance', DEFAULT_PREFETCH_HASH_TOLERANCE)
+        predicted = bool(screen_hash) and hash_distance(screen_hash, speculation.predicted_screen_hash) <= tolerance
+        if not predicted:
+            speculation.stream.stop()
+
+        try:
+            # Shielded, the worker thread can't be cancelled, only stopped through the stream
+            instructions = await asyncio.wait_for(asyncio.shield(speculation.future), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            print(f'Prefetch for step {speculation.step_num} timed out')
+            speculation.stream.stop()
+            instructions = None
+        except Exception as e:
+            print(f'Prefetch for step {speculation.step_num} failed - {e}')
+            instructions = None
+
+        if predicted and instructions:
+            return instructions
+        print(f'Discarding the plan prefetched for step {speculation.step_num}')
+        self.llm.discard_step(speculation.step_num)
+        return None
+
+    def run_in_background(self, function: Callable[..., Any], *args) -> None:
+        # Bookkeeping that shouldn't hold up the result, errors are only logged
+        def log_errors(future: asyncio.Future) -> None:
+            if not future.cancelled() and future.exception():
+                print(f'Background task {function.__name__} failed - {future.exception()}')
+
+        self.loop.run_in_executor(None, function, *args).add_done_callback(log_errors)
 
     def play_ding_on_completion(self):
         # Play ding sound to signal completion
-        if self.settings_dict.get('play_ding_on_completion'):
+        if self.settings.get_bool('play_ding_on_completion'):
             print('\a')
 
     def cleanup(self):
-        self.llm.cleanup()
+        self.unsubscribe_from_settings()
+        if self.llm:
+            self.llm.cleanup()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+async def iterate_async(steps: Iterable[dict[str, Any]]) -> AsyncIterator[dict[str, Any]]:
+    for step in steps:
+        yield step
@@ -1,79 +1,240 @@
-from multiprocessing import Queue
+import time
 from time import sleep
-from typing import Any
+from typing import Any, Callable, Optional
 
-import pyautogui
+from utils.event_bus import EventBus, StepFinished, StepStarted
+from utils.input_backends import InputBackend, InputCall, KEYBOARD_FUNCTIONS, create_input_backend
+from utils.tracing import tracer
+
+# Execution speed profiles, picked with the 'execution_speed' setting.
+#   pause: pyautogui.PAUSE, the delay pyautogui adds after every call.
+#   typing_interval: default (and maximum) seconds between keystrokes for write/press.
+#   settle_delay: wait after hotkeys, which usually open or switch something, before the next command.
+#   paste_threshold: write strings at least this long through the clipboard instead of typing them. None to never paste.
+SPEED_PROFILES: dict[str, dict[str, Any]] = {
+    'safe': {'pause': 0.1, 'typing_interval': 0.1, 'settle_delay': 0.2, 'paste_threshold': None},
+    'fast': {'pause': 0.0, 'typing_interval': 0.02, 'settle_delay': 0.05, 'paste_threshold': 40},
+    'instant': {'pause': 0.0, 'typing_interval': 0.0, 'settle_delay': 0.0, 'paste_threshold': 1},
+}
+DEFAULT_SPEED_PROFILE = 'fast'
+
+
+# Turn the LLM's fixed sleep(secs) steps into wait_for_stable_screen(timeout=secs), the
+# 'replace_sleeps_with_stable_screen_wait' setting
+DEFAULT_REPLACE_SLEEPS = True
+# sleep(secs) steps rewritten into wait_for_stable_screen still wait at least this fraction of secs (capped at 1s), so
+# we don't mistake the moment before an app starts reacting for it having finished loading.
+REPLACED_SLEEP_MIN_WAIT_FRACTION = 0.25
 
 
 class Interpreter:
-    def __init__(self, status_queue: Queue):
-        # MP Queue to put current status of execution in while processes commands.
+    def __init__(self, event_bus: EventBus, speed_profile: str = DEFAULT_SPEED_PROFILE,
+                 backend: Optional[InputBackend] = None, screen: Optional[Any] = None,
+                 replace_sleeps: bool = DEFAULT_REPLACE_SLEEPS):
+        # Each command is published as a StepStarted and a StepFinished event while it's processed.
         # It helps us reflect the current status on the UI.
-        self.status_queue = status_queue
+        self.event_bus = event_bus
+
+        # Where keyboard and mouse calls actually go, see utils/input_backends.py
+        self.backend = backend or create_input_backend()
+
+        # Used by wait_for_stable_screen, created on first use so the interpreter doesn't need a display until then
+        self.screen = screen
+        # Turn the LLM's fixed sleep(secs) steps into wait_for_stable_screen(timeout=secs)
+        self.replace_sleeps = replace_sleeps
 
-    def process_commands(self, json_commands: list[dict[str, Any]]) -> bool:
+        self.set_speed_profile(speed_profile)
+        self.warmed_up = False
+
+    def set_speed_profile(self, speed_profile: str) -> None:
+        self.speed_profile = SPEED_PROFILES.get(speed_profile, SPEED_PROFILES[DEFAULT_SPEED_PROFILE])
+        self.backend.set_pause(self.speed_profile['pause'])
+
+    def set_backend(self, backend: InputBackend) -> None:
+        self.backend = backend
+        self.backend.set_pause(self.speed_profile['pause'])
+        self.warmed_up = False
+
+    def process_commands(self, json_commands: list[dict[str, Any]],
+                         should_stop: Callable[[], bool] = lambda: False) -> bool:
         """
         Reads a list of JSON commands and runs the corresponding function call as specified in context.txt
+        If the backend supports it, consecutive keyboard commands are sent to it as a single batch.
         :param json_commands: List of JSON Objects with format as described in context.txt
-        :return: True for successful execution, False for exception while interpreting or executing.
+        :param should_stop: Checked before every command and batch, e.g. the request was stopped. What's left isn't run.
+        :return: True for successful execution, False for exception while interpreting or executing, or if stopped.
         """
+        if not self.backend.supports_batching:
+            for command in json_commands:
+                success = self.process_command(command, should_stop)
+                if not success:
+                    return False  # End early and return
+            return True
+
+        batch: list[InputCall] = []
+        batch_commands: list[dict[str, Any]] = []
         for command in json_commands:
-            success = self.process_command(command)
+            if should_stop():
+                return False
+            if command.get('function') in KEYBOARD_FUNCTIONS:
+                self.report_command(command)
+                try:
+                    batch.extend(self.get_input_calls(command['function'], command.get('parameters', {})))
+                except Exception as e:
+                    print(f'We are having a problem executing this - {e}')
+                    self.report_command_finished(command, False, 0.0)
+                    return False
+                batch_commands.append(command)
+                continue
+
+            if batch_commands and not self.run_batch(batch, batch_commands):
+                return False
+            batch = []
+            batch_commands = []
+
+            success = self.process_command(command, should_stop)
             if not success:
                 return False  # End early and return
-        return True
 
-    def process_command(self, json_command: dict[str, Any]) -> bool:
+        if should_stop():
+            return False
+        # Commands with nothing to send (an empty write) still finish
+        return self.run_batch(batch, batch_commands) if batch_commands else True
+
+    def process_command(self, json_command: dict[str, Any], should_stop: Callable[[], bool] = lambda: False) -> bool:
         """
         Reads the passed in JSON object and extracts relevant details. Format is specified in context.txt.
         After interpretation, it proceeds to execute the appropriate function call.
 
-        :return: True for successful execution, False for exception while interpreting or executing.
+        :param should_stop: Checked before the command starts, it isn't run if this returns True.
+        :return: True for successful execution, False for exception while interpreting or executing, or if stopped.
         """
+        if should_stop():
+            return False
         function_name = json_command['function']
         parameters = json_command.get('parameters', {})
-        human_readable_justification = json_command.get('human_readable_justification')
-        print(f'Now performing - {function_name} - {parameters} - {human_readable_justification}')
-        self.status_queue.put(human_readable_justification)
+        self.report_command(json_command)
+        start = time.monotonic()
         try:
-            self.execute_function(function_name, parameters)
+            with tracer.span(f'execute.{function_name}'):
+                self.execute_function(function_name, parameters)
+            self.report_command_finished(json_command, True, time.monotonic() - start)
             return True
         except Exception as e:
             print(f'We are having a problem executing this - {e}')
+            self.report_command_finished(json_command, False, time.monotonic() - start)
             return False
 
+    def report_command(self, json_command: dict[str, Any]) -> None:
+        function_name = json_command.get('function')
+        parameters = json_command.get('parameters', {})
+        human_readable_justification = json_command.get('human_readable_justification')
+        print(f'Now performing - {function_name} - {parameters} - {human_readable_justification}')
+        self.event_bus.publish(StepStarted(function_name, parameters, human_readable_justification))
+
+    def report_command_finished(self, json_command: dict[str, Any], succeeded: bool, duration_secs: float) -> None:
+        self.event_bus.publish(StepFinished(json_command.get('function'), succeeded, duration_secs))
+
+    def run_batch(self, batch: list[InputCall], commands: list[dict[str, Any]]) -> bool:
+        if not self.warmed_up:
+            self.warm_up()
+        start = time.monotonic()
+        succeeded = True
+        try:
+            with tracer.span('execute.batch', functions=[command.get('function') for command in commands]):
+                self.backend.run_batch(batch)
+        except Exception as e:
+            print(f'We are having a problem executing this - {e}')
+            succeeded = False
+        for command in commands:
+            self.report_command_finished(command, succeeded, time.monotonic() - start)
+        return succeeded
+
     def execute_function(self, function_name: str, parameters: dict[str, Any]) -> None:
         """
-            We are expecting only two types of function calls below
+            We are expecting only three types of function calls below
             1. time.sleep() - to wait for web pages, applications, and other things to load.
-            2. pyautogui calls to interact with system's mouse and keyboard.
+            2. wait_for_stable_screen() - same purpose, but returns as soon as the screen stops changing.
+            3. pyautogui calls to interact with system's mouse and keyboard.
         """
-        # Sometimes pyautogui needs warming up i.e. sometimes first call isn't executed hence padding a random call here
-        pyautogui.press("command", interval=0.2)
+        if not self.warmed_up:
+            self.warm_up()
 
         if function_name == "sleep" and parameters.get("secs"):
-            sleep(parameters.get("secs"))
-        elif hasattr(pyautogui, function_name):
-            # Execute the corresponding pyautogui function i.e. Keyboard or Mouse commands.
-            function_to_call = getattr(pyautogui, function_name)
-
-            # Special handling for the 'write' function
-            if function_name == 'write' and ('string' in parameters or 'text' in parameters):
-                # 'write' function expects a string, not a 'text' keyword argument but LLM sometimes gets confused on the parameter name.
-                string_to_write = parameters.get('string') or parameters.get('text')
-                interval = parameters.get('interval', 0.1)
-                function_to_call(string_to_write, interval=interval)
-            elif function_name == 'press' and ('keys' in parameters or 'key' in parameters):
-                # 'press' can take a list of keys or a single key
-                keys_to_press = parameters.get('keys') or parameters.get('key')
-                presses = parameters.get('presses', 1)
-                interval = parameters.get('interval', 0.1)
-                function_to_call(keys_to_press, presses=presses, interval=interval)
-            elif function_name == 'hotkey':
-                # 'hotkey' function expects multiple key arguments, not a list
-                function_to_call(*parameters['keys'])
+            secs = float(parameters.get("secs"))
+            if self.replace_sleeps:
+                self.wait_for_stable_screen(timeout=secs, min_wait=min(secs * REPLACED_SLEEP_MIN_WAIT_FRACTION, 1.0))
             else:
-                # For other functions, pass the parameters as they are
-                function_to_call(**parameters)
+                sleep(secs)
+        elif function_name == 'wait_for_stable_screen':
+            self.wait_for_stable_screen(timeout=parameters.get('timeout', parameters.get('secs', 5.0)),
+                                        threshold=parameters.get('threshold'))
+        elif self.backend.has_function(function_name):
+            # Execute the corresponding Keyboard or Mouse commands through the input backend.
+            for call in self.get_input_calls(function_name, parameters):
+                self.backend.run(call)
         else:
             print(f'No such function {function_name} in our interface\'s interpreter')
+
+    def get_input_calls(self, function_name: str, parameters: dict[str, Any]) -> list[InputCall]:
+        """
+            Translates one command from the LLM into the backend calls that carry it out.
+        """
+        # Special handling for the 'write' function
+        if function_name == 'write' and ('string' in parameters or 'text' in parameters):
+            # 'write' function expects a string, not a 'text' keyword argument but LLM sometimes gets confused on the parameter name.
+            string_to_write = parameters['string'] if 'string' in parameters else parameters['text']
+            if not string_to_write:
+                return []
+            string_to_write = str(string_to_write)
+            paste_threshold = self.speed_profile['paste_threshold']
+            if paste_threshold is not None and len(string_to_write) >= paste_threshold:
+                return [InputCall('paste', (string_to_write,))]
+            return [InputCall('write', (string_to_write,), {'interval': self.get_typing_interval(parameters)})]
+        elif function_name == 'press' and ('keys' in parameters or 'key' in parameters):
+            # 'press' can take a list of keys or a single key
+            keys_to_press = parameters.get('keys') or parameters.get('key')
+            presses = parameters.get('presses', 1)
+            return [InputCall('press', (keys_to_press,),
+                              {'presses': presses, 'interval': self.get_typing_interval(parameters)})]
+        elif function_name == 'hotkey':
+            # 'hotkey' function expects multiple key arguments, not a list
+            calls = [InputCall('hotkey', tuple(parameters['keys']))]
+            if self.speed_profile['settle_delay']:
+                calls.append(InputCall('sleep', (self.speed_profile['settle_delay'],)))
+            return calls
+        else:
+            # For other functions, pass the parameters as they are
+            return [InputCall(function_name, (), dict(parameters))]
+
+    def wait_for_stable_screen(self, timeout: float = 5.0, threshold: Optional[float] = None,
+                               min_wait: float = 0.0) -> None:
+        """
+            Waits until the screen stops changing (app launched, page loaded) or timeout seconds pass, whichever is first.
+            threshold: how different two frames must be to count as changed, see utils/screen_diff.py.
+        """
+        if self.screen is None:
+            from utils.screen import Screen
+            self.screen = Screen()
+
+        kwargs = {'timeout': float(timeout), 'min_wait': float(min_wait)}
+        if threshold is not None:
+            kwargs['threshold'] = float(threshold)
+
+        start = time.monotonic()
+        settled = self.screen.wait_for_stable_screen(**kwargs)
+        print(f'Waited {time.monotonic() - start:.2f}s for the screen to '
+              f'{"settle" if settled else "settle, timed out"} (up to {timeout}s)')
+
+    def warm_up(self) -> None:
+        # Once per session is enough, it used to be done before every command.
+        self.backend.warm_up()
+        self.warmed_up = True
+
+    def get_typing_interval(self, parameters: dict[str, Any]) -> float:
+        # The LLM's interval is honored but capped, slow typing is the main cost of long writes
+        max_interval = self.speed_profile['typing_interval']
+        try:
+            return min(float(parameters.get('interval', max_interval)), max_interval)
+        except (TypeError, ValueError):
+            return max_interval
@@ -1,69 +1,253 @@
 # app/llm.py
+import json
+import threading
+import time
 from pathlib import Path
-from typing import Any
-import ollama
-from ollama import Client
-from models.factory import ModelFactory, OllamaModel
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+from models.conversation import summarize_steps
+from models.factory import DEFAULT_MODEL_BACKEND, OllamaModel
+from models.instructions import Instructions, Usage
+from models.instructions_parser import InstructionStream
+from models.registry import model_registry
 from utils import local_info
-from utils.screen import Screen
+from utils.example_index import ExampleIndex
+from utils.prompt_budget import (BudgetedPrompt, ContextSection, assemble_prompt, estimate_tokens,
+                                 get_system_prompt_budget, parse_context_sections)
+from utils.screen import EncodedScreenshot, Screen
 from utils.settings import Settings
+from utils.tracing import tracer
 
 DEFAULT_MODEL_NAME = "llama3"
+DEFAULT_BASE_URL = 'http://localhost:11434/'  # Ollama's default
+# Most past requests shown to the model as examples at step 0, and most tokens they may take, see get_examples()
+DEFAULT_FEW_SHOT_EXAMPLES = 3
+DEFAULT_FEW_SHOT_MAX_TOKENS = 400
+
+# Settings that pick the model, and those that go into the context (the system prompt)
+MODEL_SETTINGS = {'model', 'base_url', 'model_backend'}
+CONTEXT_SETTINGS = {'default_browser', 'custom_llm_instructions', 'num_ctx', 'mouse_actions'}
+
+
+class LLM:
+    """
+    Use get_llm() rather than constructing this directly, so the whole app shares one instance (and its context,
+    models and HTTP connections).
+    """
 
-class LLM(Client):
     def __init__(self):
-        self.settings_dict: dict[str, str] = Settings().get_dict()
-        model_name, base_url = self.get_settings_values()
+        self.settings = Settings()
+        model_name, base_url, backend = self.get_settings_values()
 
         self.model_name = model_name
-        context = self.read_context_txt_file()
+        self.base_url = base_url
+        self.backend = backend
+        # Built once, reading context.txt and probing the system isn't free and it has to stay byte-identical for the
+        # prompt cache
+        self.prompt: Optional[BudgetedPrompt] = None
+        self.context = self.read_context_txt_file()
+
+        self.model = model_registry.get_model(self.model_name, self.base_url, self.context, self.backend)
+
+        # Set once the model has been downloaded (if needed) and loaded, see prepare_model_in_background()
+        self.model_ready = threading.Event()
+        self.progress_callback: Optional[Callable[[str], None]] = None
+
+        # Loaded on first use, see get_example_index()
+        self.example_index: Optional[ExampleIndex] = None
+        self.example_index_lock = threading.Lock()
 
-        self.model = ModelFactory.create_model(self.model_name, base_url, context)
-        super().__init__(base_url)  # Correct usage
+        # Switch models and rebuild the context when their settings are saved, see apply_settings()
+        self.unsubscribe_from_settings = self.settings.subscribe(self.apply_settings)
         
-    def get_settings_values(self) -> tuple[str, str]:
-        model_name = self.settings_dict.get('model')
-        if not model_name:
-            model_name = DEFAULT_MODEL_NAME
+    def get_settings_values(self) -> tuple[str, str, str]:
+        model_name = self.settings.get_str('model', DEFAULT_MODEL_NAME)
+        base_url = self.settings.get_str('base_url', DEFAULT_BASE_URL).rstrip('/') + '/'
+        # 'ollama' or 'openai' for servers with an OpenAI-compatible API (llama.cpp, vLLM, ...), see models/factory.py
+        backend = self.settings.get_str('model_backend', DEFAULT_MODEL_BACKEND)
 
-        base_url = self.settings_dict.get('base_url', '')
-        if not base_url:
-            base_url = 'http://localhost:8000/'
-        base_url = base_url.rstrip('/') + '/'
+        return model_name, base_url, backend
 
-        return model_name, base_url
+    def switch_model(self, model_name: str, base_url: Optional[str] = None, backend: Optional[str] = None):
+        """
+        Hot-swaps the model without rebuilding the context. If the base URL is unchanged the same pooled connection is
+        reused, and models we've used before are picked up from the registry.
+        """
+        if base_url:
+            self.base_url = base_url.rstrip('/') + '/'
+        if backend:
+            self.backend = backend
+        self.model_name = model_name or DEFAULT_MODEL_NAME
+        self.model = model_registry.get_model(self.model_name, self.base_url, self.context, self.backend)
 
-    def switch_model(self, model_name: str):
-        model_name, base_url = self.get_settings_values()
-        context = self.read_context_txt_file()
-        self.model_name = model_name
-        self.model = ModelFactory.create_model(self.model_name, base_url, context)
+    def apply_settings(self, changed: dict[str, Any]) -> None:
+        """
+        Subscribed to Settings. A new model, server or context means a different model object (and prompt cache), which
+        is then checked for / downloaded in the background like at startup.
+        """
+        if not changed.keys() & (MODEL_SETTINGS | CONTEXT_SETTINGS):
+            return
+        if changed.keys() & CONTEXT_SETTINGS:
+            self.context = self.read_context_txt_file()
+        try:
+            self.switch_model(*self.get_settings_values())
+        except ValueError as e:
+            print(f'Unable to switch model - {e}')
+            if self.progress_callback:
+                self.progress_callback(str(e))
+            return
+        self.prepare_model_in_background(self.progress_callback)
 
-    def download_model(self, model_name: str):
+    def download_model(self, model_name: str, progress_callback: Optional[Callable[[str], None]] = None):
         if isinstance(self.model, OllamaModel):
-            self.model.download_model(model_name)
+            self.model.download_model(model_name, progress_callback)
+
+    def prepare_model_in_background(self, progress_callback: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Downloads the model if it isn't on disk yet and loads it into memory without blocking the caller, so the window
+        can show up right away. progress_callback receives human readable progress messages.
+        """
+        self.progress_callback = progress_callback
+        self.model_ready.clear()
+        threading.Thread(target=self.prepare_model, args=(progress_callback,), daemon=True).start()
+
+    def prepare_model(self, progress_callback: Optional[Callable[[str], None]] = None) -> None:
+        try:
+            self.model.prepare(progress_callback)
+        except Exception as e:
+            print(f'Error while preparing model {self.model_name} - {e}')
+            if progress_callback:
+                progress_callback(f'Unable to prepare model {self.model_name} - {e}')
+        finally:
+            self.model_ready.set()
+
+    def wait_until_model_ready(self, timeout: Optional[float] = None) -> bool:
+        return self.model_ready.wait(timeout)
 
     def read_context_txt_file(self) -> str:
-        # Construct context for the assistant by reading context.txt and adding extra system information
-        context = ''
+        """
+        Construct context for the assistant from the sections of context.txt that apply here and extra system
+        information, within the system prompt's share of the model's context window (num_ctx).
+        See utils/prompt_budget.py.
+        """
         path_to_context_file = Path(__file__).resolve().parent.joinpath('resources', 'context.txt')
         with open(path_to_context_file, 'r') as file:
-            context += file.read()
+            sections = parse_context_sections(file.read())
 
-        context += f' Locally installed apps are {",".join(local_info.locally_installed_apps)}.'
-        context += f' OS is {local_info.operating_system}.'
-        context += f' Primary screen size is {Screen().get_size()}.\n'
+        environment = f'OS is {local_info.get_operating_system()}. Primary screen size is {Screen().get_size()}.'
+        default_browser = self.settings.get_str('default_browser')
+        if default_browser:
+            environment += f'\nDefault browser is {default_browser}.'
+        custom_llm_instructions = self.settings.get_str('custom_llm_instructions')
+        if custom_llm_instructions:
+            environment += f'\nCustom user-added info: {custom_llm_instructions}.'
+        sections.append(ContextSection('environment', environment, required=True))
+        sections.append(ContextSection(
+            'installed_apps', f'Locally installed apps are {",".join(local_info.get_locally_installed_apps())}.',
+            priority=2))
 
-        if 'default_browser' in self.settings_dict.keys() and self.settings_dict['default_browser']:
-            context += f'\nDefault browser is {self.settings_dict["default_browser"]}.'
+        self.prompt = assemble_prompt(sections, get_system_prompt_budget(self.settings.get_int('num_ctx')),
+                                      local_info.get_platform_name(), self.settings.get_bool)
+        print(self.prompt.report())
+        return self.prompt.text
+    
+    def get_instructions_for_objective(self, original_user_request: str, step_num: int = 0,
+                                       screenshot: Optional[EncodedScreenshot] = None) -> Optional[Instructions]:
+        with tracer.span('llm', model=self.model_name, step_num=step_num):
+            return self.model.get_instructions_for_objective(original_user_request, step_num,
+                                                             *self.get_screenshot_attachment(screenshot),
+                                                             examples=self.get_examples(original_user_request,
+                                                                                        step_num))
 
-        if 'custom_llm_instructions' in self.settings_dict:
-            context += f'\nCustom user-added info: {self.settings_dict["custom_llm_instructions"]}.'
+    def stream_instructions_for_objective(self, original_user_request: str, step_num: int = 0,
+                                          screenshot: Optional[EncodedScreenshot] = None) -> InstructionStream:
+        start = time.perf_counter()
+        stream = self.model.stream_instructions_for_objective(original_user_request, step_num,
+                                                              *self.get_screenshot_attachment(screenshot),
+                                                              examples=self.get_examples(original_user_request,
+                                                                                         step_num))
+        return InstructionStream(self.trace_stream(stream.text_chunks, start, step_num), stream.stop_event)
 
-        return context
-    
-    def get_instructions_for_objective(self, original_user_request: str, step_num: int = 0) -> dict[str, Any]:
-        return self.model.get_instructions_for_objective(original_user_request, step_num)
+    def trace_stream(self, text_chunks: Iterable[Union[str, Usage]], start: float,
+                     step_num: int) -> Iterator[Union[str, Usage]]:
+        # The llm span of a streamed reply lasts until it's read to the end, stopped or closed, like a blocking call's
+        try:
+            yield from text_chunks
+        finally:
+            tracer.record('llm', start, model=self.model_name, step_num=step_num, stream=True)
+
+    def get_examples(self, original_user_request: str, step_num: int) -> Optional[list[dict[str, Any]]]:
+        """
+        The past successful requests most similar to this one, with the steps that completed them, to show the model
+        at step 0 (they stay in the conversation for the steps after). As many of the few_shot_examples closest ones
+        as fit in few_shot_max_tokens.
+        """
+        k = self.settings.get_int('few_shot_examples', DEFAULT_FEW_SHOT_EXAMPLES)
+        if step_num != 0 or k <= 0:
+            return None
+        with tracer.span('retrieval'):
+            budget = self.settings.get_int('few_shot_max_tokens', DEFAULT_FEW_SHOT_MAX_TOKENS)
+            examples = []
+            for similarity, example in self.get_example_index().search(original_user_request, k):
+                formatted = {
+                    'request': example['request'],
+                    'steps': [summarize_steps(batch_num, batch) for batch_num, batch in enumerate(example['batches'])],
+                    'done': example['done'],
+                }
+                tokens = estimate_tokens(json.dumps(formatted))
+                if tokens <= budget:
+                    examples.append(formatted)
+                    budget -= tokens
+        if examples:
+            print(f'Showing {len(examples)} similar past request(s) as examples')
+        return examples or None
+
+    def remember_successful_request(self, user_request: str, batches: list[list[dict[str, Any]]],
+                                    done: Optional[str]) -> None:
+        # Called by Core once a request is done, with the steps of every round trip. Writes to disk.
+        if self.settings.get_int('few_shot_examples', DEFAULT_FEW_SHOT_EXAMPLES) > 0:
+            self.get_example_index().add(user_request, batches, done)
+
+    def get_example_index(self) -> ExampleIndex:
+        with self.example_index_lock:
+            if self.example_index is None:
+                self.example_index = ExampleIndex()
+            return self.example_index
+
+    def discard_step(self, step_num: int) -> None:
+        # Drop a speculative step's request and reply from the model's conversation, see Core
+        self.model.discard_step(step_num)
+
+    def add_replayed_steps(self, step_num: int, steps: list[dict[str, Any]], source: str) -> None:
+        # Steps Core ran from the plan cache or a macro, so the model knows they're done, see models/conversation.py
+        self.model.add_replayed_steps(step_num, steps, source)
+
+    @staticmethod
+    def get_screenshot_attachment(screenshot: Optional[EncodedScreenshot]) -> tuple[Optional[list[str]], Optional[str]]:
+        # Images to attach and what to tell the LLM about them
+        if not screenshot:
+            return None, None
+        images = [screenshot.to_base64()] if screenshot.data else None
+        return images, screenshot.describe()
+
+    def get_prompt_size_report(self) -> Optional[str]:
+        # For the model's current request, if it keeps a PromptSession
+        session = getattr(self.model, 'session', None)
+        return session.get_prompt_size_report() if session else None
 
     def cleanup(self):
+        self.unsubscribe_from_settings()
         self.model.cleanup()
+        model_registry.close()
+
+
+shared_llm: Optional[LLM] = None
+shared_llm_lock = threading.Lock()
+
+
+def get_llm() -> LLM:
+    # The process-wide LLM, created on first use
+    global shared_llm
+    with shared_llm_lock:
+        if shared_llm is None:
+            shared_llm = LLM()
+        return shared_llm
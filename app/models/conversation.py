@@ -0,0 +1,128 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from utils.prompt_budget import estimate_messages_tokens
+
+# Turns that are never summarized: the step being asked for and the one before it, the model needs those verbatim
+KEEP_RECENT_TURNS = 2
+MAX_TURNS = 8
+# Once over budget, summarize down to this fraction of it, so the history (and the server's cached prefix) is only
+# rewritten every few steps rather than on every one
+COMPACT_TO_FRACTION = 0.5
+MAX_SUMMARY_LINES = 20
+MAX_PARAMETERS_CHARS = 60
+
+
+@dataclass
+class Turn:
+    step_num: int
+    request: str
+    images: Optional[list[str]] = None
+    reply: Optional[str] = None
+
+
+def compact_reply(reply: str) -> str:
+    # The reply without the whitespace models like to pretty print JSON with, which costs tokens on every later step
+    try:
+        return json.dumps(json.loads(reply), separators=(',', ':'), ensure_ascii=False)
+    except (TypeError, ValueError):
+        return reply.strip()
+
+
+def summarize_steps(step_num: int, steps: list[dict[str, Any]], source: Optional[str] = None) -> str:
+    # One line per batch, e.g. 'step 1: hotkey {"keys":["command","space"]}; write {"string":"Chrome"}'
+    descriptions = []
+    for step in steps:
+        if not isinstance(step, dict):
+            continue
+        parameters = json.dumps(step.get('parameters', {}), separators=(',', ':'), ensure_ascii=False)
+        if len(parameters) > MAX_PARAMETERS_CHARS:
+            parameters = parameters[:MAX_PARAMETERS_CHARS] + '...'
+        descriptions.append(f'{step.get("function")} {parameters}')
+    return f'step {step_num}{f" ({source})" if source else ""}: {"; ".join(descriptions) or "no steps"}'
+
+
+def summarize_turn(turn: Turn) -> str:
+    try:
+        reply = json.loads(turn.reply or '')
+        steps = reply.get('steps') or []
+    except (AttributeError, TypeError, ValueError):
+        steps = []
+    return summarize_steps(turn.step_num, steps)
+
+
+class Conversation:
+    """
+    The messages exchanged with the model for one request, after the system prompt.
+
+    Every step the model was asked for stays as a request and compact reply pair, so it knows which steps it already
+    issued. Steps that ran without asking it (replayed from the plan cache or a macro) are added to a summary. Once
+    the history is estimated to be over history_budget tokens, or has more than max_turns turns, the oldest turns are
+    folded into that summary too, one line per batch of steps. The summary is capped at MAX_SUMMARY_LINES and goes at
+    the start of the oldest remaining request, so roles keep alternating.
+    Summarizing is done here rather than by the model, which would cost a round trip of its own.
+    """
+
+    def __init__(self, history_budget: int, max_turns: int = MAX_TURNS):
+        self.history_budget = history_budget
+        self.max_turns = max_turns
+        self.turns: list[Turn] = []
+        self.summary: list[str] = []
+        self.omitted_summary_lines = 0
+
+    def start_step(self, step_num: int, request: str, images: Optional[list[str]] = None) -> None:
+        if self.turns and self.turns[-1].reply is None:
+            # Previous call never got a reply (error or retry), replace it rather than sending two user turns in a row
+            self.turns.pop()
+        for turn in self.turns:
+            # Older screenshots are stale and would make every request carry all of them
+            turn.images = None
+        self.turns.append(Turn(step_num, request, images))
+        self.compact()
+
+    def add_reply(self, reply: str) -> None:
+        if self.turns and self.turns[-1].reply is None:
+            self.turns[-1].reply = compact_reply(reply)
+
+    def add_replayed_steps(self, step_num: int, steps: list[dict[str, Any]], source: str) -> None:
+        self.add_summary_line(summarize_steps(step_num, steps, source))
+
+    def discard_step(self, step_num: int) -> None:
+        if self.turns and self.turns[-1].step_num == step_num:
+            self.turns.pop()
+
+    def get_messages(self) -> list[dict[str, Any]]:
+        messages = []
+        for index, turn in enumerate(self.turns):
+            content = turn.request
+            if index == 0 and self.summary:
+                content = f'{self.get_summary()}\n{content}'
+            message: dict[str, Any] = {'role': 'user', 'content': content}
+            if turn.images:
+                message['images'] = turn.images
+            messages.append(message)
+            if turn.reply is not None:
+                messages.append({'role': 'assistant', 'content': turn.reply})
+        return messages
+
+    def get_summary(self) -> str:
+        omitted = f'({self.omitted_summary_lines} earlier steps omitted)\n' if self.omitted_summary_lines else ''
+        return 'Earlier steps of this request, already executed:\n' + omitted + '\n'.join(self.summary)
+
+    def compact(self) -> None:
+        if len(self.turns) <= self.max_turns and self.estimate_tokens() <= self.history_budget:
+            return
+        target = self.history_budget * COMPACT_TO_FRACTION
+        while len(self.turns) > KEEP_RECENT_TURNS and (len(self.turns) > self.max_turns
+                                                       or self.estimate_tokens() > target):
+            self.add_summary_line(summarize_turn(self.turns.pop(0)))
+
+    def add_summary_line(self, line: str) -> None:
+        self.summary.append(line)
+        if len(self.summary) > MAX_SUMMARY_LINES:
+            self.summary.pop(0)
+            self.omitted_summary_lines += 1
+
+    def estimate_tokens(self) -> int:
+        return estimate_messages_tokens(self.get_messages())
@@ -1,9 +1,15 @@
+from models.model import MODEL_BACKENDS
+# Imported for their register_model_backend side effect
 from models.ollama_model import OllamaModel
+from models.openai_compatible_model import OpenAICompatibleModel
+
+DEFAULT_MODEL_BACKEND = 'ollama'
+
 
 class ModelFactory:
     @staticmethod
-    def create_model(model_name, base_url, context):
-        if model_name in ['gemma2', 'llama3', 'phi3.5', 'custom']:
-            return OllamaModel(model_name, base_url, context)
-        else:
-            raise ValueError(f'Unsupported model type {model_name}. Create entry in app/models/')
\ No newline at end of file
+    def create_model(model_name, base_url, context, backend=DEFAULT_MODEL_BACKEND):
+        model_class = MODEL_BACKENDS.get(backend or DEFAULT_MODEL_BACKEND)
+        if model_class is None:
+            raise ValueError(f'Unsupported model backend {backend}. Create entry in app/models/')
+        return model_class(model_name, base_url, context)
@@ -0,0 +1,38 @@
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+@dataclass(slots=True)
+class Usage:
+    """
+    Token counts and timings the server reported for one call. Any of them can be None if the backend doesn't say.
+    """
+    prompt_tokens: Optional[int] = None  # Prompt tokens actually evaluated, i.e. not served from the prompt cache
+    completion_tokens: Optional[int] = None
+    prompt_eval_ms: Optional[float] = None
+    eval_ms: Optional[float] = None  # Generating the completion
+    total_ms: Optional[float] = None  # Including loading the model
+
+    @property
+    def tokens_per_sec(self) -> Optional[float]:
+        if not self.completion_tokens or not self.eval_ms:
+            return None
+        return self.completion_tokens * 1000 / self.eval_ms
+
+
+@dataclass(slots=True)
+class Instructions:
+    """
+    A parsed and validated reply from the LLM, format as described in context.txt.
+    """
+    steps: list[dict[str, Any]]
+    done: Optional[str] = None
+    usage: Optional[Usage] = None
+
+    @classmethod
+    def from_dict(cls, instructions: dict[str, Any], usage: Optional[Usage] = None) -> 'Instructions':
+        return cls(instructions['steps'], instructions.get('done'), usage)
+
+    def to_dict(self) -> dict[str, Any]:
+        # The reply as the LLM sent it, e.g. for the plan cache
+        return {'steps': self.steps, 'done': self.done}
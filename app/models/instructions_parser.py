@@ -0,0 +1,265 @@
+import json
+import threading
+from typing import Any, Iterable, Iterator, Optional, Union
+
+from models.instructions import Instructions, Usage
+from models.instructions_schema import validate_instructions, validate_step
+from utils.tracing import tracer
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    Best effort fix-up of a JSON reply that json.loads rejects, for the mistakes small local models make:
+    - code fences or chatter before and after the object
+    - trailing commas before a closing bracket
+    - truncated output (hit num_predict, or the stream was cut off), which is cut back to the last complete step and
+      closed off. A half-written step is dropped rather than guessed at, we'd rather ask again than run it.
+    :return: Repaired JSON text, or None if there's nothing to salvage.
+    """
+    start_index = text.find('{')
+    if start_index == -1:
+        return None
+
+    output: list[str] = []
+    closers: list[str] = []  # Expected closing bracket for every open container
+    in_string = False
+    escaped = False
+    # (length of output, open containers) at the last point where output could be closed off without cutting a step
+    safe_point: Optional[tuple[int, list[str]]] = None
+
+    def mark_safe_point():
+        nonlocal safe_point
+        # Only between the top level keys or between the elements of an array that isn't inside a step
+        if all(closer == ']' for closer in closers[1:]):
+            safe_point = (len(output), list(closers))
+
+    for char in text[start_index:]:
+        if in_string:
+            output.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+            output.append(char)
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+            output.append(char)
+            mark_safe_point()
+        elif char in '}]':
+            while output and output[-1] in ' \t\r\n,':
+                output.pop()
+            output.append(closers.pop())
+            if not closers:
+                return ''.join(output)
+            mark_safe_point()
+        elif char == ',':
+            mark_safe_point()
+            output.append(char)
+        else:
+            output.append(char)
+
+    if safe_point is None:
+        return None
+    length, open_closers = safe_point
+    return ''.join(output[:length]).rstrip(' \t\r\n,') + ''.join(reversed(open_closers))
+
+
+def parse_json_reply(text: str) -> Optional[Any]:
+    # Well-formed replies take the fast path, anything else goes through repair_json
+    start_index = text.find('{')
+    end_index = text.rfind('}')
+    if start_index == -1:
+        return None
+
+    if end_index > start_index:
+        try:
+            return json.loads(text[start_index:end_index + 1])
+        except ValueError:
+            pass
+
+    repaired = repair_json(text)
+    if repaired is None:
+        return None
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        return None
+
+
+def parse_instructions(text: str) -> dict[str, Any]:
+    """
+    :param text: Complete reply from the LLM.
+    :return: The instructions if they're valid (see models/instructions_schema.py), otherwise {} after printing exactly
+        what was wrong with them.
+    """
+    with tracer.span('parse'):
+        instructions = parse_json_reply(text)
+        errors = validate_instructions(instructions)
+    if not errors and not instructions['steps'] and instructions.get('done') is None:
+        # Nothing to do and not done either, e.g. a reply truncated before its first step
+        errors = ['reply: no steps and not done']
+    if errors:
+        print(f'Invalid instructions from LLM - {"; ".join(errors)}')
+        return {}
+    instructions.setdefault('done', None)
+    return instructions
+
+
+class StreamingInstructionsParser:
+    """
+    Incrementally parses the LLM's JSON reply (format described in context.txt) as it is being generated.
+    Every object inside the top level "steps" array is handed back as soon as its closing brace arrives, so the
+    interpreter can start on step 1 while the model is still writing step 2.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.scan_index = 0
+
+        # Scanner state
+        self.started = False  # True once we've seen the first '{', anything before it (e.g. ```json) is ignored
+        self.in_string = False
+        self.escaped = False
+        self.container_stack: list[str] = []
+        self.string_start = 0
+        self.last_top_level_string: Optional[str] = None
+        self.inside_steps_array = False
+        self.step_start: Optional[int] = None
+
+        self.steps: list[dict[str, Any]] = []
+        # Problems with the reply. Once a step is invalid no further steps are handed out, they likely depend on it.
+        self.errors: list[str] = []
+
+    def feed(self, chunk: str) -> list[dict[str, Any]]:
+        """
+        :param chunk: Next piece of text generated by the LLM.
+        :return: Steps that were completed by this chunk, in order.
+        """
+        self.buffer += chunk
+        completed_steps = []
+
+        while self.scan_index < len(self.buffer):
+            index = self.scan_index
+            char = self.buffer[index]
+            self.scan_index += 1
+
+            if not self.started:
+                if char == '{':
+                    self.started = True
+                    self.container_stack.append('{')
+                continue
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.container_stack == ['{']:
+                        self.last_top_level_string = self.buffer[self.string_start + 1:index]
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = index
+            elif char in '{[':
+                if char == '[' and self.container_stack == ['{'] and self.last_top_level_string == 'steps':
+                    self.inside_steps_array = True
+                elif char == '{' and self.inside_steps_array and len(self.container_stack) == 2:
+                    self.step_start = index
+                self.container_stack.append(char)
+            elif char in '}]':
+                if self.container_stack:
+                    self.container_stack.pop()
+
+                if self.inside_steps_array and len(self.container_stack) == 2 and char == '}' \
+                        and self.step_start is not None:
+                    step_text = self.buffer[self.step_start:index + 1]
+                    self.step_start = None
+                    if self.errors:
+                        continue
+                    step = self.parse_step(step_text, len(self.steps))
+                    if isinstance(step, dict) and not self.errors:
+                        self.steps.append(step)
+                        completed_steps.append(step)
+                elif self.inside_steps_array and len(self.container_stack) == 1:
+                    self.inside_steps_array = False
+
+        return completed_steps
+
+    def parse_step(self, step_text: str, index: int) -> Optional[dict[str, Any]]:
+        step = parse_json_reply(step_text)
+        errors = validate_step(step, index)
+        if errors:
+            print(f'Invalid streamed step - {"; ".join(errors)}')
+            self.errors.extend(errors)
+            return None
+        return step
+
+    def get_instructions(self) -> dict[str, Any]:
+        """
+        Call after the stream is finished.
+        :return: The full instructions dict, or the steps handed out so far if the full reply isn't valid.
+        """
+        if not self.errors:
+            instructions = parse_instructions(self.buffer)
+            if instructions and instructions['steps'] == self.steps:
+                return instructions
+
+        if self.steps:
+            return {'steps': self.steps, 'done': None}
+        return {}
+
+
+class InstructionStream:
+    """
+    Iterable over the steps of an LLM reply that's still being generated.
+    Once iteration finishes, get_instructions() returns the complete reply (including "done").
+    """
+
+    def __init__(self, text_chunks: Iterable[Union[str, Usage]], stop_event: Optional[threading.Event] = None):
+        """
+        :param text_chunks: The reply piece by piece. The model may end it with the Usage the server reported.
+        :param stop_event: Set by stop(), the model checks it between chunks too.
+        """
+        self.text_chunks = text_chunks
+        self.stop_event = stop_event or threading.Event()
+        self.parser = StreamingInstructionsParser()
+        self.usage: Optional[Usage] = None
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        for chunk in self.text_chunks:
+            if self.stop_event.is_set():
+                break
+            if isinstance(chunk, Usage):
+                self.usage = chunk
+                continue
+            yield from self.parser.feed(chunk)
+            if self.parser.errors:
+                # No point generating the rest, the caller asks again
+                break
+
+    def stop(self) -> None:
+        # Safe to call from any thread: the thread reading the stream stops at the next chunk and closes it
+        self.stop_event.set()
+
+    def is_stopped(self) -> bool:
+        return self.stop_event.is_set()
+
+    def close(self) -> None:
+        # Stops generation early, e.g. when a step fails or the user interrupts. Call from the thread reading the stream.
+        if hasattr(self.text_chunks, 'close'):
+            self.text_chunks.close()
+
+    def get_instructions(self) -> Optional[Instructions]:
+        instructions = self.parser.get_instructions()
+        if not instructions:
+            return None
+        return Instructions.from_dict(instructions, self.usage)
@@ -0,0 +1,74 @@
+from typing import Any
+
+# JSON schema of the reply described in context.txt. Passed to Ollama as `format` so generation is constrained to it
+# (grammar based sampling), and used by validate_instructions() for backends that can't constrain their output.
+STEP_SCHEMA: dict[str, Any] = {
+    'type': 'object',
+    'properties': {
+        'function': {'type': 'string'},
+        'parameters': {'type': 'object'},
+        'human_readable_justification': {'type': 'string'},
+    },
+    'required': ['function', 'parameters', 'human_readable_justification'],
+}
+
+INSTRUCTIONS_SCHEMA: dict[str, Any] = {
+    'type': 'object',
+    'properties': {
+        'steps': {'type': 'array', 'items': STEP_SCHEMA},
+        'done': {'type': ['string', 'null']},
+    },
+    'required': ['steps', 'done'],
+}
+
+
+def validate_step(step: Any, index: int) -> list[str]:
+    """
+    :return: One message per problem with the step, each naming the step, e.g. 'steps[2].function: missing'.
+        Empty if the step can be executed.
+    """
+    location = f'steps[{index}]'
+    if not isinstance(step, dict):
+        return [f'{location}: expected an object, got {type(step).__name__}']
+
+    errors = []
+    function_name = step.get('function')
+    if function_name is None:
+        errors.append(f'{location}.function: missing')
+    elif not isinstance(function_name, str) or not function_name:
+        errors.append(f'{location}.function: expected a function name, got {function_name!r}')
+
+    if not isinstance(step.get('parameters', {}), dict):
+        errors.append(f'{location}.parameters: expected an object, got {type(step["parameters"]).__name__}')
+
+    justification = step.get('human_readable_justification')
+    if justification is not None and not isinstance(justification, str):
+        errors.append(f'{location}.human_readable_justification: expected a string')
+    return errors
+
+
+def validate_instructions(instructions: Any) -> list[str]:
+    """
+    Checks a parsed reply against INSTRUCTIONS_SCHEMA. Lenient where the interpreter is: parameters and
+    human_readable_justification may be left out and "done" may be missing (same as null).
+    :return: Every problem found, empty if the instructions are valid.
+    """
+    if instructions is None:
+        return ['reply: no JSON object found']
+    if not isinstance(instructions, dict):
+        return [f'reply: expected an object, got {type(instructions).__name__}']
+
+    errors = []
+    steps = instructions.get('steps')
+    if steps is None:
+        errors.append('steps: missing')
+    elif not isinstance(steps, list):
+        errors.append(f'steps: expected an array, got {type(steps).__name__}')
+    else:
+        for index, step in enumerate(steps):
+            errors.extend(validate_step(step, index))
+
+    done = instructions.get('done')
+    if done is not None and not isinstance(done, str):
+        errors.append(f'done: expected a string or null, got {type(done).__name__}')
+    return errors
@@ -1,22 +1,144 @@
-import os
-from typing import Any
+import json
+import threading
+from typing import Any, Callable, Iterator, Optional, Union
+
+from models.instructions import Instructions, Usage
+from models.instructions_parser import InstructionStream
+from models.responses import to_instructions
+from models.session import PromptSession
+from utils.prompt_budget import get_history_budget
+from utils.settings import Settings
 
 
 class Model:
+    """
+    What every backend shares: the message the model is sent for each step, the conversation it's part of (see
+    models/session.py) and turning the reply into Instructions. A backend only implements the transport -
+    send_message_to_llm(), stream_message_to_llm() if the server can stream, prepare() and warm_up() - and sets
+    self.session to create_session() once its client is set up.
+    """
+
     def __init__(self, model_name, base_url, context):
         self.model_name = model_name
         self.base_url = base_url
         self.context = context
+        self.session: Optional[PromptSession] = None
+
+    def create_session(self) -> PromptSession:
+        # num_ctx is the server's context window, the history gets what the system prompt leaves of it
+        return PromptSession(self.context, history_budget=get_history_budget(Settings().get_int('num_ctx')))
+
+    def get_instructions_for_objective(self, original_user_request: str, step_num: int = 0,
+                                       images: Optional[list[str]] = None,
+                                       screenshot_description: Optional[str] = None,
+                                       examples: Optional[list[dict[str, Any]]] = None) -> Optional[Instructions]:
+        formatted_request = self.format_user_request_for_llm(original_user_request, step_num,
+                                                             screenshot_description, examples)
+        llm_response = self.send_message_to_llm(formatted_request, step_num, images)
+        return self.convert_llm_response_to_json_instructions(llm_response)
+
+    def stream_instructions_for_objective(self, original_user_request: str, step_num: int = 0,
+                                          images: Optional[list[str]] = None,
+                                          screenshot_description: Optional[str] = None,
+                                          examples: Optional[list[dict[str, Any]]] = None) -> InstructionStream:
+        formatted_request = self.format_user_request_for_llm(original_user_request, step_num,
+                                                             screenshot_description, examples)
+        stop_event = threading.Event()
+        return InstructionStream(self.stream_message_to_llm(formatted_request, step_num, images, stop_event.is_set),
+                                 stop_event)
 
+    def format_user_request_for_llm(self, original_user_request, step_num, screenshot_file_id=None,
+                                    examples=None) -> str:
+        """
+        Formats the user request for the LLM.
 
-    def get_instructions_for_objective(self, *args) -> dict[str, Any]:
+        Args:
+            original_user_request (str): The original request from the user.
+            step_num (int): The step number in the process.
+            screenshot_file_id (str, optional): The ID of the screenshot file, or a description of the attached
+                screenshot. Defaults to None.
+            examples (list, optional): Past requests similar to this one that succeeded and their steps, see
+                LLM.get_examples(). Defaults to None.
+
+        Returns:
+            str: The formatted request as a JSON string.
+        """
+        request_data = {
+            'original_user_request': original_user_request,
+            'step_num': step_num
+        }
+        if screenshot_file_id:
+            request_data['screenshot'] = screenshot_file_id
+        if examples:
+            request_data['similar_past_requests'] = examples
+        return json.dumps(request_data)
+
+    def send_message_to_llm(self, formatted_user_request: str, step_num: int = 0,
+                            images: Optional[list[str]] = None) -> Any:
+        # The server's whole reply, or None on error
         pass
 
-    def format_user_request_for_llm(self, *args):
+    def stream_message_to_llm(self, formatted_user_request: str, step_num: int = 0,
+                              images: Optional[list[str]] = None,
+                              should_stop: Callable[[], bool] = lambda: False) -> Iterator[Union[str, Usage]]:
+        """
+        Yields the reply text piece by piece as the model generates it, then the usage the server reported.
+        should_stop is checked between chunks; once it's true the response is closed, which makes the server stop
+        generating, and the partial reply is left out of the conversation.
+        Models without streaming support hand over the whole reply as a single chunk.
+        """
+        instructions = self.convert_llm_response_to_json_instructions(
+            self.send_message_to_llm(formatted_user_request, step_num, images))
+        if instructions is None:
+            return
+        yield json.dumps(instructions.to_dict())
+        if instructions.usage:
+            yield instructions.usage
+
+    def convert_llm_response_to_json_instructions(self, llm_response: Any) -> Optional[Instructions]:
+        # The server's chat response, see models/responses.py for the shapes we understand
+        if llm_response is None:
+            return None
+        return to_instructions(llm_response)
+
+    def discard_step(self, step_num: int) -> None:
+        # Forget a request/reply pair that shouldn't stay in the conversation
+        if self.session is not None:
+            self.session.discard_step(step_num)
+
+    def add_replayed_steps(self, step_num: int, steps: list[dict[str, Any]], source: str) -> None:
+        # Steps that ran without asking the model (plan cache, macros)
+        if self.session is not None:
+            self.session.add_replayed_steps(step_num, steps, source)
+
+    def switch_model(self, model_name: str):
+        # Switch to another model on the same server, keeping the client (and its open connections) and the context
+        self.model_name = model_name
+        self.session = self.create_session()
+
+    def prepare(self, *args):
+        # Download / load the model ahead of the first request, called from a background thread
         pass
 
-    def convert_llm_response_to_json_instructions(self, *args) -> dict[str, Any]:
+    def warm_up(self) -> None:
+        # Evaluate the system prompt once so the first real request finds it in the server's prompt cache
         pass
 
     def cleanup(self, *args):
         pass
+
+
+# Backend name -> Model subclass, filled in by register_model_backend. ModelFactory picks from it with the
+# 'model_backend' setting.
+MODEL_BACKENDS: dict[str, type[Model]] = {}
+
+
+def register_model_backend(backend_name: str) -> Callable[[type[Model]], type[Model]]:
+    """
+    Class decorator that makes a Model subclass available under backend_name. To add a backend, create its module in
+    app/models/, decorate the class and import the module in models/factory.py.
+    """
+    def register(model_class: type[Model]) -> type[Model]:
+        MODEL_BACKENDS[backend_name] = model_class
+        return model_class
+    return register
@@ -1,90 +1,154 @@
 # app/models/ollama_model.py
-import json
-from typing import Any, Dict
-import ollama
-from models.model import Model
+import time
+from typing import Any, Callable, Iterator, Optional, Union
+from models.instructions import Usage
+from models.instructions_schema import INSTRUCTIONS_SCHEMA
+from models.model import Model, register_model_backend
+from models.registry import model_registry
+from models.responses import get_response_text, get_response_usage
+from models.session import PromptSession
+from utils.prompt_budget import get_history_budget
+from utils.settings import Settings
+from utils.tracing import tracer
 
+# How long Ollama keeps the model and its prompt cache loaded between calls
+KEEP_ALIVE = '30m'
+
+@register_model_backend('ollama')
 class OllamaModel(Model):
+    # Ollama constrains generation to this JSON schema, so the reply parses on the first try instead of costing a retry.
+    # Set to 'json' for servers older than 0.5 that only know plain JSON mode, or None to turn it off.
+    output_format: Any = INSTRUCTIONS_SCHEMA
+
     def __init__(self, model_name, base_url, context):
         super().__init__(model_name, base_url, context)
         self.model_name = model_name
-        self.download_model(model_name)
-
-    def get_instructions_for_objective(self, original_user_request: str, step_num: int = 0) -> Dict[str, Any]:
-        formatted_request = self.format_user_request_for_llm(original_user_request, step_num)
-        llm_response = self.send_message_to_llm(formatted_request)
-        return self.convert_llm_response_to_json_instructions(llm_response)
+        # Shared, connection pooled client for base_url
+        self.client = model_registry.get_ollama_client(base_url)
+        self.session = self.create_session()
 
-    def format_user_request_for_llm(self, original_user_request, step_num, screenshot_file_id=None) -> str:
-        """
-        Formats the user request for the LLM.
-
-        Args:
-            original_user_request (str): The original request from the user.
-            step_num (int): The step number in the process.
-            screenshot_file_id (str, optional): The ID of the screenshot file. Defaults to None.
+    def create_session(self) -> PromptSession:
+        return PromptSession(self.context, KEEP_ALIVE, get_history_budget(Settings().get_int('num_ctx')))
 
-        Returns:
-            str: The formatted request as a JSON string.
-        """
-        request_data = {
-            'original_user_request': original_user_request,
-            'step_num': step_num
-        }
-        if screenshot_file_id:
-            request_data['screenshot'] = screenshot_file_id
-        return json.dumps(request_data)
-
-    def send_message_to_llm(self, formatted_user_request: str) -> Any:
+    def send_message_to_llm(self, formatted_user_request: str, step_num: int = 0,
+                            images: Optional[list[str]] = None) -> Any:
         try:
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        'role': 'context/instructions',
-                        'content': self.context
-                    },
-                    {
-                        'role': 'user_prompt',
-                        'content': formatted_user_request
-                    },
-                     ]
-            )
+            messages = self.session.get_messages_for_step(formatted_user_request, step_num, images)
+            turn_id = self.session.turn_id
+            with tracer.span('generation', model=self.model_name):
+                response = self.client.chat(
+                    model=self.model_name,
+                    messages=messages,
+                    keep_alive=self.session.keep_alive,
+                    format=self.output_format,
+                    options=self.get_options()
+                )
+            self.session.record_usage(get_response_usage(response))
+            self.session.add_assistant_reply(get_response_text(response), turn_id)
             return response
         except Exception as e:
             print(f'Error while sending message to LLM - {e}')
             return None
 
-    def convert_llm_response_to_json_instructions(self, llm_response: Any) -> dict[str, Any]:
+    def stream_message_to_llm(self, formatted_user_request: str, step_num: int = 0,
+                              images: Optional[list[str]] = None,
+                              should_stop: Callable[[], bool] = lambda: False) -> Iterator[Union[str, Usage]]:
+        # See Model.stream_message_to_llm()
+        reply = ''
+        request_start = time.perf_counter()
+        first_token_time = None
         try:
-            if llm_response and 'choices' in llm_response and len(llm_response['choices']) > 0:
-                llm_response_data = llm_response['choices'][0]['text'].strip()
-            else:
-                print('Invalid LLM response format')
-                return {}
-        except (KeyError, IndexError) as e:
-            print(f'Error while accessing LLM response - {e}')
-            return {}
+            messages = self.session.get_messages_for_step(formatted_user_request, step_num, images)
+            turn_id = self.session.turn_id
+            chunks = self.client.chat(
+                model=self.model_name,
+                messages=messages,
+                keep_alive=self.session.keep_alive,
+                format=self.output_format,
+                options=self.get_options(),
+                stream=True
+            )
+            try:
+                for chunk in chunks:
+                    if should_stop():
+                        return
+                    content = get_response_text(chunk)
+                    if content:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
+                            tracer.record('time_to_first_token', request_start, first_token_time,
+                                          model=self.model_name)
+                        reply += content
+                        yield content
+                    usage = get_response_usage(chunk)
+                    if usage:
+                        self.session.record_usage(usage)
+                        yield usage
+            finally:
+                # Closes the HTTP response also when we stop early or our caller closes us
+                chunks.close()
+            self.session.add_assistant_reply(reply, turn_id)
+            tracer.record('generation', first_token_time or request_start, model=self.model_name,
+                          completion_chars=len(reply))
+        except Exception as e:
+            print(f'Error while streaming message from LLM - {e}')
 
-        start_index = llm_response_data.find('{')
-        end_index = llm_response_data.rfind('}')
+    @staticmethod
+    def get_options(**options: Any) -> Optional[dict[str, Any]]:
+        # The context window the system prompt was budgeted for (see utils/prompt_budget.py), or the server's default
+        # if the num_ctx setting isn't set. Every call passes the same one, Ollama reloads the model when it changes.
+        num_ctx = Settings().get_int('num_ctx')
+        if num_ctx:
+            options['num_ctx'] = num_ctx
+        return options or None
 
+    def prepare(self, progress_callback: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Makes sure the model is on disk and loaded into memory, meant to run on a background thread at startup.
+        Pulling is skipped when the model is already downloaded, which a cheap local list call tells us.
+        """
+        if not self.is_model_available(self.model_name):
+            self.download_model(self.model_name, progress_callback)
+        self.warm_up()
+
+    def is_model_available(self, model_name: str) -> bool:
         try:
-            json_response = json.loads(llm_response_data[start_index:end_index + 1].strip())
+            local_models = self.client.list()['models']
         except Exception as e:
-            print(f'Error while parsing JSON response - {e}')
-            json_response = {}
+            print(f'Error while listing local models - {e}')
+            return False
 
-        return json_response
+        local_model_names = {local_model.get('model') or local_model.get('name') for local_model in local_models}
+        return model_name in local_model_names or f'{model_name}:latest' in local_model_names
 
-    def download_model(self, model_name: str):
-        # Use ollama-python to download the model
-        progress = ollama.pull(model_name)
-        return progress
+    def download_model(self, model_name: str, progress_callback: Optional[Callable[[str], None]] = None):
+        # Use ollama-python to download the model, streaming progress so the UI can show it
+        last_reported = None
+        for progress in self.client.pull(model_name, stream=True):
+            status = progress.get('status', '')
+            completed, total = progress.get('completed'), progress.get('total')
+            message = f'Downloading {model_name} - {status}'
+            if completed and total:
+                message += f' {completed * 100 // total}%'
 
-    def switch_model(self, model_name: str):
-        # Switch to the downloaded model
-        self.model_name = model_name
+            # pull reports every few KB, only pass on changes to the message
+            if progress_callback and message != last_reported:
+                progress_callback(message)
+                last_reported = message
 
-    def cleanup(self):
-        pass
\ No newline at end of file
+        if progress_callback:
+            progress_callback(f'Downloaded {model_name}')
+
+    def warm_up(self) -> None:
+        # Loads the weights into memory and evaluates the system prompt once, so the first real request doesn't pay for
+        # either. The prompt cache keeps the system prompt for the requests that follow.
+        try:
+            self.client.chat(
+                model=self.model_name,
+                messages=[self.session.system_message],
+                keep_alive=self.session.keep_alive,
+                options=self.get_options(num_predict=1)
+            )
+            print(f'Warmed up {self.model_name}')
+        except Exception as e:
+            print(f'Error while warming up {self.model_name} - {e}')
@@ -0,0 +1,178 @@
+import json
+import os
+import time
+from typing import Any, Callable, Iterator, Optional, Union
+from urllib.parse import urlsplit
+
+from models.instructions import Usage
+from models.instructions_schema import INSTRUCTIONS_SCHEMA
+from models.model import Model, register_model_backend
+from models.registry import REQUEST_TIMEOUT_SECS, model_registry
+from models.responses import get_response_text, get_response_usage
+from utils.tracing import tracer
+
+# First bytes of the base64 encoding of each image format we send, OpenAI wants images as data URLs with a MIME type
+IMAGE_MIME_TYPES = {'/9j/': 'image/jpeg', 'iVBOR': 'image/png', 'UklGR': 'image/webp'}
+
+
+@register_model_backend('openai')
+class OpenAICompatibleModel(Model):
+    """
+    Talks to servers that implement OpenAI's /v1/chat/completions: llama.cpp's llama-server, vLLM, LM Studio, LocalAI
+    and OpenAI itself.
+
+    All calls go through one pooled httpx client per base URL (see models/registry.py), so the connection is kept alive
+    between steps and requests; with the optional h2 package installed it's HTTP/2. Streaming uses server-sent events.
+    The API key, if the server wants one, is read from the OPENAI_API_KEY environment variable.
+    """
+    # Constrain generation to the reply's schema. vLLM and llama-server both support json_schema response formats, set
+    # to None for servers that reject it.
+    response_format: Optional[dict[str, Any]] = {
+        'type': 'json_schema',
+        'json_schema': {'name': 'instructions', 'schema': INSTRUCTIONS_SCHEMA},
+    }
+
+    def __init__(self, model_name, base_url, context):
+        super().__init__(model_name, get_api_base_url(base_url), context)
+        self.model_name = model_name
+        self.client = model_registry.get_http_client(self.base_url, **self.get_client_options())
+        self.session = self.create_session()
+
+    @staticmethod
+    def get_client_options() -> dict[str, Any]:
+        options: dict[str, Any] = {'timeout': REQUEST_TIMEOUT_SECS}
+        api_key = os.environ.get('OPENAI_API_KEY')
+        if api_key:
+            options['headers'] = {'Authorization': f'Bearer {api_key}'}
+        try:
+            import h2  # noqa: F401
+            options['http2'] = True
+        except ImportError:
+            pass
+        return options
+
+    def get_request_body(self, formatted_user_request: str, step_num: int, images: Optional[list[str]],
+                         stream: bool) -> dict[str, Any]:
+        messages = self.session.get_messages_for_step(formatted_user_request, step_num, images)
+        body: dict[str, Any] = {
+            'model': self.model_name,
+            'messages': [to_openai_message(message) for message in messages],
+            'stream': stream,
+            # llama-server only reuses its KV cache for the shared prompt prefix when asked to
+            'cache_prompt': True,
+        }
+        if self.response_format:
+            body['response_format'] = self.response_format
+        if stream:
+            body['stream_options'] = {'include_usage': True}
+        return body
+
+    def send_message_to_llm(self, formatted_user_request: str, step_num: int = 0,
+                            images: Optional[list[str]] = None) -> Any:
+        try:
+            body = self.get_request_body(formatted_user_request, step_num, images, False)
+            turn_id = self.session.turn_id
+            with tracer.span('generation', model=self.model_name):
+                response = self.client.post('chat/completions', json=body)
+            response.raise_for_status()
+            response = response.json()
+            self.session.record_usage(get_response_usage(response))
+            self.session.add_assistant_reply(get_response_text(response), turn_id)
+            return response
+        except Exception as e:
+            print(f'Error while sending message to LLM - {e}')
+            return None
+
+    def stream_message_to_llm(self, formatted_user_request: str, step_num: int = 0,
+                              images: Optional[list[str]] = None,
+                              should_stop: Callable[[], bool] = lambda: False) -> Iterator[Union[str, Usage]]:
+        # See Model.stream_message_to_llm()
+        reply = ''
+        request_start = time.perf_counter()
+        first_token_time = None
+        try:
+            body = self.get_request_body(formatted_user_request, step_num, images, True)
+            turn_id = self.session.turn_id
+            with self.client.stream('POST', 'chat/completions', json=body) as response:
+                response.raise_for_status()
+                for chunk in iterate_server_sent_events(response.iter_lines()):
+                    if should_stop():
+                        # Leaving the with block closes the connection rather than reading the rest
+                        return
+                    content = get_response_text(chunk)
+                    if content:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
+                            tracer.record('time_to_first_token', request_start, first_token_time, model=self.model_name)
+                        reply += content
+                        yield content
+                    usage = get_response_usage(chunk)
+                    if usage:
+                        self.session.record_usage(usage)
+                        yield usage
+            self.session.add_assistant_reply(reply, turn_id)
+            tracer.record('generation', first_token_time or request_start, model=self.model_name,
+                          completion_chars=len(reply))
+        except Exception as e:
+            print(f'Error while streaming message from LLM - {e}')
+
+    def prepare(self, progress_callback: Optional[Callable[[str], None]] = None) -> None:
+        """
+        These servers load their model on startup and can't download one for us, so only check that the server is up
+        and warm up the prompt cache with the system prompt.
+        """
+        try:
+            response = self.client.get('models')
+            response.raise_for_status()
+        except Exception as e:
+            print(f'Error while listing models on {self.base_url} - {e}')
+            if progress_callback:
+                progress_callback(f'Unable to reach the model server at {self.base_url} - {e}')
+            return
+        self.warm_up()
+
+    def warm_up(self) -> None:
+        try:
+            response = self.client.post('chat/completions', json={
+                'model': self.model_name,
+                'messages': [self.session.system_message],
+                'max_tokens': 1,
+                'cache_prompt': True,
+            })
+            response.raise_for_status()
+            print(f'Warmed up {self.model_name}')
+        except Exception as e:
+            print(f'Error while warming up {self.model_name} - {e}')
+
+
+
+def get_api_base_url(base_url: str) -> str:
+    # "http://localhost:8080" and "http://localhost:8080/v1/" both mean the same server
+    base_url = base_url.rstrip('/') + '/'
+    if urlsplit(base_url).path in ('', '/'):
+        base_url += 'v1/'
+    return base_url
+
+
+def to_openai_message(message: dict[str, Any]) -> dict[str, Any]:
+    # PromptSession keeps Ollama's format, where images are a list of base64 strings next to the content
+    if not message.get('images'):
+        return {'role': message['role'], 'content': message['content']}
+
+    content: list[dict[str, Any]] = [{'type': 'text', 'text': message['content']}]
+    for image in message['images']:
+        mime_type = next((mime for prefix, mime in IMAGE_MIME_TYPES.items() if image.startswith(prefix)),
+                         'image/jpeg')
+        content.append({'type': 'image_url', 'image_url': {'url': f'data:{mime_type};base64,{image}'}})
+    return {'role': message['role'], 'content': content}
+
+
+def iterate_server_sent_events(lines: Iterator[str]) -> Iterator[dict[str, Any]]:
+    # Each event is a "data: {...}" line, the stream ends with "data: [DONE]". Read on to the end of the response even
+    # after that, a response that isn't read to the end can't give its connection back to the pool.
+    for line in lines:
+        if not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data and data != '[DONE]':
+            yield json.loads(data)
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import httpx
+
+# Longest wait for the server to send anything (headers or the next chunk of a stream). Generation on CPU can be slow,
+# this is only to not hang forever on a dead server; Core's step and request budgets are enforced on their own.
+REQUEST_TIMEOUT_SECS = 300
+# Model objects kept for switching back to, each holds a prompt session whose history can be large
+MAX_CACHED_MODELS = 4
+
+
+class ModelRegistry:
+    """
+    Process-wide owner of model objects and the HTTP clients they talk through.
+
+    There is one client per base URL, each backed by an httpx connection pool with keep-alive, so requests reuse open
+    connections instead of paying for TCP (and TLS) setup on every call. Model objects are cached per (backend, model,
+    base URL, context), so switching back and forth between models in settings reuses them, prompt sessions included.
+    Only the max_models most recently used are kept, every edit to the context makes a new one.
+    """
+
+    def __init__(self, max_models: int = MAX_CACHED_MODELS):
+        self.lock = threading.Lock()
+        self.max_models = max_models
+        self.clients: dict[tuple[str, str], Any] = {}
+        # Least recently used first
+        self.models: OrderedDict[tuple[str, str, str, int], Any] = OrderedDict()
+
+    def get_ollama_client(self, base_url: str):
+        import ollama
+
+        with self.lock:
+            key = ('ollama', base_url)
+            if key not in self.clients:
+                self.clients[key] = ollama.Client(host=base_url.rstrip('/'), limits=self.get_connection_limits(),
+                                                  timeout=REQUEST_TIMEOUT_SECS)
+            return self.clients[key]
+
+    def get_http_client(self, base_url: str, **kwargs) -> httpx.Client:
+        # Plain pooled client for backends that speak HTTP themselves
+        with self.lock:
+            key = ('http', base_url)
+            if key not in self.clients:
+                self.clients[key] = httpx.Client(base_url=base_url, limits=self.get_connection_limits(), **kwargs)
+            return self.clients[key]
+
+    @staticmethod
+    def get_connection_limits() -> httpx.Limits:
+        # Calls are sequential, a couple of warm connections is plenty; keep them open between steps and requests
+        return httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=300)
+
+    def get_model(self, model_name: str, base_url: str, context: str, backend: Optional[str] = None):
+        from models.factory import DEFAULT_MODEL_BACKEND, ModelFactory
+
+        backend = backend or DEFAULT_MODEL_BACKEND
+        key = (backend, model_name, base_url, hash(context))
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None:
+                self.models.move_to_end(key)
+                return model
+
+        model = ModelFactory.create_model(model_name, base_url, context, backend)
+        with self.lock:
+            model = self.models.setdefault(key, model)
+            self.models.move_to_end(key)
+            evicted = [self.models.popitem(last=False)[1] for _ in range(len(self.models) - self.max_models)]
+        for evicted_model in evicted:
+            # Whoever still holds it (e.g. a request in flight) can keep using it, its client stays pooled
+            evicted_model.cleanup()
+        return model
+
+    def close(self) -> None:
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients = {}
+            self.models = OrderedDict()
+        for client in clients:
+            # ollama.Client wraps its httpx client in _client
+            getattr(client, '_client', client).close()
+
+
+model_registry = ModelRegistry()
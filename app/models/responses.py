@@ -0,0 +1,142 @@
+"""
+Adapters from the raw responses of the backends we talk to into one typed shape.
+
+    Ollama /api/chat          {"message": {"content": ...}, "prompt_eval_count": ..., "eval_duration": ...}
+    Ollama /api/generate      {"response": ..., "prompt_eval_count": ..., "eval_duration": ...}
+    OpenAI-compatible         {"choices": [{"message": {"content": ...}}], "usage": {"prompt_tokens": ...}}
+
+Streamed chunks of each have the same shape (OpenAI puts the text in choices[0].delta instead), so the same adapters
+work for them. Fields are read straight off the response, whether it's a dict or the ollama client's response objects,
+without converting or copying it first.
+"""
+from typing import Any, Optional
+
+from models.instructions import Instructions, Usage
+from models.instructions_parser import parse_instructions
+
+
+def get_field(response: Any, name: str) -> Any:
+    if response is None:
+        return None
+    if isinstance(response, dict):
+        return response.get(name)
+    return getattr(response, name, None)
+
+
+def nanoseconds_to_ms(duration: Optional[int]) -> Optional[float]:
+    return duration / 1_000_000 if duration is not None else None
+
+
+class ResponseAdapter:
+    @staticmethod
+    def matches(response: Any) -> bool:
+        raise NotImplementedError
+
+    @staticmethod
+    def get_text(response: Any) -> Optional[str]:
+        raise NotImplementedError
+
+    @staticmethod
+    def get_usage(response: Any) -> Optional[Usage]:
+        raise NotImplementedError
+
+
+class OllamaUsageMixin:
+    @staticmethod
+    def get_usage(response: Any) -> Optional[Usage]:
+        # Only the final (done) response of a stream carries these
+        if get_field(response, 'prompt_eval_count') is None and get_field(response, 'eval_count') is None:
+            return None
+        return Usage(prompt_tokens=get_field(response, 'prompt_eval_count'),
+                     completion_tokens=get_field(response, 'eval_count'),
+                     prompt_eval_ms=nanoseconds_to_ms(get_field(response, 'prompt_eval_duration')),
+                     eval_ms=nanoseconds_to_ms(get_field(response, 'eval_duration')),
+                     total_ms=nanoseconds_to_ms(get_field(response, 'total_duration')))
+
+
+class OllamaChatAdapter(OllamaUsageMixin, ResponseAdapter):
+    @staticmethod
+    def matches(response: Any) -> bool:
+        return get_field(response, 'message') is not None
+
+    @staticmethod
+    def get_text(response: Any) -> Optional[str]:
+        return get_field(get_field(response, 'message'), 'content')
+
+
+class OllamaGenerateAdapter(OllamaUsageMixin, ResponseAdapter):
+    @staticmethod
+    def matches(response: Any) -> bool:
+        return get_field(response, 'response') is not None
+
+    @staticmethod
+    def get_text(response: Any) -> Optional[str]:
+        return get_field(response, 'response')
+
+
+class OpenAIAdapter(ResponseAdapter):
+    @staticmethod
+    def matches(response: Any) -> bool:
+        return get_field(response, 'choices') is not None
+
+    @staticmethod
+    def get_text(response: Any) -> Optional[str]:
+        choices = get_field(response, 'choices')
+        if not choices:
+            return None
+        choice = choices[0]
+        # Chat completions, streamed chat completions, legacy completions
+        for message in (get_field(choice, 'message'), get_field(choice, 'delta')):
+            if message is not None:
+                return get_field(message, 'content') or ''
+        return get_field(choice, 'text')
+
+    @staticmethod
+    def get_usage(response: Any) -> Optional[Usage]:
+        usage = get_field(response, 'usage')
+        timings = get_field(response, 'timings')  # llama.cpp's server adds these
+        if usage is None and timings is None:
+            return None
+        prompt_ms = get_field(timings, 'prompt_ms')
+        predicted_ms = get_field(timings, 'predicted_ms')
+        return Usage(prompt_tokens=get_field(timings, 'prompt_n') or get_field(usage, 'prompt_tokens'),
+                     completion_tokens=get_field(usage, 'completion_tokens') or get_field(timings, 'predicted_n'),
+                     prompt_eval_ms=prompt_ms,
+                     eval_ms=predicted_ms,
+                     total_ms=prompt_ms + predicted_ms if prompt_ms is not None and predicted_ms is not None else None)
+
+
+RESPONSE_ADAPTERS: list[type[ResponseAdapter]] = [OllamaChatAdapter, OllamaGenerateAdapter, OpenAIAdapter]
+
+
+def get_response_adapter(response: Any) -> Optional[type[ResponseAdapter]]:
+    for adapter in RESPONSE_ADAPTERS:
+        if adapter.matches(response):
+            return adapter
+    return None
+
+
+def get_response_text(response: Any) -> Optional[str]:
+    adapter = get_response_adapter(response)
+    return adapter.get_text(response) if adapter else None
+
+
+def get_response_usage(response: Any) -> Optional[Usage]:
+    adapter = get_response_adapter(response)
+    return adapter.get_usage(response) if adapter else None
+
+
+def to_instructions(response: Any) -> Optional[Instructions]:
+    """
+    :param response: Complete (non-streamed) response from any of the supported backends.
+    :return: The instructions in it, or None if the response or the reply inside it isn't valid.
+    """
+    adapter = get_response_adapter(response)
+    if adapter is None:
+        print('Invalid LLM response format')
+        return None
+
+    instructions = parse_instructions(adapter.get_text(response) or '')
+    if not instructions:
+        return None
+    return Instructions.from_dict(instructions, adapter.get_usage(response))
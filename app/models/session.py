@@ -0,0 +1,122 @@
+from collections import deque
+from typing import Any, Optional
+
+from models.conversation import Conversation
+from models.instructions import Usage
+from utils.prompt_budget import estimate_messages_tokens, estimate_tokens, get_history_budget
+from utils.tracing import tracer
+
+# Calls whose evaluated prompt tokens are kept, the session lives as long as the model
+MAX_PROMPT_EVAL_COUNTS = 1000
+
+
+class PromptSession:
+    """
+    Keeps the chat history for the request being processed so every call to the model shares one stable prefix.
+
+    The system prompt is frozen when the session is created and never rebuilt, and within a request the history only
+    grows, until it's summarized to stay within history_budget tokens (see models/conversation.py). Ollama keeps the
+    model (and its KV cache) loaded for keep_alive and only evaluates the part of the prompt that differs from what it
+    saw last, so after step 0 only the new messages (the previous reply and the new step) are processed instead of the
+    whole system prompt.
+    """
+
+    def __init__(self, system_prompt: str, keep_alive: str = '30m', history_budget: Optional[int] = None):
+        self.system_message = {'role': 'system', 'content': system_prompt}
+        self.keep_alive = keep_alive
+        self.history_budget = history_budget if history_budget is not None else get_history_budget(None)
+        self.conversation = Conversation(self.history_budget)
+
+        # (step_num, prompt tokens the server actually evaluated) for the latest calls in this process
+        self.prompt_eval_counts: deque[tuple[int, int]] = deque(maxlen=MAX_PROMPT_EVAL_COUNTS)
+        self.current_step_num = 0
+        # Goes up with every step message and discarded step. A reply is only added for the turn_id it answers, so a
+        # stream still running for a stopped request or a discarded prefetch can't end up in the conversation.
+        self.turn_id = 0
+        self.system_prompt_tokens = estimate_tokens(system_prompt)
+        # (step_num, estimated tokens, images) of each prompt sent for the current request, see get_prompt_size_report()
+        self.prompt_sizes: list[tuple[int, int, int]] = []
+
+    @property
+    def messages(self) -> list[dict[str, Any]]:
+        return [self.system_message] + self.conversation.get_messages()
+
+    def get_messages_for_step(self, formatted_user_request: str, step_num: int,
+                              images: Optional[list[str]] = None) -> list[dict[str, Any]]:
+        """
+        Appends the user message for this step and returns the full history to send.
+        Step 0 starts a fresh request, so history from the previous request is dropped (the system prompt stays).
+        images: base64 encoded screenshots to attach to this step's message. Only the latest step keeps its images,
+            older screenshots are stale and would make every request carry all of them.
+        """
+        with tracer.span('prompt_build', step_num=step_num):
+            return self.append_step_message(formatted_user_request, step_num, images)
+
+    def append_step_message(self, formatted_user_request: str, step_num: int,
+                            images: Optional[list[str]]) -> list[dict[str, Any]]:
+        if step_num == 0:
+            self.start_request()
+
+        self.current_step_num = step_num
+        self.turn_id += 1
+        self.conversation.start_step(step_num, formatted_user_request, images)
+        messages = self.messages
+        self.prompt_sizes.append((step_num, estimate_messages_tokens(messages), len(images or [])))
+        return messages
+
+    def start_request(self) -> None:
+        self.turn_id += 1
+        self.conversation = Conversation(self.history_budget)
+        self.prompt_sizes = []
+
+    def add_replayed_steps(self, step_num: int, steps: list[dict[str, Any]], source: str) -> None:
+        """
+        Tells the model about steps that ran without asking it for them, e.g. replayed from the plan cache, so it
+        doesn't issue them again. They go into the conversation's summary.
+        """
+        if step_num == 0:
+            self.start_request()
+        self.current_step_num = step_num
+        self.conversation.add_replayed_steps(step_num, steps, source)
+
+    def discard_step(self, step_num: int) -> None:
+        """
+        Forgets the user message for step_num and the reply to it, e.g. a speculative request whose guess about the
+        screen turned out wrong. Nothing happens if the last message sent wasn't for step_num.
+        """
+        if self.current_step_num != step_num:
+            return
+        self.conversation.discard_step(step_num)
+        if self.prompt_sizes and self.prompt_sizes[-1][0] == step_num:
+            self.prompt_sizes.pop()
+        self.current_step_num = step_num - 1
+        self.turn_id += 1
+
+    def add_assistant_reply(self, reply: str, turn_id: int) -> None:
+        """
+        The reply becomes part of the cached prefix for the next step.
+        turn_id: the session's turn_id right after the message it answers was added. Replies to anything but the
+            latest message are ignored.
+        """
+        if reply and turn_id == self.turn_id:
+            self.conversation.add_reply(reply)
+
+    def record_usage(self, usage: Optional[Usage]) -> None:
+        """
+        :param usage: What the server reported for the call, see models/responses.py.
+        """
+        if not usage or usage.prompt_tokens is None:
+            return
+
+        self.prompt_eval_counts.append((self.current_step_num, int(usage.prompt_tokens)))
+        estimated = f' of ~{self.prompt_sizes[-1][1]} in the prompt' if self.prompt_sizes else ''
+        print(f'Step {self.current_step_num} - prompt tokens evaluated: {usage.prompt_tokens}{estimated}')
+
+    def get_total_prompt_tokens_evaluated(self) -> int:
+        return sum(count for _, count in self.prompt_eval_counts)
+
+    def get_prompt_size_report(self) -> str:
+        # Estimated size of every prompt sent for the current request, screenshots not included
+        steps = ', '.join(f'step {step_num} ~{tokens}' + (f' + {images} image(s)' if images else '')
+                          for step_num, tokens, images in self.prompt_sizes)
+        return f'Prompt size in tokens - system ~{self.system_prompt_tokens}; {steps or "nothing sent"}'
@@ -2,27 +2,44 @@
 import threading
 import tkinter as tk
 import webbrowser
-from multiprocessing import Queue
 from pathlib import Path
 from tkinter import ttk
 
-import speech_recognition as sr
 from PIL import Image, ImageTk
 
-from llm import LLM
+from utils.event_bus import (CoalescingSubscriber, ErrorOccurred, Event, EventBus, StatusUpdate, StepStarted,
+                             StopRequested, UserRequestSubmitted)
 from utils.settings import Settings
 from version import version
 
 def open_link(url) -> None:
     webbrowser.open_new(url)
 
+# How often status updates from Core are drawn, at most one repaint per frame however many arrive in between
+STATUS_REFRESH_MS = 16
+
+
 class UI:
-    def __init__(self):
-        self.main_window = self.MainWindow()
+    def __init__(self, event_bus: EventBus):
+        self.main_window = self.MainWindow(event_bus)
+
+        # Events arrive on Core's threads, only the latest one is drawn on the next frame on Tk's main thread
+        self.status_subscriber = CoalescingSubscriber(self.display_status_event)
+        for event_type in (StatusUpdate, StepStarted, ErrorOccurred):
+            event_bus.subscribe(event_type, self.status_subscriber)
 
     def run(self) -> None:
+        self.main_window.after(STATUS_REFRESH_MS, self.refresh_status)
         self.main_window.mainloop()
 
+    def refresh_status(self) -> None:
+        self.status_subscriber.flush()
+        self.main_window.after(STATUS_REFRESH_MS, self.refresh_status)
+
+    def display_status_event(self, event: Event) -> None:
+        if event.status_text is not None:
+            self.display_current_status(event.status_text)
+
     def display_current_status(self, text: str):
         self.main_window.update_message(text)
 
@@ -43,6 +60,7 @@ class UI:
 
             if 'base_url' in settings_dict:
                 self.base_url_entry.insert(0, settings_dict['base_url'])
+            self.backend_var.set(settings_dict.get('model_backend') or 'ollama')
             DEFAULT_MODEL_NAME = 'gemma2'
             
             if 'model' in settings_dict:
@@ -52,6 +70,10 @@ class UI:
                 self.model_entry.insert(0, DEFAULT_MODEL_NAME)
                 self.model_var.set(DEFAULT_MODEL_NAME)
 
+            for setting_name, entry in self.budget_entries.items():
+                if setting_name in settings_dict:
+                    entry.insert(0, str(settings_dict[setting_name]))
+
         def create_widgets(self) -> None:
             # Radio buttons for model selection
             tk.Label(self, text='Select Model:').pack(pady=10, padx=10)
@@ -70,7 +92,19 @@ class UI:
             for text, value in models:
                 ttk.Radiobutton(radio_frame, text=text, value=value, variable=self.model_var).pack(anchor=tk.W)
 
-            label_base_url = tk.Label(self, text='Custom OpenAI-Like API Model Base URL')
+            # Radio buttons for the kind of server the model runs on
+            tk.Label(self, text='Model Server:').pack(pady=10, padx=10)
+            self.backend_var = tk.StringVar(value='ollama')
+            backend_frame = ttk.Frame(self)
+            backend_frame.pack(padx=20)
+            backends = [
+                ('Ollama', 'ollama'),
+                ('OpenAI-Like API (llama.cpp, vLLM, LM Studio)', 'openai'),
+            ]
+            for text, value in backends:
+                ttk.Radiobutton(backend_frame, text=text, value=value, variable=self.backend_var).pack(anchor=tk.W)
+
+            label_base_url = tk.Label(self, text='Custom Model Server Base URL')
             label_base_url.pack(pady=10)
 
             # Entry for Base URL
@@ -85,6 +119,19 @@ class UI:
             self.model_entry = ttk.Entry(self, width=30)
             self.model_entry.pack()
 
+            # Entries for per-request budgets, left empty to use the defaults
+            self.budget_entries: dict[str, ttk.Entry] = {}
+            budgets = [
+                ('Max LLM Round Trips per Request:', 'max_steps'),
+                ('Request Timeout (seconds):', 'request_timeout_secs'),
+                ('Round Trip Timeout (seconds):', 'step_timeout_secs'),
+            ]
+            for text, setting_name in budgets:
+                tk.Label(self, text=text).pack(pady=(10, 0))
+                entry = ttk.Entry(self, width=10)
+                entry.pack()
+                self.budget_entries[setting_name] = entry
+
             # Save Button
             save_button = ttk.Button(self, text='Save Settings', command=self.save_button)
             save_button.pack(pady=20)
@@ -92,15 +139,21 @@ class UI:
         def save_button(self):
             base_url = self.base_url_entry.get().strip()
             model = self.model_var.get() if self.model_var.get() != 'custom' else self.model_entry.get().strip()
+            backend = self.backend_var.get()
             settings_dict = {
                 'base_url': base_url,
                 'model': model,
+                'model_backend': backend,
             }
-            try:
-                LLM().switch_model(model)
-            except ValueError as e:
-                LLM().download_model(model)
-                LLM().switch_model(model)
+            for setting_name, entry in self.budget_entries.items():
+                value = entry.get().strip()
+                if value:
+                    try:
+                        settings_dict[setting_name] = float(value) if '.' in value else int(value)
+                    except ValueError:
+                        pass
+            # The shared LLM switches to the new model and checks for / downloads it in the background on its own, with
+            # progress shown in the main window, see LLM.apply_settings()
             self.settings.save_settings_to_file(settings_dict)
             self.destroy()
 
@@ -192,7 +245,7 @@ class UI:
             UI.AdvancedSettingsWindow(self)
 
     class MainWindow(tk.Tk):
-        def __init__(self):
+        def __init__(self, event_bus: EventBus):
             super().__init__()
             self.title('Open Interface')
             self.minsize(420, 250)
@@ -206,10 +259,9 @@ class UI:
             # This adds app icon in linux which pyinstaller can't
             self.tk.call('wm', 'iconphoto', self._w, self.logo_img)
 
-            # MP Queue to facilitate communication between UI and Core.
-            # Put user requests received from UI text box into this queue which will then be dequeued in App to be sent
-            # to core.
-            self.user_request_queue = Queue()
+            # User requests received from the UI text box and stop button are published here, App passes them on to
+            # Core.
+            self.event_bus = event_bus
 
             self.create_widgets()
 
@@ -261,8 +313,8 @@ class UI:
             UI.SettingsWindow(self)
 
         def stop_previous_request(self) -> None:
-            # Interrupt currently running request by queueing a stop signal.
-            self.user_request_queue.put('stop')
+            # Interrupt currently running request by publishing a stop signal.
+            self.event_bus.publish(StopRequested())
 
         def display_input(self) -> str:
             # Get the entry and update the input display
@@ -275,7 +327,7 @@ class UI:
             return user_input.strip()
 
         def execute_user_request(self) -> None:
-            # Puts the user request received from the UI into the MP queue being read in App to be sent to Core.
+            # Publishes the user request received from the UI, App sends it on to Core.
             user_request = self.display_input()
 
             if user_request == '' or user_request is None:
@@ -283,7 +335,7 @@ class UI:
 
             self.update_message('Fetching Instructions')
 
-            self.user_request_queue.put(user_request)
+            self.event_bus.publish(UserRequestSubmitted(user_request))
 
         def start_voice_input_thread(self) -> None:
             # Start voice input in a separate thread
@@ -291,6 +343,7 @@ class UI:
 
         def voice_input(self) -> None:
             # Function to handle voice input
+            import speech_recognition as sr  # Slow to import and only needed once the mic button is pressed
             recognizer = sr.Recognizer()
             with sr.Microphone() as source:
                 self.update_message('Listening...')
@@ -0,0 +1,136 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, TypeVar
+
+
+@dataclass(slots=True)
+class Event:
+    timestamp: float = field(default_factory=time.monotonic, kw_only=True)
+
+    @property
+    def status_text(self) -> Optional[str]:
+        # What the UI shows for this event, None for events it doesn't show
+        return None
+
+
+@dataclass(slots=True)
+class StatusUpdate(Event):
+    message: str
+
+    @property
+    def status_text(self) -> Optional[str]:
+        return self.message
+
+
+@dataclass(slots=True)
+class ErrorOccurred(Event):
+    message: str
+
+    @property
+    def status_text(self) -> Optional[str]:
+        return f'Error: {self.message}'
+
+
+@dataclass(slots=True)
+class StepStarted(Event):
+    function: str
+    parameters: dict[str, Any]
+    justification: Optional[str] = None
+
+    @property
+    def status_text(self) -> Optional[str]:
+        return self.justification
+
+
+@dataclass(slots=True)
+class StepFinished(Event):
+    function: str
+    succeeded: bool
+    duration_secs: float  # For keyboard commands sent to the backend as one batch, the whole batch's time
+
+
+@dataclass(slots=True)
+class RequestFinished(Event):
+    result: Any  # core.RequestResult
+
+
+@dataclass(slots=True)
+class UserRequestSubmitted(Event):
+    user_request: str
+
+
+@dataclass(slots=True)
+class StopRequested(Event):
+    pass
+
+
+EventType = TypeVar('EventType', bound=Event)
+
+
+class EventBus:
+    """
+    In-process publish/subscribe between the UI, Core and anything else that wants to follow along (logging, metrics).
+    Replaces the multiprocessing Queues they used to talk through; everything runs in one process, so events are
+    passed as they are instead of being pickled through a pipe.
+
+    Subscribers are called right away on the publishing thread, in the order they subscribed, and get every event of
+    the type they subscribed to or a subclass of it. They should be quick, a subscriber that needs a particular thread
+    (Tk's main thread) or doesn't need every event should use a CoalescingSubscriber.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: dict[type[Event], list[Callable[[Any], None]]] = {}
+
+    def subscribe(self, event_type: type[EventType], callback: Callable[[EventType], None]) -> Callable[[], None]:
+        # Returns a function that unsubscribes the callback again
+        with self.lock:
+            self.subscribers[event_type] = self.subscribers.get(event_type, []) + [callback]
+
+        def unsubscribe() -> None:
+            with self.lock:
+                callbacks = [subscriber for subscriber in self.subscribers.get(event_type, [])
+                             if subscriber is not callback]
+                self.subscribers[event_type] = callbacks
+        return unsubscribe
+
+    def publish(self, event: Event) -> None:
+        with self.lock:
+            # Lists are replaced rather than changed, so subscribing from a callback doesn't affect this event
+            callbacks = [callback for event_type in type(event).__mro__
+                         for callback in self.subscribers.get(event_type, [])]
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f'Error in {type(event).__name__} subscriber {callback} - {e}')
+
+
+class CoalescingSubscriber:
+    """
+    Holds on to the latest event it was given until flush() passes it to callback, dropping the ones before it.
+    The UI flushes once per frame on Tk's main thread, so a burst of status updates from a long list of steps costs
+    one repaint instead of one per update.
+    """
+
+    def __init__(self, callback: Callable[[Event], None]):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.pending: Optional[Event] = None
+        self.dropped = 0  # Events replaced before they were flushed
+
+    def __call__(self, event: Event) -> None:
+        with self.lock:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = event
+
+    def flush(self) -> bool:
+        # Returns whether there was an event to pass on
+        with self.lock:
+            event, self.pending = self.pending, None
+        if event is None:
+            return False
+        self.callback(event)
+        return True
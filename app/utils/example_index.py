@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+from utils.files import atomic_write, atomic_write_json
+from utils.plan_cache import normalize_request
+
+DIMENSIONS = 512
+DEFAULT_MAX_EXAMPLES = 500
+# Cosine similarity below which a past request isn't similar enough to be worth its tokens as an example
+DEFAULT_MIN_SIMILARITY = 0.35
+
+# Words that say nothing about what a request is for
+STOP_WORDS = {'a', 'an', 'and', 'at', 'can', 'for', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'please', 'the', 'to',
+              'with', 'you'}
+
+
+def get_features(text: str) -> list[str]:
+    # Words and pairs of neighbouring words, so "open chrome" and "chrome open" aren't quite the same request
+    words = [word for word in re.findall(r'[a-z0-9]+', normalize_request(text)) if word not in STOP_WORDS]
+    return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+
+def vectorize(text: str) -> np.ndarray:
+    """
+    Hashed bag of words: every feature adds +1 or -1 (also picked by its hash) to one of DIMENSIONS buckets, and the
+    vector is normalized so a dot product is the cosine similarity. Needs no vocabulary or model, and is stable across
+    runs and Python versions unlike hash().
+    """
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for feature in get_features(text):
+        digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+        vector[digest % DIMENSIONS] += 1.0 if digest >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ExampleIndex:
+    """
+    Past requests that completed successfully and the steps that did it, one batch of steps per LLM round trip,
+    searchable by similarity to a new request. The LLM shows the closest ones to the model as examples, see
+    LLM.get_examples().
+
+    Stored in ~/.open-interface/examples/ as vectors.npy, one vectorize()d request per row, and examples.json with the
+    request, steps and result for each row. A newer run of the same request replaces the older one, and the oldest
+    examples are dropped past max_examples.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_examples: int = DEFAULT_MAX_EXAMPLES):
+        if directory is None:
+            from utils.settings import Settings
+            directory = os.path.join(Settings().get_settings_directory_path(), 'examples')
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, 'vectors.npy')
+        self.metadata_path = os.path.join(directory, 'examples.json')
+        self.max_examples = max_examples
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # So the two files of concurrent saves can't get mixed up
+
+        self.vectors = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        self.examples: list[dict[str, Any]] = []  # Row i of vectors is examples[i], oldest first
+        self.load()
+
+    def add(self, user_request: str, batches: list[list[dict[str, Any]]], done: Optional[str]) -> None:
+        if not any(batches):
+            return
+        request = normalize_request(user_request)
+        # The justifications are for the user, they'd only cost tokens in an example
+        batches = [[{'function': step.get('function'), 'parameters': step.get('parameters', {})} for step in batch]
+                   for batch in batches]
+        example = {'request': request, 'batches': batches, 'done': done, 'created': time.time()}
+
+        with self.lock:
+            keep = [index for index, other in enumerate(self.examples) if other['request'] != request]
+            keep = keep[len(keep) - self.max_examples + 1:] if len(keep) >= self.max_examples else keep
+            self.examples = [self.examples[index] for index in keep] + [example]
+            self.vectors = np.vstack([self.vectors[keep], vectorize(request)[None, :]])
+        self.save()
+
+    def search(self, user_request: str, k: int,
+               min_similarity: float = DEFAULT_MIN_SIMILARITY) -> list[tuple[float, dict[str, Any]]]:
+        # Up to k (similarity, example) pairs, most similar first
+        with self.lock:
+            if not self.examples or k <= 0:
+                return []
+            similarities = self.vectors @ vectorize(user_request)
+            closest = np.argsort(-similarities, kind='stable')[:k]
+            return [(float(similarities[index]), self.examples[index]) for index in closest
+                    if similarities[index] >= min_similarity]
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def load(self) -> None:
+        if not os.path.exists(self.metadata_path) or not os.path.exists(self.vectors_path):
+            return
+        try:
+            with open(self.metadata_path, 'r') as file:
+                examples = json.load(file)
+            vectors = np.load(self.vectors_path)
+            if vectors.shape != (len(examples), DIMENSIONS):
+                raise ValueError(f'{vectors.shape[0]} vectors for {len(examples)} examples')
+            self.examples, self.vectors = examples[-self.max_examples:], vectors[-self.max_examples:]
+        except Exception as e:
+            print(f'Ignoring unreadable example index {self.directory} - {e}')
+
+    def save(self) -> None:
+        # Both files are written atomically, so a crash mid-write can't leave a corrupt index behind
+        with self.save_lock:
+            with self.lock:
+                examples, vectors = list(self.examples), self.vectors
+            self.write(examples, vectors)
+
+    def write(self, examples: list[dict[str, Any]], vectors: np.ndarray) -> None:
+        try:
+            atomic_write(self.vectors_path, lambda file: np.save(file, vectors), binary=True)
+            atomic_write_json(self.metadata_path, examples, separators=(',', ':'))
+        except Exception as e:
+            print(f'Unable to save example index - {e}')
@@ -0,0 +1,27 @@
+import json
+import os
+import tempfile
+from typing import IO, Any, Callable
+
+
+def atomic_write(file_path: str, write: Callable[[IO], None], binary: bool = False) -> None:
+    """
+    Writes file_path through write(file) so that readers, a crash mid-write or another thread saving the same file at
+    the same time never leave a half-written file behind: write goes to a uniquely named temp file in the same
+    directory, which then replaces file_path in one rename. Creates the directory if needed, errors are raised.
+    """
+    directory = os.path.dirname(file_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb' if binary else 'w', dir=directory, delete=False, suffix='.tmp') as file:
+        try:
+            write(file)
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+    os.replace(file.name, file_path)
+
+
+def atomic_write_json(file_path: str, data: Any, **json_options: Any) -> None:
+    # json_options are passed on to json.dump, e.g. indent or separators
+    atomic_write(file_path, lambda file: json.dump(data, file, **json_options))
@@ -0,0 +1,243 @@
+"""
+Input backends the Interpreter sends keyboard and mouse calls through.
+
+Calls use pyautogui's function names and arguments (that's what the LLM is told to emit in context.txt), every backend
+translates them to its own mechanism:
+    - PyAutoGUIBackend: the real thing, one pyautogui call per event.
+    - RecordingBackend: headless, keeps an in-memory log of calls with timestamps. For tests and benchmarks.
+    - XdotoolBackend: Linux/X11, can send a whole list of events to a single xdotool process.
+"""
+import platform
+import shlex
+import subprocess
+import time
+from typing import Any, NamedTuple, Optional
+
+KEYBOARD_FUNCTIONS = {'write', 'typewrite', 'press', 'hotkey', 'keyDown', 'keyUp', 'paste'}
+MOUSE_FUNCTIONS = {'moveTo', 'moveRel', 'move', 'click', 'doubleClick', 'tripleClick', 'rightClick', 'middleClick',
+                   'mouseDown', 'mouseUp', 'dragTo', 'dragRel', 'drag', 'scroll', 'hscroll', 'vscroll'}
+
+
+class InputCall(NamedTuple):
+    function_name: str
+    args: tuple = ()
+    kwargs: dict[str, Any] = {}
+
+
+class InputBackend:
+    # Whether run_batch() is cheaper than calling run() for each call
+    supports_batching = False
+
+    def has_function(self, function_name: str) -> bool:
+        return function_name in KEYBOARD_FUNCTIONS or function_name in MOUSE_FUNCTIONS
+
+    def run(self, call: InputCall) -> None:
+        if call.function_name == 'sleep':
+            time.sleep(*call.args)
+        elif call.function_name == 'paste':
+            self.paste(*call.args)
+        else:
+            self.run_function(call)
+
+    def run_batch(self, calls: list[InputCall]) -> None:
+        for call in calls:
+            self.run(call)
+
+    def run_function(self, call: InputCall) -> None:
+        raise NotImplementedError
+
+    def paste(self, text: str) -> None:
+        # Put the text on the clipboard and paste it in one keystroke, restoring whatever the user had copied after.
+        try:
+            import pyperclip
+        except ImportError:
+            self.run_function(InputCall('write', (text,), {'interval': 0}))
+            return
+
+        previous_clipboard = pyperclip.paste()
+        pyperclip.copy(text)
+        paste_modifier = 'command' if platform.system() == 'Darwin' else 'ctrl'
+        self.run_function(InputCall('hotkey', (paste_modifier, 'v')))
+        # The target app reads the clipboard asynchronously, give it a moment before restoring it
+        time.sleep(0.1)
+        pyperclip.copy(previous_clipboard)
+
+    def set_pause(self, pause: float) -> None:
+        pass
+
+    def warm_up(self) -> None:
+        pass
+
+    def size(self) -> tuple[int, int]:
+        raise NotImplementedError
+
+
+class PyAutoGUIBackend(InputBackend):
+    def __init__(self):
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def has_function(self, function_name: str) -> bool:
+        return function_name == 'paste' or hasattr(self.pyautogui, function_name)
+
+    def run_function(self, call: InputCall) -> None:
+        getattr(self.pyautogui, call.function_name)(*call.args, **call.kwargs)
+
+    def set_pause(self, pause: float) -> None:
+        self.pyautogui.PAUSE = pause
+
+    def warm_up(self) -> None:
+        # Sometimes pyautogui needs warming up i.e. sometimes first call isn't executed hence padding a random call here.
+        self.pyautogui.press("command", interval=0.2)
+
+    def size(self) -> tuple[int, int]:
+        return self.pyautogui.size()
+
+
+class RecordedInputEvent(NamedTuple):
+    timestamp: float  # time.perf_counter() when the backend received the call
+    call: InputCall
+    batch_index: Optional[int]  # Which run_batch() call delivered it, None if it was sent on its own
+
+
+class RecordingBackend(InputBackend):
+    """
+    Doesn't touch the real keyboard or mouse, just logs what would have been sent.
+    """
+    supports_batching = True
+
+    def __init__(self, screen_size: tuple[int, int] = (1920, 1080), simulate_sleeps: bool = False):
+        self.screen_size = screen_size
+        self.simulate_sleeps = simulate_sleeps
+        self.events: list[RecordedInputEvent] = []
+        self.batch_count = 0
+        self.current_batch: Optional[int] = None
+
+    def run(self, call: InputCall) -> None:
+        self.events.append(RecordedInputEvent(time.perf_counter(), call, self.current_batch))
+        if call.function_name == 'sleep' and self.simulate_sleeps:
+            time.sleep(*call.args)
+
+    def run_batch(self, calls: list[InputCall]) -> None:
+        self.current_batch = self.batch_count
+        self.batch_count += 1
+        try:
+            super().run_batch(calls)
+        finally:
+            self.current_batch = None
+
+    def get_function_names(self) -> list[str]:
+        return [event.call.function_name for event in self.events]
+
+    def clear(self) -> None:
+        self.events = []
+        self.batch_count = 0
+
+    def size(self) -> tuple[int, int]:
+        return self.screen_size
+
+
+# pyautogui key names that are named differently in X11 keysyms
+XDOTOOL_KEY_NAMES = {
+    'enter': 'Return', 'return': 'Return', '\n': 'Return', 'esc': 'Escape', 'escape': 'Escape', 'tab': 'Tab',
+    '\t': 'Tab', 'space': 'space', ' ': 'space', 'backspace': 'BackSpace', 'delete': 'Delete', 'del': 'Delete',
+    'up': 'Up', 'down': 'Down', 'left': 'Left', 'right': 'Right', 'home': 'Home', 'end': 'End',
+    'pageup': 'Prior', 'pgup': 'Prior', 'pagedown': 'Next', 'pgdn': 'Next', 'insert': 'Insert',
+    'command': 'super', 'cmd': 'super', 'win': 'super', 'winleft': 'super', 'option': 'alt', 'altleft': 'alt',
+    'ctrlleft': 'ctrl', 'shiftleft': 'shift', 'capslock': 'Caps_Lock',
+}
+XDOTOOL_MOUSE_BUTTONS = {'left': '1', 'middle': '2', 'right': '3'}
+
+
+class XdotoolBackend(InputBackend):
+    """
+    Linux (X11) backend that shells out to xdotool.
+    A batch is sent as one xdotool script on stdin, so a whole step list costs one process launch instead of one
+    round trip through pyautogui/Xlib per key.
+    """
+    supports_batching = True
+
+    def __init__(self, typing_delay_ms: int = 0):
+        self.typing_delay_ms = typing_delay_ms
+
+    def has_function(self, function_name: str) -> bool:
+        return function_name in {'write', 'typewrite', 'press', 'hotkey', 'keyDown', 'keyUp', 'paste', 'moveTo',
+                                 'click', 'doubleClick', 'rightClick', 'scroll'}
+
+    def run_function(self, call: InputCall) -> None:
+        subprocess.run(['xdotool', *self.to_xdotool_args(call)], check=True)
+
+    def run_batch(self, calls: list[InputCall]) -> None:
+        script_lines = []
+        for call in calls:
+            if call.function_name == 'sleep':
+                script_lines.append(f'sleep {float(call.args[0])}')
+            else:
+                script_lines.append(' '.join(shlex.quote(arg) for arg in self.to_xdotool_args(call)))
+        subprocess.run(['xdotool', '-'], input='\n'.join(script_lines) + '\n', text=True, check=True)
+
+    def paste(self, text: str) -> None:
+        # xdotool types a whole string in a single command, as fast as a paste and without touching the clipboard
+        self.run_function(InputCall('write', (text,)))
+
+    def to_xdotool_args(self, call: InputCall) -> list[str]:
+        name, args, kwargs = call
+        if name in ('write', 'typewrite', 'paste'):
+            message = args[0] if args else kwargs.get('message', '')
+            interval = kwargs.get('interval', args[1] if len(args) > 1 else 0)
+            delay = max(self.typing_delay_ms, int(float(interval) * 1000))
+            return ['type', '--delay', str(delay), '--', message]
+        if name == 'press':
+            keys = args[0] if args else kwargs.get('keys')
+            keys = [keys] if isinstance(keys, str) else list(keys)
+            presses = int(kwargs.get('presses', 1))
+            interval = float(kwargs.get('interval', 0))
+            return ['key', '--delay', str(int(interval * 1000))] + [self.key_name(key) for key in keys] * presses
+        if name == 'hotkey':
+            return ['key', '+'.join(self.key_name(key) for key in args)]
+        if name in ('keyDown', 'keyUp'):
+            return [name.lower(), self.key_name(args[0] if args else kwargs['key'])]
+        if name == 'moveTo':
+            x, y = (args + (None, None))[:2] if args else (kwargs.get('x'), kwargs.get('y'))
+            return ['mousemove', str(int(x)), str(int(y))]
+        if name in ('click', 'doubleClick', 'rightClick'):
+            x, y = kwargs.get('x', args[0] if args else None), kwargs.get('y', args[1] if len(args) > 1 else None)
+            button = {'rightClick': 'right'}.get(name, kwargs.get('button', 'left'))
+            repeat = {'doubleClick': 2}.get(name, int(kwargs.get('clicks', 1)))
+            move = ['mousemove', str(int(x)), str(int(y))] if x is not None and y is not None else []
+            return move + ['click', '--repeat', str(repeat), XDOTOOL_MOUSE_BUTTONS.get(button, '1')]
+        if name == 'scroll':
+            clicks = int(args[0] if args else kwargs['clicks'])
+            # X11 scrolls with buttons 4 (up) and 5 (down)
+            return ['click', '--repeat', str(abs(clicks)), '4' if clicks > 0 else '5']
+        raise ValueError(f'xdotool backend does not support {name}')
+
+    @staticmethod
+    def key_name(key: str) -> str:
+        if key in XDOTOOL_KEY_NAMES:
+            return XDOTOOL_KEY_NAMES[key]
+        if key.lower() in XDOTOOL_KEY_NAMES:
+            return XDOTOOL_KEY_NAMES[key.lower()]
+        if len(key) > 1 and key[0] in 'fF' and key[1:].isdigit():
+            return key.upper()
+        return key
+
+    def size(self) -> tuple[int, int]:
+        output = subprocess.run(['xdotool', 'getdisplaygeometry'], capture_output=True, text=True, check=True).stdout
+        width, height = output.split()
+        return int(width), int(height)
+
+
+INPUT_BACKENDS = {
+    'pyautogui': PyAutoGUIBackend,
+    'recording': RecordingBackend,
+    'xdotool': XdotoolBackend,
+}
+DEFAULT_INPUT_BACKEND = 'pyautogui'
+
+
+def create_input_backend(name: Optional[str] = None) -> InputBackend:
+    backend_class = INPUT_BACKENDS.get(name or DEFAULT_INPUT_BACKEND)
+    if backend_class is None:
+        raise ValueError(f'Unsupported input backend {name}. Choose one of {", ".join(INPUT_BACKENDS)}')
+    return backend_class()
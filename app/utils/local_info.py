@@ -1,12 +1,70 @@
 import os
 import platform
+import subprocess
+import sys
+from functools import lru_cache
+from typing import Optional
 
 """
-List the apps the user has locally, default browsers, etc. 
+List the apps the user has locally, default browsers, etc.
+Probed on first call rather than at import, LLM builds the context from these on Core's startup thread.
 """
-try:
-    locally_installed_apps: list[str] = [app for app in os.listdir('/Applications') if app.endswith('.app')]
-except:
-    locally_installed_apps: list[str] = ["Unknown"]
 
-operating_system: str = platform.platform()
+
+@lru_cache(maxsize=None)
+def get_locally_installed_apps() -> list[str]:
+    try:
+        return [app for app in os.listdir('/Applications') if app.endswith('.app')]
+    except:
+        return ["Unknown"]
+
+
+@lru_cache(maxsize=None)
+def get_operating_system() -> str:
+    return platform.platform()
+
+
+def get_platform_name() -> str:
+    # darwin, windows or linux, matched against the os= of context.txt's sections
+    return 'windows' if sys.platform.startswith('win') else sys.platform.rstrip('0123456789')
+
+
+def get_foreground_app() -> Optional[str]:
+    """
+    Name of the application in the foreground (its executable on Windows and Linux), None if it can't be told, e.g. on
+    Linux without xdotool. Not cached, it changes all the time. Macros check it before replaying keystrokes into it.
+    """
+    try:
+        if sys.platform == 'darwin':
+            script = 'tell application "System Events" to get name of first application process whose frontmost is true'
+            name = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=2).stdout
+        elif sys.platform.startswith('win'):
+            name = get_foreground_windows_executable()
+        else:
+            pid = subprocess.run(['xdotool', 'getactivewindow', 'getwindowpid'], capture_output=True, text=True,
+                                 timeout=2).stdout.strip()
+            with open(f'/proc/{int(pid)}/comm', 'r') as file:
+                name = file.read()
+        return name.strip() or None
+    except Exception:
+        return None
+
+
+def get_foreground_windows_executable() -> str:
+    import ctypes
+    from ctypes import wintypes
+
+    user32, kernel32 = ctypes.windll.user32, ctypes.windll.kernel32
+    pid = wintypes.DWORD()
+    user32.GetWindowThreadProcessId(user32.GetForegroundWindow(), ctypes.byref(pid))
+    process = kernel32.OpenProcess(0x1000, False, pid.value)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not process:
+        return ''
+    try:
+        buffer = ctypes.create_unicode_buffer(260)
+        size = wintypes.DWORD(len(buffer))
+        if not kernel32.QueryFullProcessImageNameW(process, 0, buffer, ctypes.byref(size)):
+            return ''
+        return os.path.basename(buffer.value)
+    finally:
+        kernel32.CloseHandle(process)
@@ -0,0 +1,135 @@
+"""
+Macros are recordings of requests that completed successfully: for every LLM round trip, the screen it started from
+(as a perceptual hash), the application that was in the foreground and the steps that were executed. Replaying one
+re-runs the steps directly through the Interpreter, checking before each batch that the same application is in front
+and the screen still looks like it did when it was recorded. As long as the checkpoints match, a routine request needs
+no LLM calls at all; at the first mismatch we hand over to the LLM.
+Replayed keystrokes go to whatever has focus, so the checks are strict and the feature is off by default (the 'macros'
+setting).
+
+Stored as compact JSON in ~/.open-interface/macros/, one file per request.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Optional
+
+from utils.files import atomic_write_json
+from utils.plan_cache import normalize_request
+from utils.screen_diff import hash_distance
+
+# Max differing bits (out of 80, see ScreenSignature.perceptual_hash()) between a checkpoint's screen hash and the
+# current one for the screen to still count as the same. A clock or a cursor shouldn't force a trip to the LLM, but a
+# different window in the same place must.
+DEFAULT_CHECKPOINT_TOLERANCE = 2
+
+
+class MacroRecorder:
+    def __init__(self, user_request: str):
+        self.macro = {
+            'request': normalize_request(user_request),
+            'created': time.time(),
+            'checkpoints': [],
+            'done': None,
+        }
+
+    def record(self, screen_hash: Optional[str], steps: list[dict[str, Any]], duration_secs: float,
+               app: Optional[str] = None) -> None:
+        # One LLM round trip (or cached replay) worth of steps, and the screen and foreground application they started
+        # from, see local_info.get_foreground_app()
+        self.macro['checkpoints'].append({
+            'screen_hash': screen_hash,
+            'app': app,
+            'steps': steps,
+            'duration_secs': round(duration_secs, 3),
+        })
+
+    def finish(self, done: str) -> dict[str, Any]:
+        self.macro['done'] = done
+        return self.macro
+
+
+class MacroLibrary:
+    def __init__(self, directory: Optional[str] = None):
+        if directory is None:
+            from utils.settings import Settings
+            directory = os.path.join(Settings().get_settings_directory_path(), 'macros')
+        self.directory = directory
+
+    def get_file_path(self, user_request: str) -> str:
+        request = normalize_request(user_request)
+        slug = re.sub(r'[^a-z0-9]+', '-', request).strip('-')[:40] or 'macro'
+        return os.path.join(self.directory, f'{slug}-{hashlib.sha1(request.encode()).hexdigest()[:8]}.json')
+
+    def save(self, macro: dict[str, Any]) -> Optional[str]:
+        # A macro is only useful if every checkpoint can be verified, screen and foreground application both
+        if not macro['checkpoints'] or any(not checkpoint['screen_hash'] or not checkpoint.get('app')
+                                           for checkpoint in macro['checkpoints']):
+            return None
+        try:
+            file_path = self.get_file_path(macro['request'])
+            atomic_write_json(file_path, macro, separators=(',', ':'))
+            return file_path
+        except Exception as e:
+            print(f'Unable to save macro - {e}')
+            return None
+
+    def find(self, user_request: str) -> Optional[dict[str, Any]]:
+        file_path = self.get_file_path(user_request)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'r') as file:
+                return json.load(file)
+        except Exception as e:
+            print(f'Ignoring unreadable macro {file_path} - {e}')
+            return None
+
+    def delete(self, user_request: str) -> None:
+        file_path = self.get_file_path(user_request)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class MacroPlayer:
+    def __init__(self, interpreter, get_screen_hash: Callable[[], Optional[str]],
+                 tolerance: int = DEFAULT_CHECKPOINT_TOLERANCE,
+                 get_foreground_app: Callable[[], Optional[str]] = lambda: None):
+        """
+        :param interpreter: Runs the recorded steps, through process_commands() so keyboard steps get batched.
+        :param get_screen_hash: Returns the perceptual hash of the screen right now.
+        :param get_foreground_app: Returns the application in the foreground right now, see
+            local_info.get_foreground_app(). It has to be the one recorded, and an application that can't be
+            determined (None) never matches.
+        """
+        self.interpreter = interpreter
+        self.get_screen_hash = get_screen_hash
+        self.tolerance = tolerance
+        self.get_foreground_app = get_foreground_app
+
+    def play(self, macro: dict[str, Any], should_stop: Callable[[], bool] = lambda: False) -> tuple[bool, int]:
+        """
+        :return: (whether the whole macro ran, index of the first checkpoint that didn't run). When it didn't finish,
+            the caller should continue with the LLM from that step number.
+        """
+        for index, checkpoint in enumerate(macro['checkpoints']):
+            if should_stop():
+                return False, index
+
+            app = self.get_foreground_app()
+            if app is None or app != checkpoint.get('app'):
+                print(f'Macro checkpoint {index} was recorded in {checkpoint.get("app")}, not {app}, handing over to '
+                      f'the LLM')
+                return False, index
+
+            screen_hash = self.get_screen_hash()
+            if not screen_hash or hash_distance(screen_hash, checkpoint['screen_hash']) > self.tolerance:
+                print(f'Macro checkpoint {index} does not match the screen, handing over to the LLM')
+                return False, index
+
+            if not self.interpreter.process_commands(checkpoint['steps'], should_stop):
+                return False, index
+
+        return True, len(macro['checkpoints'])
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from utils.files import atomic_write_json
+
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_TTL_SECS = 7 * 24 * 60 * 60
+
+
+def normalize_request(user_request: str) -> str:
+    # "Open Chrome", "open chrome." and " open  Chrome! " are the same request
+    return re.sub(r'\s+', ' ', user_request.strip().lower()).rstrip('.!?')
+
+
+class PlanCache:
+    """
+    Persistent cache of the LLM's instructions, keyed on the normalized request, step number, model name and a
+    perceptual hash of the screen at the time of the step. Repeated requests ("Open Chrome", "Hello") from the same
+    starting screen can then be replayed without calling the model.
+
+    Entries are evicted least recently used first once there are more than max_entries, and expire ttl_secs after they
+    were stored. Stored as JSON in ~/.open-interface/plan_cache.json.
+    """
+
+    def __init__(self, file_path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl_secs: float = DEFAULT_TTL_SECS, clock: Callable[[], float] = time.time):
+        if file_path is None:
+            from utils.settings import Settings
+            file_path = os.path.join(Settings().get_settings_directory_path(), 'plan_cache.json')
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        self.entries: OrderedDict[str, dict[str, Any]] = OrderedDict()  # Least recently used first
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self.load()
+
+    @staticmethod
+    def get_key(user_request: str, step_num: int, model_name: str, screen_hash: Optional[str]) -> str:
+        key = json.dumps([normalize_request(user_request), step_num, model_name, screen_hash])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, user_request: str, step_num: int, model_name: str,
+            screen_hash: Optional[str]) -> Optional[dict[str, Any]]:
+        key = self.get_key(user_request, step_num, model_name, screen_hash)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.clock() - entry['created'] > self.ttl_secs:
+                del self.entries[key]
+                self.stats['expirations'] += 1
+                entry = None
+
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            entry['last_used'] = self.clock()
+            entry['hits'] += 1
+            self.stats['hits'] += 1
+            return entry['instructions']
+
+    def put_many(self, plans: list[tuple[str, int, str, Optional[str], dict[str, Any]]]) -> None:
+        """
+        :param plans: (user_request, step_num, model_name, screen_hash, instructions) for every step of a request.
+            Stored together and only once the request succeeded, so a plan that led nowhere isn't replayed.
+        """
+        if not plans:
+            return
+        now = self.clock()
+        with self.lock:
+            for user_request, step_num, model_name, screen_hash, instructions in plans:
+                key = self.get_key(user_request, step_num, model_name, screen_hash)
+                self.entries[key] = {'request': normalize_request(user_request), 'step_num': step_num,
+                                     'model': model_name, 'instructions': instructions, 'created': now,
+                                     'last_used': now, 'hits': 0}
+                self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        self.save()
+
+    def get_stats(self) -> dict[str, Any]:
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {**self.stats, 'entries': len(self.entries),
+                    'hit_rate': self.stats['hits'] / lookups if lookups else 0.0}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+        self.save()
+
+    def load(self) -> None:
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, 'r') as file:
+                data = json.load(file)
+            entries = sorted(data.get('entries', {}).items(), key=lambda item: item[1]['last_used'])
+            self.entries = OrderedDict(entries[-self.max_entries:])
+            self.stats.update(data.get('stats', {}))
+        except Exception as e:
+            print(f'Ignoring unreadable plan cache {self.file_path} - {e}')
+
+    def save(self) -> None:
+        # Written atomically, so a crash mid-write can't leave a corrupt cache behind
+        with self.lock:
+            data = {'entries': dict(self.entries), 'stats': dict(self.stats)}
+        try:
+            atomic_write_json(self.file_path, data)
+        except Exception as e:
+            print(f'Unable to save plan cache - {e}')
@@ -0,0 +1,136 @@
+"""
+Assembles the system prompt from the sections of context.txt, leaving out the ones that don't apply to this machine or
+these settings and the optional ones that don't fit the model's context window.
+
+A section starts with a header line, everything up to the next header is its text:
+    [[section name required os=darwin when=mouse_actions priority=2]]
+required: always included, even over budget. os: only on this platform (sys.platform style: darwin, windows, linux).
+when: only if this setting is on. priority: optional sections are added lowest first while they fit the budget.
+"""
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Optional
+
+# Ollama's context window when num_ctx isn't set
+DEFAULT_NUM_CTX = 4096
+# Share of the context window the system prompt may take, the rest is for the request's messages, screenshots and reply
+SYSTEM_PROMPT_SHARE = 0.5
+# Kept free in the context window for the model's reply
+REPLY_TOKENS = 512
+
+SECTION_HEADER = re.compile(r'^\[\[section (\w+)((?: [\w=]+)*)]]$', re.MULTILINE)
+# Words, numbers and single punctuation characters, roughly how BPE tokenizers split English text and JSON
+TOKEN_PIECES = re.compile(r'[A-Za-z]+|\d+|[^\sA-Za-z\d]')
+CHARS_PER_WORD_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate token count without a tokenizer: about one token per short word, number or punctuation mark and one
+    more every CHARS_PER_WORD_TOKEN characters of longer words. Close enough to budget with, tokenizers differ
+    between models anyway.
+    """
+    return sum(math.ceil(len(piece) / CHARS_PER_WORD_TOKEN) for piece in TOKEN_PIECES.findall(text))
+
+
+def estimate_messages_tokens(messages: Iterable[dict[str, Any]]) -> int:
+    # Content plus a few tokens per message for the chat template's role markers. Images aren't counted, how many
+    # tokens they take depends on the model.
+    return sum(estimate_tokens(str(message.get('content', ''))) + 4 for message in messages)
+
+
+@dataclass
+class ContextSection:
+    name: str
+    text: str
+    required: bool = False
+    priority: int = 0
+    os: Optional[str] = None
+    when: Optional[str] = None
+    tokens: int = field(init=False)
+
+    def __post_init__(self):
+        self.tokens = estimate_tokens(self.text)
+
+
+def parse_context_sections(text: str) -> list[ContextSection]:
+    # Text before the first header is a required section of its own
+    sections = []
+    headers = list(SECTION_HEADER.finditer(text))
+    preamble = text[:headers[0].start()] if headers else text
+    if preamble.strip():
+        sections.append(ContextSection('preamble', preamble.strip(), required=True))
+
+    for index, header in enumerate(headers):
+        end = headers[index + 1].start() if index + 1 < len(headers) else len(text)
+        attributes = dict(attribute.partition('=')[::2] for attribute in header.group(2).split())
+        sections.append(ContextSection(
+            header.group(1),
+            text[header.end():end].strip(),
+            required='required' in attributes,
+            priority=int(attributes.get('priority') or 0),
+            os=attributes.get('os') or None,
+            when=attributes.get('when') or None))
+    return sections
+
+
+def get_system_prompt_budget(num_ctx: Optional[int]) -> int:
+    return int((num_ctx or DEFAULT_NUM_CTX) * SYSTEM_PROMPT_SHARE)
+
+
+def get_history_budget(num_ctx: Optional[int]) -> int:
+    # What's left for the request's messages, see models/conversation.py
+    return int((num_ctx or DEFAULT_NUM_CTX) * (1 - SYSTEM_PROMPT_SHARE)) - REPLY_TOKENS
+
+
+@dataclass
+class BudgetedPrompt:
+    text: str
+    budget: int
+    included: list[ContextSection]
+    # Section name -> why it was left out
+    left_out: dict[str, str]
+
+    @property
+    def tokens(self) -> int:
+        return sum(section.tokens for section in self.included)
+
+    def report(self) -> str:
+        report = (f'System prompt ~{self.tokens} tokens of a {self.budget} token budget - '
+                  + ', '.join(f'{section.name} {section.tokens}' for section in self.included))
+        if self.left_out:
+            report += '; left out ' + ', '.join(f'{name} ({reason})' for name, reason in self.left_out.items())
+        return report
+
+
+def assemble_prompt(sections: list[ContextSection], budget: int, os_name: str,
+                    is_enabled: Callable[[str], bool]) -> BudgetedPrompt:
+    """
+    Picks the smallest set of sections for this prompt: the required ones that apply to os_name, then optional ones that
+    apply, by priority, as long as they fit in budget tokens. Sections keep their order from context.txt.
+    is_enabled: whether the setting named in a section's `when` is on.
+    """
+    left_out = {}
+    relevant = []
+    for section in sections:
+        if section.os and section.os != os_name:
+            left_out[section.name] = f'not {section.os}'
+        elif section.when and not is_enabled(section.when):
+            left_out[section.name] = f'{section.when} off'
+        else:
+            relevant.append(section)
+
+    chosen = {section.name for section in relevant if section.required}
+    used = sum(section.tokens for section in relevant if section.required)
+    if used > budget:
+        print(f'Required context sections take ~{used} tokens, over the {budget} token budget, raise num_ctx')
+    for section in sorted((section for section in relevant if not section.required), key=lambda s: s.priority):
+        if used + section.tokens <= budget:
+            chosen.add(section.name)
+            used += section.tokens
+        else:
+            left_out[section.name] = 'over budget'
+
+    included = [section for section in relevant if section.name in chosen]
+    return BudgetedPrompt('\n\n'.join(section.text for section in included), budget, included, left_out)
@@ -2,22 +2,134 @@ import base64
 import io
 import os
 import tempfile
+import time
+from typing import NamedTuple, Optional
 
-import pyautogui
 from PIL import Image
+from utils.screen_diff import DEFAULT_CHANGE_THRESHOLD, ScreenChangeDetector, ScreenSignature
 from utils.settings import Settings
+from utils.tracing import tracer
+
+DEFAULT_SCREENSHOT_MAX_EDGE = 1280
+DEFAULT_SCREENSHOT_FORMAT = 'jpeg'
+DEFAULT_SCREENSHOT_QUALITY = 70
+
+
+class EncodedScreenshot(NamedTuple):
+    data: bytes  # Empty if the screen hasn't changed since the last screenshot we sent
+    format: str
+    size: tuple[int, int]  # After cropping and downscaling
+    original_size: tuple[int, int]
+    timings_ms: dict[str, float]  # capture, resize, encode
+    region: Optional[tuple[int, int, int, int]] = None  # (left, top, right, bottom) if cropped to what changed
+    signature: Optional[ScreenSignature] = None
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode('utf-8')
+
+    def describe(self) -> str:
+        # Goes into the "screenshot" field of the request so the LLM knows what it's looking at
+        if not self.data:
+            return 'unchanged since the previous screenshot, not attached again'
+        if self.region:
+            return f'attached image, cropped to the screen region {self.region} (left, top, right, bottom) that ' \
+                   f'changed since the previous screenshot, the rest of the screen is unchanged'
+        return 'attached image'
 
 
 class Screen:
+    # pyautogui is imported on first use, it's slow to import (AppKit on macOS, X11 on Linux) and not needed until
+    # the first request
+
     def get_size(self) -> tuple[int, int]:
+        import pyautogui
         screen_width, screen_height = pyautogui.size()  # Get the size of the primary monitor.
         return screen_width, screen_height
 
     def get_screenshot(self) -> Image.Image:
         # Enable screen recording from settings
-        img = pyautogui.screenshot()  # Takes roughly 100ms # img.show()
+        import pyautogui
+        with tracer.span('capture'):
+            img = pyautogui.screenshot()  # Takes roughly 100ms # img.show()
         return img
 
+    def capture_for_llm(self, max_edge: int = DEFAULT_SCREENSHOT_MAX_EDGE, image_format: str = DEFAULT_SCREENSHOT_FORMAT,
+                        quality: int = DEFAULT_SCREENSHOT_QUALITY) -> EncodedScreenshot:
+        start = time.perf_counter()
+        img = self.get_screenshot()
+        capture_ms = (time.perf_counter() - start) * 1000
+        return self.encode_for_llm(img, max_edge, image_format, quality, timings_ms={'capture': capture_ms})
+
+    def encode_for_llm(self, img: Image.Image, max_edge: int = DEFAULT_SCREENSHOT_MAX_EDGE,
+                       image_format: str = DEFAULT_SCREENSHOT_FORMAT, quality: int = DEFAULT_SCREENSHOT_QUALITY,
+                       region: Optional[tuple[int, int, int, int]] = None, timings_ms: Optional[dict[str, float]] = None,
+                       signature: Optional[ScreenSignature] = None) -> EncodedScreenshot:
+        """
+        Screenshot ready to attach to an LLM request: optionally cropped to region, downscaled so its longest edge is
+        at most max_edge and encoded to JPEG or WebP in memory. Full resolution PNGs of a 4K screen take hundreds of
+        milliseconds to encode and bloat the request, the model doesn't need that detail.
+        """
+        timings_ms = dict(timings_ms or {})
+        start = time.perf_counter()
+
+        original_size = img.size
+        if region:
+            img = img.crop(region)
+        scale = max_edge / max(img.size)
+        if scale < 1:
+            # reducing_gap lets Pillow shrink in integer steps first, which is much faster for big downscales
+            img = img.resize((round(img.size[0] * scale), round(img.size[1] * scale)),
+                             Image.BILINEAR, reducing_gap=2.0)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        resized = time.perf_counter()
+
+        img_bytes = io.BytesIO()
+        image_format = image_format.lower()
+        if image_format == 'webp':
+            img.save(img_bytes, format='WEBP', quality=quality, method=0)  # method 0 is the fastest encoder setting
+        else:
+            image_format = 'jpeg'
+            img.save(img_bytes, format='JPEG', quality=quality)
+        encoded = time.perf_counter()
+
+        timings_ms['resize'] = (resized - start) * 1000
+        timings_ms['encode'] = (encoded - resized) * 1000
+        tracer.record('resize', start, resized, size=img.size)
+        tracer.record('encode', resized, encoded, format=image_format)
+        screenshot = EncodedScreenshot(img_bytes.getvalue(), image_format, img.size, original_size, timings_ms, region,
+                                       signature)
+        print(f'Screenshot {original_size} -> {img.size} {image_format} {len(screenshot.data) // 1024} KB - '
+              + ', '.join(f'{stage} {ms:.0f}ms' for stage, ms in timings_ms.items()))
+        return screenshot
+
+    def wait_for_stable_screen(self, timeout: float = 5.0, threshold: float = DEFAULT_CHANGE_THRESHOLD,
+                               poll_interval: float = 0.1, stable_frames: int = 2, min_wait: float = 0.0) -> bool:
+        """
+        Polls low resolution captures until the screen stops changing, i.e. the app or page finished loading.
+        :param stable_frames: How many consecutive unchanged comparisons count as settled.
+        :param min_wait: Always wait at least this long, apps can take a moment to even start reacting to input.
+        :return: True if the screen settled, False if we gave up after timeout seconds.
+        """
+        detector = ScreenChangeDetector(threshold)
+        deadline = time.monotonic() + timeout
+        if min_wait:
+            time.sleep(min(min_wait, timeout))
+        previous = detector.get_signature(self.get_screenshot())
+        unchanged_count = 0
+
+        while time.monotonic() < deadline:
+            time.sleep(poll_interval)
+            current = detector.get_signature(self.get_screenshot())
+            if detector.compare(previous, current).changed:
+                unchanged_count = 0
+            else:
+                unchanged_count += 1
+                if unchanged_count >= stable_frames:
+                    return True
+            previous = current
+        return False
+
     def get_screenshot_in_base64(self) -> str:
         # Base64 images work with ChatCompletions API but not Assistants API
         img_bytes = self.get_screenshot_as_file_object()
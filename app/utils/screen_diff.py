@@ -0,0 +1,92 @@
+"""
+Cheap change detection between screenshots.
+
+Frames are compared on a small grayscale thumbnail split into tiles, so a comparison costs well under a millisecond
+regardless of screen resolution. It tells us whether anything meaningful changed between two screenshots and, if so,
+which part of the screen, so we can skip sending identical frames to the LLM or send only the region that changed.
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+
+THUMBNAIL_WIDTH = 256
+TILE_SIZE = 8  # In thumbnail pixels, i.e. a 32x32 tile of a 1024 pixel wide screen
+DEFAULT_CHANGE_THRESHOLD = 3.0  # Mean absolute gray level difference for a tile to count as changed (0-255)
+# Bits for the frame's mean brightness at the end of its perceptual hash
+BRIGHTNESS_BITS = 16
+
+
+class ScreenSignature(NamedTuple):
+    thumbnail: np.ndarray  # Grayscale, int16 so differences don't wrap around
+    screen_size: tuple[int, int]
+
+    def perceptual_hash(self) -> str:
+        """
+        Hash of the frame as hex: a 64 bit difference hash (dHash) of its structure, then BRIGHTNESS_BITS for its mean
+        brightness. Screens that look the same to a person hash the same, so it can be used as a cache key for screen
+        state; compare hashes with hash_distance().
+        dHash alone is all zeros for any frame without structure, so every blank screen would look the same whatever
+        its colour. The brightness is a thermometer code (the first n bits set), so the distance between two levels is
+        how far apart they are.
+        """
+        small = np.asarray(Image.fromarray(self.thumbnail.astype(np.uint8)).resize((9, 8), Image.BILINEAR),
+                           dtype=np.int16)
+        bits = list((small[:, 1:] > small[:, :-1]).flatten())
+        brightness_level = round(float(self.thumbnail.mean()) / 255 * BRIGHTNESS_BITS)
+        bits += [index < brightness_level for index in range(BRIGHTNESS_BITS)]
+        return f'{int("".join("1" if bit else "0" for bit in bits), 2):0{len(bits) // 4}x}'
+
+
+class ScreenChange(NamedTuple):
+    changed_tiles: np.ndarray  # Boolean grid, True where the tile changed
+    changed_fraction: float  # Of the whole screen
+    dirty_region: Optional[tuple[int, int, int, int]]  # (left, top, right, bottom) in screen pixels, None if unchanged
+
+    @property
+    def changed(self) -> bool:
+        return self.dirty_region is not None
+
+
+class ScreenChangeDetector:
+    def __init__(self, threshold: float = DEFAULT_CHANGE_THRESHOLD, tile_size: int = TILE_SIZE):
+        self.threshold = threshold
+        self.tile_size = tile_size
+
+    def get_signature(self, img: Image.Image) -> ScreenSignature:
+        width, height = img.size
+        thumbnail_height = max(self.tile_size, round(THUMBNAIL_WIDTH * height / width))
+        thumbnail = img.convert('L').resize((THUMBNAIL_WIDTH, thumbnail_height), Image.BILINEAR)
+        return ScreenSignature(np.asarray(thumbnail, dtype=np.int16), img.size)
+
+    def compare(self, previous: ScreenSignature, current: ScreenSignature) -> ScreenChange:
+        if previous.thumbnail.shape != current.thumbnail.shape:
+            # Resolution changed, treat everything as dirty
+            rows, columns = (dimension // self.tile_size for dimension in current.thumbnail.shape)
+            return ScreenChange(np.ones((rows, columns), dtype=bool), 1.0, (0, 0) + tuple(current.screen_size))
+
+        tile = self.tile_size
+        rows, columns = current.thumbnail.shape[0] // tile, current.thumbnail.shape[1] // tile
+        difference = np.abs(current.thumbnail - previous.thumbnail)[:rows * tile, :columns * tile]
+        tile_differences = difference.reshape(rows, tile, columns, tile).mean(axis=(1, 3))
+        changed_tiles = tile_differences > self.threshold
+
+        if not changed_tiles.any():
+            return ScreenChange(changed_tiles, 0.0, None)
+
+        changed_rows = np.flatnonzero(changed_tiles.any(axis=1))
+        changed_columns = np.flatnonzero(changed_tiles.any(axis=0))
+        scale_x = current.screen_size[0] / current.thumbnail.shape[1]
+        scale_y = current.screen_size[1] / current.thumbnail.shape[0]
+        dirty_region = (
+            int(changed_columns[0] * tile * scale_x),
+            int(changed_rows[0] * tile * scale_y),
+            min(current.screen_size[0], int((changed_columns[-1] + 1) * tile * scale_x)),
+            min(current.screen_size[1], int((changed_rows[-1] + 1) * tile * scale_y)),
+        )
+        return ScreenChange(changed_tiles, float(changed_tiles.mean()), dirty_region)
+
+
+def hash_distance(first_hash: str, second_hash: str) -> int:
+    # Number of differing bits between two perceptual hashes, 0 means the screens look the same
+    return bin(int(first_hash, 16) ^ int(second_hash, 16)).count('1')
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from utils.files import atomic_write_json
+
+DEFAULT_MAX_ENTRIES = 1000
+
+
+class ScreenTransitions:
+    """
+    Remembers which screen a batch of steps led to: (perceptual hash of the screen before, steps) -> hash after.
+    Core uses it to predict the screen a batch will end on while the batch is still executing, so it can ask the LLM
+    for the next batch ahead of time, see Core.start_speculative_prefetch().
+
+    Only what the steps do counts, not the LLM's justification for them. Entries are evicted least recently used first.
+    Stored as JSON in ~/.open-interface/screen_transitions.json.
+    """
+
+    def __init__(self, file_path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        if file_path is None:
+            from utils.settings import Settings
+            file_path = os.path.join(Settings().get_settings_directory_path(), 'screen_transitions.json')
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.transitions: OrderedDict[str, str] = OrderedDict()  # Least recently used first
+        self.load()
+
+    @staticmethod
+    def get_key(screen_hash: str, steps: list[dict[str, Any]]) -> str:
+        actions = [[step.get('function'), step.get('parameters', {})] for step in steps]
+        return hashlib.sha1(json.dumps([screen_hash, actions], sort_keys=True).encode()).hexdigest()
+
+    def predict(self, screen_hash: Optional[str], steps: list[dict[str, Any]]) -> Optional[str]:
+        # Hash of the screen these steps led to from this screen last time, None if we haven't seen them
+        if not screen_hash or not steps:
+            return None
+        key = self.get_key(screen_hash, steps)
+        with self.lock:
+            predicted_hash = self.transitions.get(key)
+            if predicted_hash is not None:
+                self.transitions.move_to_end(key)
+            return predicted_hash
+
+    def record(self, screen_hash: Optional[str], steps: list[dict[str, Any]], next_screen_hash: Optional[str]) -> None:
+        if not screen_hash or not next_screen_hash or not steps:
+            return
+        key = self.get_key(screen_hash, steps)
+        with self.lock:
+            self.transitions[key] = next_screen_hash
+            self.transitions.move_to_end(key)
+            while len(self.transitions) > self.max_entries:
+                self.transitions.popitem(last=False)
+
+    def load(self) -> None:
+        if not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, 'r') as file:
+                self.transitions = OrderedDict(list(json.load(file).items())[-self.max_entries:])
+        except Exception as e:
+            print(f'Ignoring unreadable screen transitions {self.file_path} - {e}')
+
+    def save(self) -> None:
+        with self.lock:
+            data = dict(self.transitions)
+        try:
+            atomic_write_json(self.file_path, data)
+        except Exception as e:
+            print(f'Unable to save screen transitions - {e}')
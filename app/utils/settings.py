@@ -2,59 +2,172 @@
 import base64
 import json
 import os
+import queue
+import threading
 from pathlib import Path
+from typing import Any, Callable, Optional
+
+from utils.files import atomic_write_json
+
+# Called with the names and new values of the settings that changed
+SettingsSubscriber = Callable[[dict[str, Any]], None]
+
+TRUE_STRINGS = {'1', 'true', 'yes', 'on'}
+
+
+class SettingsStore:
+    """
+    The contents of one settings.json, loaded once per process and shared by every Settings() pointing at it.
+    Saving merges into the cached copy, writes it to a temporary file and renames that over settings.json, so a crash
+    mid-write can't leave a truncated file behind, and then tells subscribers what changed.
+    Subscribers are called on one worker thread, in the order settings were saved, rather than on the thread that
+    saved them. That's usually Tk's, and some subscribers are slow (switching models, reloading the context).
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.subscribers: list[SettingsSubscriber] = []
+        # (changed settings, subscribers to tell) for the notifier thread
+        self.notifications: queue.Queue[tuple[dict[str, Any], list[SettingsSubscriber]]] = queue.Queue()
+        self.notifier_thread: Optional[threading.Thread] = None
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self.settings: dict[str, Any] = self.load()
+
+    def load(self) -> dict[str, Any]:
+        if not os.path.exists(self.file_path):
+            return {}
+        with open(self.file_path, 'r') as file:
+            try:
+                settings = json.load(file)
+            except:
+                return {}
+
+        # Decode the base_url
+        if 'base_url' in settings:
+            settings['base_url'] = base64.b64decode(settings['base_url']).decode()
+        return settings
+
+    def save(self, settings_dict: dict[str, Any]) -> None:
+        with self.lock:
+            changed = {name: value for name, value in settings_dict.items()
+                       if value is not None and self.settings.get(name) != value}
+            if not changed:
+                return
+            # Replaced rather than updated, so a get_dict() copy being read on another thread stays consistent
+            self.settings = {**self.settings, **changed}
+
+            if 'base_url' in changed:
+                os.environ["BASE_URL"] = changed['base_url']  # Set environment variable
+            on_disk = dict(self.settings)
+            if 'base_url' in on_disk:
+                on_disk['base_url'] = base64.b64encode(on_disk['base_url'].encode()).decode()
+
+            atomic_write_json(self.file_path, on_disk, indent=4)
+            if self.subscribers:
+                self.notify(changed, list(self.subscribers))
+
+    def notify(self, changed: dict[str, Any], subscribers: list[SettingsSubscriber]) -> None:
+        # Called with the lock held, so notifications are queued in the order settings were saved
+        self.notifications.put((changed, subscribers))
+        if self.notifier_thread is None:
+            self.notifier_thread = threading.Thread(target=self.deliver_notifications, name='settings-notifier',
+                                                    daemon=True)
+            self.notifier_thread.start()
+
+    def deliver_notifications(self) -> None:
+        while True:
+            changed, subscribers = self.notifications.get()
+            for subscriber in subscribers:
+                try:
+                    subscriber(changed)
+                except Exception as e:
+                    print(f'Error while applying changed settings {", ".join(changed)} - {e}')
+            self.notifications.task_done()
+
+    def wait_for_subscribers(self) -> None:
+        # Blocks until subscribers have been told about everything saved so far
+        self.notifications.join()
+
+    def subscribe(self, subscriber: SettingsSubscriber) -> Callable[[], None]:
+        # Returns a function that unsubscribes again
+        with self.lock:
+            self.subscribers.append(subscriber)
+
+        def unsubscribe() -> None:
+            with self.lock:
+                if subscriber in self.subscribers:
+                    self.subscribers.remove(subscriber)
+        return unsubscribe
+
+
+settings_stores: dict[str, SettingsStore] = {}
+settings_stores_lock = threading.Lock()
+
+
+def get_settings_store(file_path: str) -> SettingsStore:
+    with settings_stores_lock:
+        if file_path not in settings_stores:
+            settings_stores[file_path] = SettingsStore(file_path)
+        return settings_stores[file_path]
 
 
 class Settings:
+    """
+    Cheap to construct anywhere, every instance reads from and writes to the same SettingsStore.
+    Read settings when they're needed rather than keeping a copy of get_dict() around, and subscribe() to act on
+    changes as they're saved.
+    """
+
     def __init__(self):
         self.settings_file_path = self.get_settings_directory_path() + 'settings.json'
-        os.makedirs(os.path.dirname(self.settings_file_path), exist_ok=True)
-        self.settings = self.load_settings_from_file()
+        self.store = get_settings_store(self.settings_file_path)
 
     def get_settings_directory_path(self):
         return str(Path.home()) + '/.open-interface/'
 
-    def get_dict(self) -> dict[str, str]:
-        return self.settings
+    def get_dict(self) -> dict[str, Any]:
+        return dict(self.store.settings)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        # Unset and empty settings both mean the default
+        value = self.get_dict().get(name)
+        return default if value is None or value == '' else value
+
+    def get_str(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        value = self.get(name)
+        return default if value is None else str(value)
+
+    def get_int(self, name: str, default: Optional[int] = None) -> Optional[int]:
+        return self.get_number(name, default, int)
+
+    def get_float(self, name: str, default: Optional[float] = None) -> Optional[float]:
+        return self.get_number(name, default, float)
+
+    def get_number(self, name: str, default, cast):
+        value = self.get(name)
+        if value is None:
+            return default
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, name: str, default: bool = False) -> bool:
+        value = self.get(name)
+        if value is None:
+            return default
+        if isinstance(value, str):
+            return value.strip().lower() in TRUE_STRINGS
+        return bool(value)
 
     def save_settings_to_file(self, settings_dict) -> None:
-        settings: dict[str, str] = {}
+        # Settings missing from settings_dict or set to None keep their previous value
+        self.store.save(settings_dict)
 
-        # Preserve previous settings in case new dict doesn't contain them
-        if os.path.exists(self.settings_file_path):
-            with open(self.settings_file_path, 'r') as file:
-                try:
-                    settings = json.load(file)
-                except:
-                    settings = {}
-
-        for setting_name in settings_dict:
-            setting_val = settings_dict[setting_name]
-            if setting_val is not None:
-                if setting_name == "base_url":
-                    base_url = settings_dict["base_url"]
-                    os.environ["BASE_URL"] = base_url  # Set environment variable
-                    encoded_base_url = base64.b64encode(base_url.encode()).decode()
-                    settings['base_url'] = encoded_base_url
-                else:
-                    settings[setting_name] = setting_val
-
-        with open(self.settings_file_path, 'w+') as file:
-            json.dump(settings, file, indent=4)
-
-    def load_settings_from_file(self) -> dict[str, str]:
-        if os.path.exists(self.settings_file_path):
-            with open(self.settings_file_path, 'r') as file:
-                try:
-                    settings = json.load(file)
-                except:
-                    return {}
-
-                # Decode the base_url
-                if 'base_url' in settings:
-                    decoded_base_url = base64.b64decode(settings['base_url']).decode()
-                    settings['base_url'] = decoded_base_url
-                return settings
-        else:
-            return {}
+    def load_settings_from_file(self) -> dict[str, Any]:
+        return self.get_dict()
 
+    def subscribe(self, subscriber: SettingsSubscriber) -> Callable[[], None]:
+        # subscriber is called on a worker thread, see SettingsStore
+        return self.store.subscribe(subscriber)
@@ -0,0 +1,201 @@
+"""
+Per-stage timing for requests, see Tracer.
+
+Traces are written to ~/.open-interface/traces/ when the 'tracing' setting is on:
+    trace-<time>.json   One per request in Chrome's trace event format, open it in chrome://tracing or
+                        https://ui.perfetto.dev to see the stages of every round trip on a timeline.
+    spans.jsonl         Every span of every traced request, one JSON object per line.
+
+Print p50/p95 per stage over spans.jsonl with `python -m utils.tracing` from the app directory.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+MAX_TRACE_FILES = 50  # Oldest Chrome traces are deleted beyond this
+MAX_SPANS_FILE_BYTES = 20 * 1024 * 1024  # spans.jsonl is moved to spans.jsonl.1 when it grows past this
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    start: float  # time.perf_counter() seconds
+    end: float
+    thread_id: int
+    thread_name: str
+    args: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end - self.start) * 1000
+
+
+@dataclass(slots=True)
+class Trace:
+    name: str
+    start: float
+    wall_time: float  # time.time() at start, for file names and to line traces up with logs
+    spans: list[Span] = field(default_factory=list)
+
+
+class Tracer:
+    """
+    Collects spans for the request being traced. Core starts a trace per request, the stages it goes through mark
+    themselves with `with tracer.span('name'):` (or tracer.record() when start and end aren't in one block), from
+    whichever thread they run on. Spans outside a trace, or while tracing is off, cost a check and nothing else.
+
+    Stages: capture, encode, prompt_build, llm, time_to_first_token, generation, parse and execute.<function> for
+    every command, within a round_trip per completed LLM round trip and a request for the whole request.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.trace: Optional[Trace] = None
+
+    def start_trace(self, name: str) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.trace = Trace(name, time.perf_counter(), time.time())
+
+    def finish_trace(self) -> Optional[Trace]:
+        # Stops collecting and hands back what was collected, spans that end later are dropped
+        with self.lock:
+            trace, self.trace = self.trace, None
+        return trace
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        if self.trace is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), **args)
+
+    def record(self, name: str, start: float, end: Optional[float] = None, **args: Any) -> None:
+        if self.trace is None:
+            return
+        thread = threading.current_thread()
+        span = Span(name, start, time.perf_counter() if end is None else end, thread.ident, thread.name, args)
+        with self.lock:
+            if self.trace is not None:
+                self.trace.spans.append(span)
+
+
+# Shared by everything that records spans, the same way models/registry.py shares model_registry
+tracer = Tracer()
+
+
+def get_traces_directory_path() -> str:
+    from utils.settings import Settings
+    return os.path.join(Settings().get_settings_directory_path(), 'traces')
+
+
+def to_chrome_trace(trace: Trace) -> dict[str, Any]:
+    # Complete ("X") events with microsecond timestamps relative to the start of the trace, plus thread names
+    events: list[dict[str, Any]] = []
+    thread_names = {span.thread_id: span.thread_name for span in trace.spans}
+    for thread_id, thread_name in thread_names.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread_id, 'args': {'name': thread_name}})
+    for span in trace.spans:
+        events.append({'name': span.name, 'ph': 'X', 'pid': 1, 'tid': span.thread_id,
+                       'ts': round((span.start - trace.start) * 1e6), 'dur': round((span.end - span.start) * 1e6),
+                       'args': span.args})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'request': trace.name}}
+
+
+def to_span_records(trace: Trace) -> list[dict[str, Any]]:
+    trace_id = time.strftime('%Y%m%d-%H%M%S', time.localtime(trace.wall_time))
+    return [{'trace': trace_id, 'request': trace.name, 'name': span.name,
+             'start_ms': round((span.start - trace.start) * 1000, 3), 'duration_ms': round(span.duration_ms, 3),
+             'thread': span.thread_name, 'args': span.args}
+            for span in trace.spans]
+
+
+def save_trace(trace: Trace, directory: Optional[str] = None) -> Optional[str]:
+    """
+    Writes the trace as Chrome trace JSON and appends its spans to spans.jsonl. Returns the Chrome trace's path.
+    Meant to run in the background after the request, errors are printed rather than raised.
+    """
+    if not trace.spans:
+        return None
+    directory = directory or get_traces_directory_path()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        time_str = time.strftime('%Y%m%d-%H%M%S', time.localtime(trace.wall_time))
+        trace_path = os.path.join(directory, f'trace-{time_str}-{int(trace.wall_time * 1000) % 1000:03d}.json')
+        with open(trace_path, 'w') as file:
+            json.dump(to_chrome_trace(trace), file, default=str)
+
+        spans_path = os.path.join(directory, 'spans.jsonl')
+        if os.path.exists(spans_path) and os.path.getsize(spans_path) > MAX_SPANS_FILE_BYTES:
+            os.replace(spans_path, spans_path + '.1')
+        with open(spans_path, 'a') as file:
+            for record in to_span_records(trace):
+                file.write(json.dumps(record, default=str) + '\n')
+
+        trace_files = sorted(name for name in os.listdir(directory) if re.fullmatch(r'trace-.*\.json', name))
+        for name in trace_files[:-MAX_TRACE_FILES]:
+            os.remove(os.path.join(directory, name))
+        return trace_path
+    except Exception as e:
+        print(f'Unable to save trace - {e}')
+        return None
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    # Linear interpolation between the closest ranks
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(records: list[dict[str, Any]]) -> dict[str, dict[str, float]]:
+    # Stage name -> count, p50, p95, max and total duration in milliseconds
+    durations: dict[str, list[float]] = {}
+    for record in records:
+        durations.setdefault(record['name'], []).append(float(record['duration_ms']))
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = {'count': len(values), 'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95),
+                         'max': values[-1], 'total': sum(values)}
+    return summary
+
+
+def format_summary(summary: dict[str, dict[str, float]]) -> str:
+    lines = [f'{"stage":<28}{"count":>8}{"p50 ms":>12}{"p95 ms":>12}{"max ms":>12}{"total ms":>14}']
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['total']):
+        lines.append(f'{name:<28}{stats["count"]:>8}{stats["p50"]:>12.1f}{stats["p95"]:>12.1f}{stats["max"]:>12.1f}'
+                     f'{stats["total"]:>14.1f}')
+    return '\n'.join(lines)
+
+
+def read_span_records(path: str) -> list[dict[str, Any]]:
+    records = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+if __name__ == '__main__':
+    spans_file = sys.argv[1] if len(sys.argv) > 1 else os.path.join(get_traces_directory_path(), 'spans.jsonl')
+    if not Path(spans_file).exists():
+        print(f'No spans recorded yet at {spans_file}, turn on the "tracing" setting and run a request first')
+        sys.exit(1)
+    print(format_summary(summarize(read_span_records(spans_file))))
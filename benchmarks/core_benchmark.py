@@ -0,0 +1,256 @@
+"""
+Runs Core end to end through scripted multi-step tasks, headless: the LLM is tests/stub_llm_server.py replying with
+the scripted steps at a configurable per-token latency, input goes to the recording backend and screenshots come from
+a synthetic screen that changes with every input event. Reports requests per minute, request and round trip latency
+percentiles, per-stage timings (from utils/tracing.py), CPU time and peak memory, and compares them against a saved
+baseline.
+
+> python3 benchmarks/core_benchmark.py [--backend ollama|openai] [--token-latency SECS] [--iterations N]
+                                       [--no-stream] [--save-baseline] [--baseline PATH] [--tolerance FRACTION]
+
+Exits with status 1 if a metric is worse than the baseline by more than the tolerance, so it can gate CI. Baselines
+are only comparable on the same machine with the same options, so none is checked in: save one with --save-baseline
+before making changes (benchmarks/core_baseline.json by default, ignored by git). Without one there is nothing to
+compare against, the results are only printed and the exit status is 0.
+CPU time includes the stub server, which runs in the same process.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Optional
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../tests')))
+
+from interpreter_benchmark import make_fake_pyautogui, make_fake_pyperclip
+
+DEFAULT_TASKS_FILE = os.path.join(os.path.dirname(__file__), 'scripted_tasks.json')
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'core_baseline.json')
+DEFAULT_TOKEN_LATENCY = 0.002
+DEFAULT_ITERATIONS = 3
+DEFAULT_TOLERANCE = 0.2
+
+# Metrics where bigger is better, the rest regress when they grow
+HIGHER_IS_BETTER = {'requests_per_minute'}
+# Options that have to match for two runs to be comparable
+CONFIG_KEYS = ('backend', 'stream', 'token_latency', 'tasks')
+
+
+class SyntheticScreen:
+    """
+    Stands in for pyautogui.screenshot(): a desktop with a few windows that move whenever an input event has been sent
+    since the last screenshot, so change detection, hashing and encoding do the same work they would on a real screen.
+    """
+
+    def __init__(self, size: tuple[int, int] = (1920, 1080)):
+        self.size = size
+        self.backend = None  # The RecordingBackend whose events drive the screen's state
+
+    def screenshot(self, *args, **kwargs) -> Image.Image:
+        state = len(self.backend.events) if self.backend else 0
+        rng = np.random.default_rng(state)
+        width, height = self.size
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[:] = np.linspace(40, 90, height, dtype=np.uint8)[:, None, None]
+        for _ in range(4):
+            left, top = rng.integers(0, width - 400), rng.integers(0, height - 300)
+            pixels[top:top + 300, left:left + 400] = rng.integers(0, 256, 3, dtype=np.uint8)
+            # Lines of "text" so the encoder has some detail to deal with
+            pixels[top + 40:top + 280:12, left + 20:left + 380] = 20
+        return Image.fromarray(pixels)
+
+
+def install_fakes(screen: SyntheticScreen) -> None:
+    fake_pyautogui = make_fake_pyautogui()
+    fake_pyautogui.screenshot = screen.screenshot
+    fake_pyautogui.size = lambda: screen.size
+    sys.modules['pyautogui'] = fake_pyautogui
+    sys.modules['pyperclip'] = make_fake_pyperclip()
+
+
+def read_spans(spans_file: str, expected_requests: int, timeout: float = 10.0) -> list[dict[str, Any]]:
+    # Traces are saved in the background after each request, wait for the last ones
+    deadline = time.monotonic() + timeout
+    while True:
+        records = []
+        if os.path.exists(spans_file):
+            from utils.tracing import read_span_records
+            records = read_span_records(spans_file)
+        if sum(record['name'] == 'request' for record in records) >= expected_requests or time.monotonic() > deadline:
+            return records
+        time.sleep(0.05)
+
+
+def get_peak_memory_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_benchmark(tasks: list[dict[str, Any]], backend: str, stream: bool, token_latency: float,
+                  iterations: int, verbose: bool = False) -> dict[str, Any]:
+    # Settings, traces and caches go to a throwaway home directory instead of the user's
+    os.environ['HOME'] = tempfile.mkdtemp(prefix='open-interface-benchmark-')
+    screen = SyntheticScreen()
+    install_fakes(screen)
+
+    from stub_llm_server import StubLLMServer
+    from utils.settings import Settings
+    from utils.tracing import get_traces_directory_path, percentile, summarize
+
+    server = StubLLMServer(token_latency=token_latency).start()
+    Settings().save_settings_to_file({
+        'base_url': server.base_url,
+        'model': 'stub',
+        'model_backend': backend,
+        'input_backend': 'recording',
+        'stream_steps': stream,
+        'tracing': True,
+        # Every iteration has to go to the LLM
+        'plan_cache': False,
+        'macros': False,
+        'speculative_prefetch': False,
+    })
+
+    output = sys.stdout if verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):
+        from core import Core
+        core = Core()
+        screen.backend = core.interpreter.backend
+        core.llm.wait_until_model_ready(30)
+
+        request_latencies = []
+        outcomes: dict[str, int] = {}
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(iterations):
+            for task in tasks:
+                server.replies = list(task['replies'])
+                start = time.perf_counter()
+                result = core.execute_user_request(task['request'])
+                request_latencies.append((time.perf_counter() - start) * 1000)
+                outcomes[result.outcome.value] = outcomes.get(result.outcome.value, 0) + 1
+        wall_secs = time.perf_counter() - wall_start
+        cpu_secs = time.process_time() - cpu_start
+
+        records = read_spans(os.path.join(get_traces_directory_path(), 'spans.jsonl'), len(request_latencies))
+        core.cleanup()
+    server.stop()
+
+    stages = summarize(records)
+    request_latencies.sort()
+    metrics = {
+        'requests_per_minute': len(request_latencies) / wall_secs * 60,
+        'request_p50_ms': percentile(request_latencies, 0.5),
+        'request_p95_ms': percentile(request_latencies, 0.95),
+        'cpu_ms_per_request': cpu_secs * 1000 / len(request_latencies),
+    }
+    if 'round_trip' in stages:
+        metrics['round_trip_p50_ms'] = stages['round_trip']['p50']
+        metrics['round_trip_p95_ms'] = stages['round_trip']['p95']
+    peak_memory_mb = get_peak_memory_mb()
+    if peak_memory_mb is not None:
+        metrics['peak_memory_mb'] = peak_memory_mb
+
+    return {
+        'config': {'backend': backend, 'stream': stream, 'token_latency': token_latency,
+                   'tasks': [task['request'] for task in tasks]},
+        'requests': len(request_latencies),
+        'outcomes': outcomes,
+        'metrics': metrics,
+        'stages': stages,
+    }
+
+
+def compare_with_baseline(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    """
+    Prints every metric next to its baseline value and returns the ones that got worse by more than tolerance.
+    """
+    mismatched = [key for key in CONFIG_KEYS if results['config'].get(key) != baseline['config'].get(key)]
+    if mismatched:
+        print(f'\nNot comparing with the baseline, it was run with different {", ".join(mismatched)}')
+        return []
+
+    regressions = []
+    print(f'\n{"metric":<24}{"baseline":>12}{"now":>12}{"change":>10}')
+    for name, value in results['metrics'].items():
+        baseline_value = baseline['metrics'].get(name)
+        if not baseline_value:
+            continue
+        change = (value - baseline_value) / baseline_value
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        print(f'{name:<24}{baseline_value:>12.1f}{value:>12.1f}{change:>+10.1%}{flag}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def print_results(results: dict[str, Any]) -> None:
+    from utils.tracing import format_summary
+
+    config = results['config']
+    print(f'\n{results["requests"]} requests on the {config["backend"]} backend, '
+          f'{"streamed" if config["stream"] else "not streamed"}, {config["token_latency"] * 1000:g}ms per token - '
+          + ', '.join(f'{count} {outcome}' for outcome, count in results['outcomes'].items()))
+    for name, value in results['metrics'].items():
+        print(f'{name:<24}{value:>12.1f}')
+    print()
+    print(format_summary(results['stages']))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', default=DEFAULT_TASKS_FILE, help='JSON list of {"request", "replies"} tasks')
+    parser.add_argument('--backend', default='ollama', choices=['ollama', 'openai'])
+    parser.add_argument('--no-stream', action='store_true', help='Wait for whole replies instead of streaming steps')
+    parser.add_argument('--token-latency', type=float, default=DEFAULT_TOKEN_LATENCY,
+                        help='Seconds the stub server takes per generated token')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help='Times to run every task')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='Save this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Fraction a metric may get worse by before it counts as a regression')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's own output")
+    args = parser.parse_args()
+
+    with open(args.tasks, 'r') as file:
+        tasks = json.load(file)
+
+    results = run_benchmark(tasks, args.backend, not args.no_stream, args.token_latency, args.iterations,
+                            args.verbose)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f'\nSaved baseline to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'\nNo baseline at {args.baseline}, nothing to compare with. Run with --save-baseline on the code '
+              f'before your changes to save one.')
+        return 0
+
+    with open(args.baseline, 'r') as file:
+        regressions = compare_with_baseline(results, json.load(file), args.tolerance)
+    if regressions:
+        print(f'\nRegressed by more than {args.tolerance:.0%}: {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
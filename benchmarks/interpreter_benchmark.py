@@ -0,0 +1,96 @@
+"""
+Replays a recorded step list through the Interpreter against a fake pyautogui and reports the time spent per step,
+for every execution speed profile. Runs headless, nothing is actually typed.
+
+> python3 benchmarks/interpreter_benchmark.py [path/to/steps.json]
+
+The fake pyautogui sleeps for the delays the real one would add (PAUSE after each call, the interval between
+keystrokes), so the numbers reflect input-simulation overhead rather than the speed of the mock.
+"""
+import json
+import os
+import sys
+import time
+import types
+from typing import Any
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+DEFAULT_STEPS_FILE = os.path.join(os.path.dirname(__file__), 'recorded_steps.json')
+
+
+def make_fake_pyautogui() -> types.ModuleType:
+    fake = types.ModuleType('pyautogui')
+    fake.PAUSE = 0.1
+
+    def pause():
+        time.sleep(fake.PAUSE)
+
+    def write(message, interval=0.0):
+        time.sleep(len(message) * interval)
+        pause()
+
+    def press(keys, presses=1, interval=0.0):
+        keys = [keys] if isinstance(keys, str) else keys
+        time.sleep(len(keys) * presses * interval)
+        pause()
+
+    def hotkey(*keys, **kwargs):
+        pause()
+
+    def size():
+        return 1920, 1080
+
+    fake.write = write
+    fake.press = press
+    fake.hotkey = hotkey
+    fake.size = size
+    return fake
+
+
+def make_fake_pyperclip() -> types.ModuleType:
+    fake = types.ModuleType('pyperclip')
+    clipboard = {'text': ''}
+    fake.copy = lambda text: clipboard.update(text=text)
+    fake.paste = lambda: clipboard['text']
+    return fake
+
+
+def install_fakes() -> None:
+    sys.modules['pyautogui'] = make_fake_pyautogui()
+    sys.modules['pyperclip'] = make_fake_pyperclip()
+
+
+def benchmark_profile(steps: list[dict[str, Any]], profile: str) -> list[float]:
+    from interpreter import Interpreter
+    from utils.event_bus import EventBus
+
+    interpreter = Interpreter(EventBus(), profile)
+    interpreter.warm_up()  # Done once per session, keep it out of the per step numbers
+
+    timings = []
+    for step in steps:
+        start = time.perf_counter()
+        interpreter.process_command(step)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(steps_file: str = DEFAULT_STEPS_FILE) -> None:
+    install_fakes()
+    from interpreter import SPEED_PROFILES
+
+    with open(steps_file, 'r') as file:
+        steps = json.load(file)
+
+    results = {profile: benchmark_profile(steps, profile) for profile in SPEED_PROFILES}
+
+    print(f'\n{"step":<6}{"function":<10}' + ''.join(f'{profile:>12}' for profile in results))
+    for index, step in enumerate(steps):
+        row = ''.join(f'{timings[index] * 1000:>10.1f}ms' for timings in results.values())
+        print(f'{index:<6}{step["function"]:<10}{row}')
+    print(f'{"total":<16}' + ''.join(f'{sum(timings) * 1000:>10.1f}ms' for timings in results.values()))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,81 @@
+"""
+Measures how long importing the app takes before its window can show up, with `python -X importtime`, and fails if
+it's over budget or if a module that's supposed to load lazily (after the window is up) got imported at startup.
+Runs headless, the window isn't created.
+
+> python3 benchmarks/startup_benchmark.py [--budget-ms MS] [--runs N] [--top N]
+
+Every import costs more in a PyInstaller build, where modules are unpacked from the archive, so keep the budget tight
+and move anything heavy behind a function-level import.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+APP_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '../app'))
+
+DEFAULT_BUDGET_MS = 250.0
+DEFAULT_RUNS = 5
+
+# Imported by Core, the LLM and the voice input, all of which load on a background thread or on first use
+DEFERRED_MODULES = ['core', 'llm', 'interpreter', 'models.registry', 'utils.screen', 'httpx', 'ollama', 'numpy',
+                    'pyautogui', 'speech_recognition']
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def measure_imports(module: str = 'app') -> tuple[dict[str, tuple[int, int]], list[str]]:
+    """
+    Imports module in a fresh interpreter. Returns module name -> (self, cumulative) import time in microseconds for
+    every module it pulled in, and which of DEFERRED_MODULES got imported.
+    """
+    check = f'import sys, {module}; print(",".join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))'
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', check], cwd=APP_DIRECTORY,
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{completed.stderr[-2000:]}')
+
+    timings = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            timings[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    deferred_imported = [name for name in completed.stdout.strip().split(',') if name]
+    return timings, deferred_imported
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='Most milliseconds importing the app may take (median over runs)')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    parser.add_argument('--top', type=int, default=15, help='Slowest modules to list')
+    args = parser.parse_args()
+
+    runs = [measure_imports() for _ in range(args.runs)]
+    totals_ms = [timings['app'][1] / 1000 for timings, _ in runs]
+    total_ms = statistics.median(totals_ms)
+
+    # The slowest modules of the median run, by their own import time so nested imports aren't counted twice
+    timings, deferred_imported = sorted(runs, key=lambda run: run[0]['app'][1])[len(runs) // 2]
+    print(f'{"module":<40}{"self ms":>10}{"cumulative ms":>16}')
+    for name, (self_us, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f'{name:<40}{self_us / 1000:>10.1f}{cumulative_us / 1000:>16.1f}')
+    print(f'\nimport app: {total_ms:.1f}ms median over {args.runs} runs '
+          f'(min {min(totals_ms):.1f}ms, max {max(totals_ms):.1f}ms), budget {args.budget_ms:g}ms')
+
+    failed = False
+    if deferred_imported:
+        print(f'Imported at startup but should load lazily: {", ".join(deferred_imported)}')
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f'Over budget by {total_ms - args.budget_ms:.1f}ms')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
 
 from app import App
+from utils.event_bus import UserRequestSubmitted
 
 from multiprocessing import freeze_support
 
@@ -26,7 +27,7 @@ def simple_test(app):
 
 
 def put_requests_in_app(app, request):
-    app.ui.main_window.user_request_queue.put(request)
+    app.event_bus.publish(UserRequestSubmitted(request))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,207 @@
+# tests/stub_llm_server.py
+"""
+Tiny local stand-in for an Ollama or OpenAI-compatible (llama.cpp, vLLM) server, so model code can be exercised
+without downloading or running a model.
+
+It replies with scripted text and simulates Ollama's prompt cache: prompt_eval_count only counts the tokens after the
+longest prefix shared with the previous call (prompt + generated reply), the same way a kept-alive model reuses its
+KV cache.
+
+Run standalone with `python tests/stub_llm_server.py` and point the app's base URL at http://127.0.0.1:11434/.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+DEFAULT_REPLY = '{"steps": [{"function": "press", "parameters": {"keys": ["enter"]}, ' \
+                '"human_readable_justification": "Stub step"}], "done": "Stub done"}'
+
+
+def tokenize(text: str) -> list[str]:
+    # Rough stand-in for a real tokenizer, good enough to compare prompt sizes
+    return re.findall(r'\w+|[^\w\s]', text)
+
+
+def render_prompt(messages: list[dict[str, str]]) -> str:
+    return ''.join(f'<|{message["role"]}|>{message["content"]}' for message in messages)
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, replies: Optional[list[str]] = None, token_latency: float = 0.0, host: str = '127.0.0.1',
+                 port: int = 0):
+        super().__init__((host, port), StubLLMRequestHandler)
+        self.replies = list(replies) if replies else [DEFAULT_REPLY]
+        self.token_latency = token_latency
+        self.cached_tokens: list[str] = []
+        self.requests: list[dict] = []
+        # Streamed replies the client hung up on before they were finished
+        self.disconnects = 0
+        # Requests still being replied to
+        self.active_requests = 0
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self) -> 'StubLLMServer':
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def next_reply(self) -> str:
+        # Replies are consumed in order and the last one repeats
+        with self.lock:
+            return self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+
+    def count_prompt_eval(self, prompt: str, reply: str) -> int:
+        prompt_tokens = tokenize(prompt)
+        with self.lock:
+            shared = 0
+            for cached, new in zip(self.cached_tokens, prompt_tokens):
+                if cached != new:
+                    break
+                shared += 1
+            self.cached_tokens = prompt_tokens + tokenize(f'<|assistant|>{reply}')
+        return len(prompt_tokens) - shared
+
+
+class StubLLMRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: StubLLMServer
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def read_json_body(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b'{}'
+        request = json.loads(body or b'{}')
+        # The client's port tells requests on the same kept-alive connection apart from new connections
+        self.server.requests.append({'path': self.path, 'body': request, 'client_port': self.client_address[1]})
+        return request
+
+    def send_json(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip('/') == '/api/tags':
+            self.send_json({'models': [{'name': 'stub:latest', 'model': 'stub:latest'}]})
+        elif self.path.rstrip('/') == '/v1/models':
+            self.send_json({'object': 'list', 'data': [{'id': 'stub', 'object': 'model'}]})
+        else:
+            self.send_json({'error': f'unknown path {self.path}'}, status=404)
+
+    def do_POST(self) -> None:
+        with self.server.lock:
+            self.server.active_requests += 1
+        try:
+            if self.path.rstrip('/') == '/api/chat':
+                self.handle_ollama_chat(self.read_json_body())
+            elif self.path.rstrip('/') == '/v1/chat/completions':
+                self.handle_openai_chat(self.read_json_body())
+            else:
+                self.send_json({'error': f'unknown path {self.path}'}, status=404)
+        except ConnectionError:
+            # The client closed the connection mid-reply, the way a stopped stream does
+            with self.server.lock:
+                self.server.disconnects += 1
+            self.close_connection = True
+        finally:
+            with self.server.lock:
+                self.server.active_requests -= 1
+
+    def handle_ollama_chat(self, request: dict) -> None:
+        reply = self.server.next_reply()
+        prompt_eval_count = self.server.count_prompt_eval(render_prompt(request.get('messages', [])), reply)
+        final = {
+            'model': request.get('model'),
+            'done': True,
+            'prompt_eval_count': prompt_eval_count,
+            'eval_count': len(tokenize(reply)),
+        }
+
+        if not request.get('stream', True):
+            time.sleep(self.server.token_latency * len(tokenize(reply)))
+            self.send_json({**final, 'message': {'role': 'assistant', 'content': reply}})
+            return
+
+        # Ollama streams newline delimited JSON objects
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for piece in re.findall(r'\S+\s*|\s+', reply):
+            time.sleep(self.server.token_latency)
+            self.write_chunk({'model': request.get('model'), 'done': False,
+                              'message': {'role': 'assistant', 'content': piece}})
+        self.write_chunk({**final, 'message': {'role': 'assistant', 'content': ''}})
+        self.wfile.write(b'0\r\n\r\n')
+
+    def handle_openai_chat(self, request: dict) -> None:
+        reply = self.server.next_reply()
+        messages = [{'role': message['role'], 'content': get_text_content(message['content'])}
+                    for message in request.get('messages', [])]
+        usage = {'prompt_tokens': self.server.count_prompt_eval(render_prompt(messages), reply),
+                 'completion_tokens': len(tokenize(reply))}
+
+        if not request.get('stream'):
+            time.sleep(self.server.token_latency * len(tokenize(reply)))
+            self.send_json({'object': 'chat.completion', 'model': request.get('model'), 'usage': usage,
+                            'choices': [{'index': 0, 'finish_reason': 'stop',
+                                         'message': {'role': 'assistant', 'content': reply}}]})
+            return
+
+        # Server-sent events, one "data:" line per token and a final usage chunk if asked for
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for piece in re.findall(r'\S+\s*|\s+', reply):
+            time.sleep(self.server.token_latency)
+            self.write_event({'object': 'chat.completion.chunk', 'model': request.get('model'),
+                              'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+        if request.get('stream_options', {}).get('include_usage'):
+            self.write_event({'object': 'chat.completion.chunk', 'model': request.get('model'), 'choices': [],
+                              'usage': usage})
+        self.write_chunk_data(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, payload: dict) -> None:
+        self.write_chunk_data(json.dumps(payload).encode() + b'\n')
+
+    def write_event(self, payload: dict) -> None:
+        self.write_chunk_data(b'data: ' + json.dumps(payload).encode() + b'\n\n')
+
+    def write_chunk_data(self, data: bytes) -> None:
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def get_text_content(content) -> str:
+    # OpenAI message content is either a string or a list of parts, images among them
+    if isinstance(content, str):
+        return content
+    return ''.join(part.get('text', '') for part in content if part.get('type') == 'text')
+
+
+if __name__ == '__main__':
+    server = StubLLMServer(port=11434)
+    print(f'Stub LLM server listening on {server.base_url}')
+    server.serve_forever()
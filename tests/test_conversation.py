@@ -0,0 +1,86 @@
+# tests/test_conversation.py
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from models.conversation import KEEP_RECENT_TURNS, MAX_SUMMARY_LINES, Conversation
+from models.session import PromptSession
+
+
+def make_reply(step_num: int) -> str:
+    steps = [{'function': 'write', 'parameters': {'string': f'line {step_num} ' * 20},
+              'human_readable_justification': f'Type line {step_num}'}]
+    return json.dumps({'steps': steps, 'done': None}, indent=4)
+
+
+def run_step(conversation: Conversation, step_num: int) -> None:
+    conversation.start_step(step_num, json.dumps({'original_user_request': 'Write a poem', 'step_num': step_num}))
+    conversation.add_reply(make_reply(step_num))
+
+
+class TestConversation(unittest.TestCase):
+    def test_replies_are_kept_compact(self):
+        conversation = Conversation(10000)
+        run_step(conversation, 0)
+        conversation.start_step(1, 'step 1', images=['aGVsbG8='])
+
+        user_0, assistant_0, user_1 = conversation.get_messages()
+        self.assertEqual(json.loads(assistant_0['content']), json.loads(make_reply(0)))
+        self.assertNotIn('\n', assistant_0['content'])
+        self.assertNotIn('images', user_0)
+        self.assertEqual(user_1['images'], ['aGVsbG8='])
+
+    def test_old_turns_are_summarized_within_budget(self):
+        conversation = Conversation(400)
+        for step_num in range(6):
+            run_step(conversation, step_num)
+            self.assertLessEqual(conversation.estimate_tokens(), 400 + 200)  # At most the newest turn over
+
+        self.assertGreaterEqual(len(conversation.turns), KEEP_RECENT_TURNS)
+        self.assertLess(len(conversation.turns), 6)
+        summarized = 6 - len(conversation.turns)
+        self.assertEqual(len(conversation.summary), summarized)
+        self.assertTrue(conversation.summary[0].startswith('step 0: write {"string":"line 0 line 0'))
+
+        first_message = conversation.get_messages()[0]
+        self.assertEqual(first_message['role'], 'user')
+        self.assertTrue(first_message['content'].startswith('Earlier steps of this request, already executed:\n'))
+        roles = [message['role'] for message in conversation.get_messages()]
+        self.assertEqual(roles, ['user', 'assistant'] * len(conversation.turns))
+
+    def test_history_is_bounded(self):
+        conversation = Conversation(10 ** 6, max_turns=3)
+        for step_num in range(MAX_SUMMARY_LINES + 10):
+            run_step(conversation, step_num)
+
+        self.assertLessEqual(len(conversation.turns), 3)
+        self.assertEqual(len(conversation.summary), MAX_SUMMARY_LINES)
+        self.assertIn('earlier steps omitted', conversation.get_summary())
+
+    def test_unanswered_and_discarded_steps(self):
+        conversation = Conversation(10000)
+        run_step(conversation, 0)
+        conversation.start_step(1, 'step 1')
+        conversation.start_step(1, 'step 1 again')
+        self.assertEqual([turn.request for turn in conversation.turns][1:], ['step 1 again'])
+
+        conversation.discard_step(1)
+        self.assertEqual([turn.step_num for turn in conversation.turns], [0])
+
+    def test_replayed_steps_go_into_the_summary(self):
+        session = PromptSession('System prompt')
+        session.get_messages_for_step('previous request', 0)
+        session.add_replayed_steps(0, [{'function': 'hotkey', 'parameters': {'keys': ['command', 'space']}}],
+                                   'plan cache')
+        messages = session.get_messages_for_step('step 1', 1)
+
+        self.assertEqual([message['role'] for message in messages], ['system', 'user'])
+        self.assertEqual(messages[1]['content'], 'Earlier steps of this request, already executed:\n'
+                                                 'step 0 (plan cache): hotkey {"keys":["command","space"]}\nstep 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
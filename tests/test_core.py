@@ -0,0 +1,349 @@
+# tests/test_core.py
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from typing import Callable
+from unittest.mock import patch
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+import core
+import llm
+from core import Core, RequestOutcome
+from models.registry import model_registry
+from stub_llm_server import StubLLMServer
+from utils.screen_transitions import ScreenTransitions
+from utils.settings import Settings
+from utils.tracing import tracer
+
+
+def step(function: str, parameters: dict, justification: str = 'Test step') -> dict:
+    return {'function': function, 'parameters': parameters, 'human_readable_justification': justification}
+
+
+DONE_REPLY = json.dumps({'steps': [step('press', {'keys': ['enter']})], 'done': 'Request B done'})
+# A first step, then enough text after it to still be generating when the request is stopped
+LONG_REPLY = json.dumps({'steps': [step('press', {'keys': ['enter']})], 'done': 'Request A ' + 'and ' * 40 + 'done'})
+# Slower to finish than the rest of LONG_REPLY, so a stream left running for request A would end during this one
+SLOW_REPLY = json.dumps({'steps': [step('press', {'keys': ['enter']})], 'done': 'Request B ' + 'and ' * 150 + 'done'})
+# Takes a while before its first step is complete
+SLOW_FIRST_STEP_REPLY = json.dumps({'steps': [step('press', {'keys': ['enter']}, 'Slow ' + 'and ' * 150 + 'slow')],
+                                    'done': 'Too late'})
+NOT_DONE_REPLY = json.dumps({'steps': [step('press', {'keys': ['enter']})], 'done': None})
+INVALID_REPLY = 'Sure! First press enter, then you are done.'
+
+
+# Screens with different perceptual hashes: brightness going left to right, right to left, and vertical stripes
+SCREEN_BEFORE = Image.linear_gradient('L').rotate(90).convert('RGB')
+SCREEN_AFTER = Image.linear_gradient('L').rotate(270).convert('RGB')
+SCREEN_UNEXPECTED = Image.frombytes('L', (8, 1), bytes([0, 255] * 4)).resize((256, 256)).convert('RGB')
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class CoreTestCase(unittest.TestCase):
+    """
+    Runs requests end to end against StubLLMServer, with a recording input backend so nothing is typed and without
+    screenshots or anything that writes to disk.
+    """
+
+    def setUp(self):
+        self.server = StubLLMServer([DONE_REPLY]).start()
+        self.settings = {'model': 'stub', 'base_url': self.server.base_url, 'input_backend': 'recording',
+                         'send_screenshots': False, 'plan_cache': False, 'macros': False, 'few_shot_examples': 0,
+                         'replace_sleeps_with_stable_screen_wait': False, 'stream_steps': True}
+        for patcher in (patch.object(Settings, 'get_dict', return_value=self.settings),
+                        patch.object(llm.LLM, 'read_context_txt_file', return_value='Test context'),
+                        patch.object(llm, 'shared_llm', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.core = Core()
+        self.core.llm.wait_until_model_ready(5)
+
+    def tearDown(self):
+        self.core.cleanup()
+        # A blocking call that timed out is still waiting for its reply, closing the client under it would break the
+        # next test's connections
+        wait_for(lambda: self.server.active_requests == 0)
+        model_registry.close()
+        self.server.stop()
+
+    def get_conversation(self) -> list[dict]:
+        return self.core.llm.model.session.conversation.get_messages()
+
+    def get_step_messages(self) -> list[dict]:
+        # The last message of each request the model was sent for a step, leaving out warm up
+        return [request['body']['messages'][-1] for request in self.server.requests
+                if request['body']['messages'][-1]['role'] == 'user']
+
+
+class TestCore(CoreTestCase):
+    def test_stopping_a_streamed_request_leaves_the_next_one_alone(self):
+        self.server.replies = [LONG_REPLY, SLOW_REPLY]
+        self.server.token_latency = 0.01
+        request_a = self.core.submit_user_request('Request A')
+        # Stop once A's step ran, while the model is still generating the rest
+        self.assertTrue(wait_for(lambda: self.core.interpreter.backend.events))
+        self.core.stop_previous_request()
+        self.assertEqual(request_a.result(5).outcome, RequestOutcome.INTERRUPTED)
+
+        result = self.core.execute_user_request('Request B')
+        self.assertEqual(result.outcome, RequestOutcome.DONE)
+
+        # A's stream was closed rather than read to the end, and its reply never joined B's conversation
+        self.assertEqual(self.server.disconnects, 1)
+        conversation = self.get_conversation()
+        self.assertEqual([message['role'] for message in conversation], ['user', 'assistant'])
+        self.assertIn('Request B', conversation[0]['content'])
+        self.assertTrue(json.loads(conversation[1]['content'])['done'].startswith('Request B'))
+
+    def test_step_timeout_while_streaming(self):
+        self.settings.update({'step_timeout_secs': 0.5, 'request_timeout_secs': 60})
+        self.server.replies = [SLOW_FIRST_STEP_REPLY]
+        self.server.token_latency = 0.02
+
+        result = self.core.execute_user_request('Slow request')
+
+        self.assertEqual(result.outcome, RequestOutcome.TIMED_OUT)
+        self.assertLess(result.duration_secs, 1.5)
+        self.assertEqual(self.core.interpreter.backend.events, [])
+        # The stream is closed rather than left generating
+        self.assertTrue(wait_for(lambda: self.server.disconnects == 1))
+
+    def test_request_timeout_while_streaming(self):
+        self.settings.update({'step_timeout_secs': 60, 'request_timeout_secs': 1})
+        self.server.replies = [NOT_DONE_REPLY, SLOW_FIRST_STEP_REPLY]
+        self.server.token_latency = 0.02
+
+        result = self.core.execute_user_request('Slow request')
+
+        self.assertEqual(result.outcome, RequestOutcome.TIMED_OUT)
+        self.assertEqual(result.steps_taken, 2)
+        self.assertLess(result.duration_secs, 2)
+        self.assertEqual(len(self.core.interpreter.backend.events), 1)
+        self.assertTrue(wait_for(lambda: self.server.disconnects == 1))
+
+    def test_cleanup_unsubscribes_from_settings(self):
+        subscribers = self.core.settings.store.subscribers
+        self.assertIn(self.core.apply_settings, subscribers)
+
+        self.core.cleanup()
+
+        self.assertNotIn(self.core.apply_settings, subscribers)
+        self.assertNotIn(self.core.llm.apply_settings, subscribers)
+
+    def test_max_steps_reached(self):
+        self.settings['max_steps'] = 2
+        self.server.replies = [NOT_DONE_REPLY] * 3
+
+        result = self.core.execute_user_request('Never done')
+
+        self.assertEqual(result.outcome, RequestOutcome.MAX_STEPS_REACHED)
+        self.assertEqual(result.steps_taken, 2)
+        self.assertEqual(len(self.core.interpreter.backend.events), 2)
+        self.assertEqual(len(self.get_step_messages()), 2)
+
+    def test_invalid_json_is_asked_for_again(self):
+        self.server.replies = [INVALID_REPLY, DONE_REPLY]
+
+        result = self.core.execute_user_request('Request B')
+
+        self.assertEqual(result.outcome, RequestOutcome.DONE)
+        first, retry = self.get_step_messages()
+        self.assertNotIn('valid JSON', first['content'])
+        self.assertIn('Please reply in valid JSON', retry['content'])
+        # The retry replaced the unanswered message rather than following it
+        self.assertEqual([message['role'] for message in self.get_conversation()], ['user', 'assistant'])
+
+    def test_invalid_json_twice_fails(self):
+        self.server.replies = [INVALID_REPLY, INVALID_REPLY]
+
+        result = self.core.execute_user_request('Request B')
+
+        self.assertEqual(result.outcome, RequestOutcome.FAILED)
+        self.assertEqual(len(self.get_step_messages()), 2)
+        self.assertEqual(self.core.interpreter.backend.events, [])
+
+    def test_streamed_reply_records_an_llm_span(self):
+        traces = []
+        for patcher in (patch.object(tracer, 'enabled', True), patch.object(core, 'save_trace', traces.append)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.assertEqual(self.core.execute_user_request('Request B').outcome, RequestOutcome.DONE)
+
+        self.assertTrue(wait_for(lambda: traces))
+        spans = {span.name: span for span in traces[0].spans}
+        self.assertEqual(spans['llm'].args['step_num'], 0)
+        self.assertTrue(spans['llm'].args['stream'])
+        # From asking for the reply until the last of it was read
+        self.assertLessEqual(spans['llm'].start, spans['time_to_first_token'].start)
+        self.assertGreaterEqual(spans['llm'].end, spans['generation'].end)
+
+
+class TestCoreWithoutStreaming(CoreTestCase):
+    # Whole replies, stream_steps off
+    def setUp(self):
+        super().setUp()
+        self.settings['stream_steps'] = False
+
+    def test_steps_run_once_the_reply_is_complete(self):
+        self.server.replies = [NOT_DONE_REPLY, DONE_REPLY]
+
+        result = self.core.execute_user_request('Request B')
+
+        self.assertEqual(result.outcome, RequestOutcome.DONE)
+        self.assertEqual(result.message, 'Request B done')
+        self.assertEqual(result.steps_taken, 2)
+        self.assertEqual(len(self.core.interpreter.backend.events), 2)
+        self.assertTrue(all(not request['body'].get('stream', True) for request in self.server.requests
+                            if request['body']['messages'][-1]['role'] == 'user'))
+        self.assertEqual([message['role'] for message in self.get_conversation()], ['user', 'assistant'] * 2)
+
+    def test_invalid_json_is_asked_for_again(self):
+        self.server.replies = [INVALID_REPLY, DONE_REPLY]
+
+        result = self.core.execute_user_request('Request B')
+
+        self.assertEqual(result.outcome, RequestOutcome.DONE)
+        self.assertIn('Please reply in valid JSON', self.get_step_messages()[-1]['content'])
+
+    def test_invalid_json_twice_fails(self):
+        self.server.replies = [INVALID_REPLY, INVALID_REPLY]
+        self.assertEqual(self.core.execute_user_request('Request B').outcome, RequestOutcome.FAILED)
+
+    def test_step_timeout(self):
+        self.settings.update({'step_timeout_secs': 0.5, 'request_timeout_secs': 60})
+        self.server.replies = [SLOW_FIRST_STEP_REPLY]
+        self.server.token_latency = 0.01
+
+        result = self.core.execute_user_request('Slow request')
+
+        self.assertEqual(result.outcome, RequestOutcome.TIMED_OUT)
+        self.assertLess(result.duration_secs, 1.5)
+        self.assertEqual(self.core.interpreter.backend.events, [])
+
+    def test_request_timeout(self):
+        self.settings.update({'step_timeout_secs': 60, 'request_timeout_secs': 1})
+        self.server.replies = [NOT_DONE_REPLY, SLOW_FIRST_STEP_REPLY]
+        self.server.token_latency = 0.01
+
+        result = self.core.execute_user_request('Slow request')
+
+        self.assertEqual(result.outcome, RequestOutcome.TIMED_OUT)
+        self.assertEqual(result.steps_taken, 2)
+        self.assertLess(result.duration_secs, 2)
+        self.assertEqual(len(self.core.interpreter.backend.events), 1)
+
+
+class TestSpeculativePrefetch(CoreTestCase):
+    """
+    With speculative_prefetch on, step 1 is requested while step 0's steps run, betting the screen ends up where it
+    did the last time these steps ran from this screen.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.settings['speculative_prefetch'] = True
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.core.screen_transitions = ScreenTransitions(os.path.join(directory.name, 'screen_transitions.json'))
+        # The screen changes once the request's first step ran
+        self.screen_after = SCREEN_AFTER
+        self.steps_before_request = 0
+        self.core.screen.get_screenshot = lambda: SCREEN_BEFORE \
+            if len(self.core.interpreter.backend.events) == self.steps_before_request else self.screen_after
+
+    def run_request(self, replies: list[str]):
+        self.server.replies = replies
+        self.steps_before_request = len(self.core.interpreter.backend.events)
+        return self.core.execute_user_request('Open the menu and pick an item')
+
+    def get_step_requests(self, step_num: int) -> list[dict]:
+        # Leaving out warm up, which only sends the system prompt
+        return [request for request in self.server.requests if request['body']['messages'][-1]['role'] == 'user'
+                and json.loads(request['body']['messages'][-1]['content'])['step_num'] == step_num]
+
+    def test_prefetched_plan_used_when_screen_matches(self):
+        self.assertEqual(self.run_request([NOT_DONE_REPLY, DONE_REPLY]).prefetched_steps, 0)
+
+        result = self.run_request([NOT_DONE_REPLY, DONE_REPLY])
+
+        self.assertEqual(result.outcome, RequestOutcome.DONE)
+        self.assertEqual(result.prefetched_steps, 1)
+        self.assertEqual(len(self.get_step_requests(1)), 2)  # One per request, the second one ahead of time
+        self.assertEqual([message['role'] for message in self.get_conversation()], ['user', 'assistant'] * 2)
+
+    def test_prefetched_plan_discarded_when_screen_differs(self):
+        self.run_request([NOT_DONE_REPLY, DONE_REPLY])
+        self.screen_after = SCREEN_UNEXPECTED
+
+        result = self.run_request([NOT_DONE_REPLY, NOT_DONE_REPLY, DONE_REPLY])
+
+        self.assertEqual(result.outcome, RequestOutcome.DONE)
+        self.assertEqual(result.prefetched_steps, 0)
+        self.assertEqual(len(self.get_step_requests(1)), 3)  # The prefetch and asking again after it was discarded
+        conversation = self.get_conversation()
+        self.assertEqual([message['role'] for message in conversation], ['user', 'assistant'] * 2)
+        self.assertEqual(json.loads(conversation[-1]['content'])['done'], 'Request B done')
+
+    def test_discarded_prefetch_still_streaming_is_stopped(self):
+        self.run_request([NOT_DONE_REPLY, DONE_REPLY])
+        self.screen_after = SCREEN_UNEXPECTED
+        self.server.token_latency = 0.01
+
+        # The prefetch gets the slow reply, it's still generating when the screen turns out different
+        result = self.run_request([NOT_DONE_REPLY, SLOW_FIRST_STEP_REPLY, DONE_REPLY])
+
+        self.assertEqual(result.outcome, RequestOutcome.DONE)
+        self.assertEqual(result.prefetched_steps, 0)
+        self.assertEqual(self.server.disconnects, 1)
+        self.assertLess(result.duration_secs, 1.5)
+        conversation = self.get_conversation()
+        self.assertEqual([message['role'] for message in conversation], ['user', 'assistant'] * 2)
+        self.assertEqual(json.loads(conversation[-1]['content'])['done'], 'Request B done')
+
+
+class TestScreenshots(CoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.settings.update({'send_screenshots': True, 'screenshot_change_detection': True})
+        self.captures = 0
+
+        def get_screenshot():
+            self.captures += 1
+            return SCREEN_BEFORE
+        self.core.screen.get_screenshot = get_screenshot
+
+    def test_step_0_is_sent_without_a_screenshot(self):
+        self.assertIsNone(self.core.capture_screenshot(0))
+        self.assertEqual(self.captures, 0)
+
+        self.server.replies = [NOT_DONE_REPLY, NOT_DONE_REPLY, DONE_REPLY]
+        self.assertEqual(self.core.execute_user_request('Open the menu').outcome, RequestOutcome.DONE)
+
+        step_0, step_1, step_2 = self.get_step_messages()
+        self.assertNotIn('images', step_0)
+        self.assertNotIn('screenshot', json.loads(step_0['content']))
+        self.assertEqual(len(step_1['images']), 1)
+        self.assertEqual(json.loads(step_1['content'])['screenshot'], 'attached image')
+        # Same screen as the step before, it isn't sent again
+        self.assertNotIn('images', step_2)
+        self.assertIn('unchanged', json.loads(step_2['content'])['screenshot'])
+
+
+if __name__ == '__main__':
+    unittest.main()
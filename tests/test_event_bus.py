@@ -0,0 +1,60 @@
+# tests/test_event_bus.py
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.event_bus import CoalescingSubscriber, Event, EventBus, StatusUpdate, StepStarted
+
+
+class TestEventBus(unittest.TestCase):
+    def test_subscribers_get_events_of_their_type_and_subclasses(self):
+        bus = EventBus()
+        statuses, everything = [], []
+        bus.subscribe(StatusUpdate, statuses.append)
+        bus.subscribe(Event, everything.append)
+
+        bus.publish(StatusUpdate('Fetching Instructions'))
+        bus.publish(StepStarted('press', {'keys': ['enter']}, 'Submit'))
+
+        self.assertEqual([event.message for event in statuses], ['Fetching Instructions'])
+        self.assertEqual([event.status_text for event in everything], ['Fetching Instructions', 'Submit'])
+
+    def test_unsubscribe_and_failing_subscriber(self):
+        bus = EventBus()
+        received = []
+
+        def fail(event):
+            raise RuntimeError('broken subscriber')
+
+        bus.subscribe(StatusUpdate, fail)
+        unsubscribe = bus.subscribe(StatusUpdate, received.append)
+        bus.publish(StatusUpdate('first'))
+        unsubscribe()
+        bus.publish(StatusUpdate('second'))
+
+        self.assertEqual([event.message for event in received], ['first'])
+
+    def test_coalescing_subscriber_keeps_only_latest_event(self):
+        flushed = []
+        subscriber = CoalescingSubscriber(flushed.append)
+        bus = EventBus()
+        bus.subscribe(StatusUpdate, subscriber)
+
+        threads = [threading.Thread(target=lambda n=n: bus.publish(StatusUpdate(f'step {n}'))) for n in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        bus.publish(StatusUpdate('last'))
+
+        self.assertTrue(subscriber.flush())
+        self.assertFalse(subscriber.flush())
+        self.assertEqual([event.message for event in flushed], ['last'])
+        self.assertEqual(subscriber.dropped, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
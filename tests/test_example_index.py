@@ -0,0 +1,75 @@
+# tests/test_example_index.py
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.example_index import ExampleIndex, vectorize
+
+OPEN_CHROME = [[{'function': 'hotkey', 'parameters': {'keys': ['command', 'space']},
+                 'human_readable_justification': 'Open spotlight'},
+                {'function': 'write', 'parameters': {'string': 'Chrome'}, 'human_readable_justification': 'Search'}],
+               [{'function': 'press', 'parameters': {'keys': ['enter']}, 'human_readable_justification': 'Launch'}]]
+
+
+class TestExampleIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_index(self, **kwargs) -> ExampleIndex:
+        return ExampleIndex(self.directory.name, **kwargs)
+
+    def test_vectorize(self):
+        self.assertAlmostEqual(float(np.linalg.norm(vectorize('Open Chrome please'))), 1.0, places=5)
+        self.assertAlmostEqual(float(vectorize('Open Chrome') @ vectorize('  open   chrome. ')), 1.0, places=5)
+        similar = float(vectorize('Open Chrome and go to youtube') @ vectorize('Open Chrome and go to gmail'))
+        unrelated = float(vectorize('Open Chrome and go to youtube') @ vectorize('Write a poem in Notes'))
+        self.assertGreater(similar, 0.5)
+        self.assertLess(unrelated, similar)
+        self.assertFalse(vectorize('the').any())
+
+    def test_search_finds_similar_requests_and_persists(self):
+        index = self.make_index()
+        index.add('Open Chrome and go to youtube', OPEN_CHROME, 'Opened YouTube')
+        index.add('Write a poem in Notes', [[{'function': 'write', 'parameters': {'string': 'Roses'}}]], 'Written')
+
+        (similarity, example), = self.make_index().search('open chrome and go to gmail', k=3)
+        self.assertGreater(similarity, 0.5)
+        self.assertEqual(example['request'], 'open chrome and go to youtube')
+        self.assertEqual(example['batches'][0][0], {'function': 'hotkey', 'parameters': {'keys': ['command', 'space']}})
+        self.assertEqual(example['done'], 'Opened YouTube')
+        self.assertEqual(self.make_index().search('Order a pizza', k=3), [])
+
+    def test_newer_run_replaces_older_and_oldest_evicted(self):
+        index = self.make_index(max_examples=2)
+        index.add('Open Chrome', OPEN_CHROME, 'First')
+        index.add('Open Notes', OPEN_CHROME, 'Notes')
+        index.add('open chrome.', OPEN_CHROME, 'Second')
+        self.assertEqual([example['done'] for example in index.examples], ['Notes', 'Second'])
+
+        index.add('Open Calculator', OPEN_CHROME, 'Calculator')
+        index = self.make_index(max_examples=2)
+        self.assertEqual([example['done'] for example in index.examples], ['Second', 'Calculator'])
+        self.assertEqual(index.vectors.shape[0], 2)
+        self.assertEqual(index.search('open chrome', k=1)[0][1]['done'], 'Second')
+
+    def test_requests_without_steps_and_unreadable_index_ignored(self):
+        index = self.make_index()
+        index.add('Hello', [[]], 'Hi')
+        self.assertEqual(len(index), 0)
+
+        index.add('Open Chrome', OPEN_CHROME, 'Opened')
+        with open(index.metadata_path, 'w') as file:
+            file.write('[]')
+        self.assertEqual(len(self.make_index()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
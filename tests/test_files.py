@@ -0,0 +1,56 @@
+# tests/test_files.py
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.files import atomic_write, atomic_write_json
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'nested', 'data.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.file_path) as file:
+            return json.load(file)
+
+    def test_writes_json_and_creates_directory(self):
+        atomic_write_json(self.file_path, {'a': 1}, indent=4)
+        self.assertEqual(self.read(), {'a': 1})
+        self.assertEqual(os.listdir(os.path.dirname(self.file_path)), ['data.json'])
+
+    def test_failed_write_keeps_old_file(self):
+        atomic_write_json(self.file_path, {'a': 1})
+
+        def fail(file):
+            file.write('{"a": ')
+            raise RuntimeError('disk full')
+        with self.assertRaises(RuntimeError):
+            atomic_write(self.file_path, fail)
+
+        self.assertEqual(self.read(), {'a': 1})
+        self.assertEqual(os.listdir(os.path.dirname(self.file_path)), ['data.json'])
+
+    def test_concurrent_writers_leave_one_complete_file(self):
+        payloads = [{'writer': writer, 'data': 'x' * 100_000} for writer in range(8)]
+        threads = [threading.Thread(target=atomic_write_json, args=(self.file_path, payload)) for payload in payloads]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn(self.read(), payloads)
+        self.assertEqual(os.listdir(os.path.dirname(self.file_path)), ['data.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# tests/test_instructions_parser.py
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from models.instructions_parser import InstructionStream, StreamingInstructionsParser, parse_instructions, repair_json
+from models.instructions_schema import validate_instructions
+
+LLM_REPLY = '```json\n{"steps": [{"function": "press", "parameters": {"keys": ["command", "space"]}, ' \
+            '"human_readable_justification": "Open {spotlight}"}, {"function": "write", "parameters": ' \
+            '{"string": "Chrome \\"beta\\""}, "human_readable_justification": "Type app name"}], "done": null}\n```'
+
+
+class TestStreamingInstructionsParser(unittest.TestCase):
+    def test_steps_are_emitted_as_soon_as_they_close(self):
+        parser = StreamingInstructionsParser()
+        first_step_end = LLM_REPLY.index('}, {"function": "write"') + 1
+
+        self.assertEqual(parser.feed(LLM_REPLY[:first_step_end - 1]), [])
+        first = parser.feed(LLM_REPLY[first_step_end - 1:first_step_end])
+        self.assertEqual([step['function'] for step in first], ['press'])
+
+        rest = parser.feed(LLM_REPLY[first_step_end:])
+        self.assertEqual([step['function'] for step in rest], ['write'])
+        self.assertEqual(rest[0]['parameters']['string'], 'Chrome "beta"')
+        self.assertIsNone(parser.get_instructions()['done'])
+
+    def test_character_by_character_stream(self):
+        stream = InstructionStream(iter(LLM_REPLY))
+        steps = list(stream)
+
+        self.assertEqual(len(steps), 2)
+        self.assertEqual(stream.get_instructions().steps, steps)
+
+    def test_truncated_reply_keeps_completed_steps(self):
+        parser = StreamingInstructionsParser()
+        parser.feed(LLM_REPLY[:LLM_REPLY.index('"function": "write"')])
+
+        self.assertEqual(parser.get_instructions(), {'steps': parser.steps, 'done': None})
+        self.assertEqual(len(parser.steps), 1)
+
+    def test_invalid_reply(self):
+        parser = StreamingInstructionsParser()
+        parser.feed('I cannot help with that.')
+
+        self.assertEqual(parser.get_instructions(), {})
+
+    def test_invalid_step_stops_the_stream(self):
+        reply = '{"steps": [{"function": "press", "parameters": {"keys": ["enter"]}}, ' \
+                '{"parameters": {"string": "hi"}}, {"function": "press", "parameters": {}}], "done": null}'
+        stream = InstructionStream(iter(reply))
+
+        self.assertEqual([step['function'] for step in stream], ['press'])
+        self.assertEqual(stream.parser.errors, ['steps[1].function: missing'])
+        self.assertEqual(stream.get_instructions().to_dict(), {'steps': stream.parser.steps, 'done': None})
+
+
+class TestRepair(unittest.TestCase):
+    def test_trailing_commas_and_code_fences(self):
+        reply = 'Sure!\n```json\n{"steps": [{"function": "press", "parameters": {"keys": ["a", "b",],},},], ' \
+                '"done": "ok",}\n```\nLet me know {if} you need more.'
+
+        instructions = parse_instructions(reply)
+        self.assertEqual(instructions['steps'][0]['parameters'], {'keys': ['a', 'b']})
+        self.assertEqual(instructions['done'], 'ok')
+
+    def test_truncated_reply_drops_the_unfinished_step(self):
+        reply = '{"steps": [{"function": "press", "parameters": {"keys": ["enter"]}}, ' \
+                '{"function": "write", "parameters": {"string": "Hel'
+
+        self.assertEqual(repair_json(reply), '{"steps": [{"function": "press", "parameters": {"keys": ["enter"]}}]}')
+        self.assertEqual(parse_instructions(reply)['done'], None)
+
+    def test_braces_inside_strings(self):
+        reply = '{"steps": [{"function": "write", "parameters": {"string": "a}, ]{\\"b"}},], "done": null'
+
+        self.assertEqual(parse_instructions(reply)['steps'][0]['parameters']['string'], 'a}, ]{"b')
+
+    def test_nothing_to_salvage(self):
+        self.assertIsNone(repair_json('I cannot help with that.'))
+        self.assertEqual(repair_json('{"steps": [{"function": "pre'), '{"steps": []}')
+        self.assertEqual(parse_instructions('{"steps": [{"function": "pre'), {})
+
+
+class TestValidation(unittest.TestCase):
+    def test_reports_the_bad_step(self):
+        instructions = {'steps': [{'function': 'press', 'parameters': {}},
+                                  {'function': 'write', 'parameters': 'hello'},
+                                  'click'],
+                        'done': 1}
+
+        self.assertEqual(validate_instructions(instructions), [
+            'steps[1].parameters: expected an object, got str',
+            'steps[2]: expected an object, got str',
+            'done: expected a string or null, got int',
+        ])
+
+    def test_valid_instructions(self):
+        self.assertEqual(validate_instructions({'steps': [{'function': 'sleep', 'parameters': {'secs': 1}}]}), [])
+        self.assertEqual(validate_instructions(None), ['reply: no JSON object found'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# tests/test_interpreter.py
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from interpreter import Interpreter
+from utils.event_bus import EventBus, StepFinished, StepStarted
+from utils.input_backends import InputCall, RecordingBackend, XdotoolBackend
+
+STEPS = [
+    {'function': 'hotkey', 'parameters': {'keys': ['command', 'space']}, 'human_readable_justification': 'Spotlight'},
+    {'function': 'write', 'parameters': {'text': 'Chrome', 'interval': 0.5}, 'human_readable_justification': 'Type'},
+    {'function': 'press', 'parameters': {'key': 'enter'}, 'human_readable_justification': 'Launch'},
+    {'function': 'sleep', 'parameters': {'secs': 0.01}, 'human_readable_justification': 'Wait'},
+    {'function': 'write', 'parameters': {'string': 'x' * 50}, 'human_readable_justification': 'Long text'},
+]
+
+
+class TestInterpreter(unittest.TestCase):
+    def setUp(self):
+        self.backend = RecordingBackend()
+        self.event_bus = EventBus()
+        # STEPS has a fixed sleep, and there's no screen to wait on
+        self.interpreter = Interpreter(self.event_bus, 'fast', self.backend, replace_sleeps=False)
+
+    def test_consecutive_keyboard_commands_are_batched(self):
+        self.assertTrue(self.interpreter.process_commands(STEPS))
+
+        batches = [event.batch_index for event in self.backend.events]
+        self.assertEqual(batches, [0, 0, 0, 0, 1])
+        self.assertEqual(self.backend.get_function_names(), ['hotkey', 'sleep', 'write', 'press', 'paste'])
+
+    def test_typing_interval_is_capped_by_profile(self):
+        self.interpreter.process_command(STEPS[1])
+
+        self.assertEqual(self.backend.events[0].call, InputCall('write', ('Chrome',), {'interval': 0.02}))
+
+    def test_every_command_is_published_as_started_and_finished(self):
+        events = []
+        self.event_bus.subscribe(StepStarted, events.append)
+        self.event_bus.subscribe(StepFinished, events.append)
+
+        self.interpreter.process_commands(STEPS)
+
+        self.assertEqual([event.justification for event in events if isinstance(event, StepStarted)],
+                         [step['human_readable_justification'] for step in STEPS])
+        finished = [event for event in events if isinstance(event, StepFinished)]
+        self.assertEqual(sorted(event.function for event in finished), sorted(step['function'] for step in STEPS))
+        self.assertTrue(all(event.succeeded for event in finished))
+
+    def test_malformed_command_fails_batch(self):
+        success = self.interpreter.process_commands([{'function': 'hotkey', 'parameters': {}}])
+
+        self.assertFalse(success)
+
+    def test_long_writes_are_pasted(self):
+        self.interpreter.process_command({'function': 'write', 'parameters': {'string': 'x' * 39}})
+        self.interpreter.process_command({'function': 'write', 'parameters': {'string': 'x' * 40}})
+
+        self.assertEqual(self.backend.get_function_names(), ['write', 'paste'])
+        self.assertEqual(self.backend.events[1].call, InputCall('paste', ('x' * 40,)))
+
+    def test_typing_interval_is_capped(self):
+        write = {'function': 'write', 'parameters': {'string': 'abc', 'interval': 0.01}}
+        self.interpreter.process_command(write)
+        self.interpreter.process_command({**write, 'parameters': {'string': 'abc', 'interval': 'slow'}})
+        self.interpreter.process_command({'function': 'press', 'parameters': {'keys': ['tab'], 'interval': 1}})
+
+        self.assertEqual([event.call.kwargs['interval'] for event in self.backend.events], [0.01, 0.02, 0.02])
+
+    def test_set_speed_profile(self):
+        long_write = {'function': 'write', 'parameters': {'string': 'x' * 100}}
+        self.interpreter.set_speed_profile('safe')
+        self.interpreter.process_command(long_write)
+        self.interpreter.set_speed_profile('instant')
+        self.interpreter.process_command({'function': 'write', 'parameters': {'string': 'x'}})
+        self.interpreter.set_speed_profile('unknown')
+        self.interpreter.process_command(long_write)
+
+        # safe never pastes and types slowly, instant pastes everything, unknown profiles fall back to fast
+        self.assertEqual([event.call for event in self.backend.events],
+                         [InputCall('write', ('x' * 100,), {'interval': 0.1}), InputCall('paste', ('x',)),
+                          InputCall('paste', ('x' * 100,))])
+
+    def test_empty_write_sends_nothing(self):
+        finished = []
+        self.event_bus.subscribe(StepFinished, finished.append)
+
+        self.assertTrue(self.interpreter.process_commands([{'function': 'write', 'parameters': {'string': ''}},
+                                                           {'function': 'write', 'parameters': {'text': ''}}]))
+        self.assertTrue(self.interpreter.process_command({'function': 'write', 'parameters': {'string': None}}))
+
+        self.assertEqual(self.backend.events, [])
+        self.assertEqual(len(finished), 3)
+        self.assertTrue(all(event.succeeded for event in finished))
+
+    def test_stops_between_commands_when_asked(self):
+        stopped = []
+        self.event_bus.subscribe(StepFinished, lambda event: stopped.append(True) if event.function == 'sleep' else None)
+
+        self.assertFalse(self.interpreter.process_commands(STEPS, should_stop=lambda: bool(stopped)))
+
+        # The batch before the sleep ran, the long text after it didn't
+        self.assertEqual(self.backend.get_function_names(), ['hotkey', 'sleep', 'write', 'press'])
+
+    def test_stopped_command_is_not_run(self):
+        self.assertFalse(self.interpreter.process_command(STEPS[0], should_stop=lambda: True))
+        self.assertEqual(self.backend.events, [])
+
+    def test_sleep_is_replaced_with_stable_screen_wait(self):
+        screen = FakeScreen()
+        interpreter = Interpreter(self.event_bus, 'fast', self.backend, screen, replace_sleeps=True)
+
+        interpreter.process_command({'function': 'sleep', 'parameters': {'secs': 4}})
+        interpreter.process_command({'function': 'wait_for_stable_screen', 'parameters': {'timeout': 2,
+                                                                                           'threshold': 5}})
+
+        self.assertEqual(screen.waits, [{'timeout': 4.0, 'min_wait': 1.0},
+                                        {'timeout': 2.0, 'min_wait': 0.0, 'threshold': 5.0}])
+
+
+class FakeScreen:
+    def __init__(self):
+        self.waits = []
+
+    def wait_for_stable_screen(self, **kwargs):
+        self.waits.append(kwargs)
+        return True
+
+
+class TestXdotoolBackend(unittest.TestCase):
+    def test_translates_pyautogui_calls(self):
+        backend = XdotoolBackend()
+
+        self.assertEqual(backend.to_xdotool_args(InputCall('hotkey', ('command', 'space'))), ['key', 'super+space'])
+        self.assertEqual(backend.to_xdotool_args(InputCall('press', ('enter',), {'presses': 2})),
+                         ['key', '--delay', '0', 'Return', 'Return'])
+        self.assertEqual(backend.to_xdotool_args(InputCall('write', ('hi',), {'interval': 0.02})),
+                         ['type', '--delay', '20', '--', 'hi'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,74 +1,101 @@
 # tests/test_llm.py
-
+import json
+import os
+import sys
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock
-from app.llm import LLM
-from app.utils.settings import Settings
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from llm import LLM
+from models.registry import model_registry
+from stub_llm_server import StubLLMServer
+from utils.example_index import ExampleIndex
+from utils.settings import Settings
+
+REPLY = '{"steps": [{"function": "test_function", "parameters": {"key1": "value1"}, ' \
+        '"human_readable_justification": "test justification"}], "done": null}'
+
 
 class TestLLMWithOllama(unittest.TestCase):
-    @patch('app.llm.ollama.generate')
-    @patch.object(Settings, 'get_dict', return_value={
-        'model': 'gemma2',
-        'base_url': 'http://localhost:8000/'
-    })
-    def test_llm_with_ollama_model(self, mock_get_dict, mock_generate):
-        # Mock the response from ollama.generate
-        mock_generate.return_value = {
-            'choices': [
-                {'text': '{"steps": [{"function": "test_function", "parameters": {"key1": "value1"}, "human_readable_justification": "test justification"}], "done": null}'}
-            ]
-        }
+    def setUp(self):
+        # A local stand-in for Ollama rather than mocks, so the requests the model code actually makes are checked
+        self.server = StubLLMServer([REPLY]).start()
+        settings = {'model': 'gemma2', 'base_url': self.server.base_url}
+        for patcher in (patch.object(Settings, 'get_dict', return_value=settings),
+                        patch.object(LLM, 'read_context_txt_file', return_value='Test context')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
 
-        # Initialize the LLM class
+    def tearDown(self):
+        model_registry.close()
+        self.server.stop()
+
+    def test_llm_with_ollama_model(self):
         llm = LLM()
 
-        # Test the get_instructions_for_objective method
-        original_user_request = "Test request"
-        step_num = 0
-        instructions = llm.get_instructions_for_objective(original_user_request, step_num)
+        instructions = llm.get_instructions_for_objective('Test request', 0)
 
-        # Verify the instructions
         expected_instructions = {
-            "steps": [
+            'steps': [
                 {
-                    "function": "test_function",
-                    "parameters": {
-                        "key1": "value1"
+                    'function': 'test_function',
+                    'parameters': {
+                        'key1': 'value1'
                     },
-                    "human_readable_justification": "test justification"
+                    'human_readable_justification': 'test justification'
                 }
             ],
-            "done": None
+            'done': None
         }
-        self.assertEqual(instructions, expected_instructions)
+        self.assertEqual(instructions.to_dict(), expected_instructions)
+
+        # One chat call with the context as system prompt and the formatted request, constrained to the schema
+        request = self.server.requests[-1]
+        self.assertEqual(request['path'], '/api/chat')
+        self.assertEqual(request['body']['model'], 'gemma2')
+        self.assertEqual(request['body']['messages'], [
+            {'role': 'system', 'content': 'Test context'},
+            {'role': 'user', 'content': json.dumps({'original_user_request': 'Test request', 'step_num': 0})},
+        ])
+        self.assertIn('format', request['body'])
+
+    def test_similar_past_requests_shown_at_step_0(self):
+        llm = LLM()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        llm.example_index = ExampleIndex(directory.name)
+        steps = [{'function': 'hotkey', 'parameters': {'keys': ['command', 'space']},
+                  'human_readable_justification': 'Open spotlight'}]
+        llm.remember_successful_request('Open Chrome and go to youtube', [steps], 'Opened YouTube')
+
+        llm.get_instructions_for_objective('Open Chrome and go to gmail', 0)
 
-        # Verify that ollama.generate was called with the correct parameters
-        mock_generate.assert_called_once_with(
-            model='gemma2',
-            prompt='{"original_user_request": "Test request", "step_num": 0}'
-        )
+        user_message = json.loads(self.server.requests[-1]['body']['messages'][-1]['content'])
+        self.assertEqual(user_message['similar_past_requests'], [{
+            'request': 'open chrome and go to youtube',
+            'steps': ['step 0: hotkey {"keys":["command","space"]}'],
+            'done': 'Opened YouTube',
+        }])
 
-    @patch('app.llm.ollama.download')
-    def test_download_model(self, mock_download):
-        # Initialize the LLM class
+    def test_download_model(self):
         llm = LLM()
 
-        # Test the download_model method
-        llm.download_model('gemma2')
+        with patch.object(llm.model.client, 'pull', return_value=iter([{'status': 'success'}])) as mock_pull:
+            llm.download_model('gemma2')
 
-        # Verify that ollama.download was called with the correct parameters
-        mock_download.assert_called_once_with('gemma2')
+        mock_pull.assert_called_once_with('gemma2', stream=True)
 
-    @patch('app.llm.ollama.generate')
-    def test_switch_model(self, mock_generate):
-        # Initialize the LLM class
+    def test_switch_model(self):
         llm = LLM()
 
-        # Test the switch_model method
         llm.switch_model('phi3')
 
-        # Verify that the model name was updated
         self.assertEqual(llm.model_name, 'phi3')
+        self.assertEqual(llm.model.model_name, 'phi3')
+
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,128 @@
+# tests/test_macros.py
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from interpreter import Interpreter
+from utils.event_bus import EventBus
+from utils.input_backends import RecordingBackend
+from utils.macros import DEFAULT_CHECKPOINT_TOLERANCE, MacroLibrary, MacroPlayer, MacroRecorder
+
+SPOTLIGHT = [{'function': 'hotkey', 'parameters': {'keys': ['command', 'space']},
+              'human_readable_justification': 'Open spotlight'},
+             {'function': 'write', 'parameters': {'string': 'Chrome'}, 'human_readable_justification': 'Type'},
+             {'function': 'press', 'parameters': {'keys': ['enter']}, 'human_readable_justification': 'Launch'}]
+NEW_TAB = [{'function': 'hotkey', 'parameters': {'keys': ['command', 't']}, 'human_readable_justification': 'New tab'}]
+
+DESKTOP_HASH = '00000000ffffffff00ff'
+CHROME_HASH = 'a5a5a5a5a5a5a5a5ffff'
+
+
+def flip_bits(screen_hash: str, bits: int) -> str:
+    return f'{int(screen_hash, 16) ^ ((1 << bits) - 1):020x}'
+
+
+class TestMacros(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.library = MacroLibrary(self.directory.name)
+        self.backend = RecordingBackend()
+        self.interpreter = Interpreter(EventBus(), 'fast', self.backend)
+        # What the player sees, one (foreground app, screen hash) per checkpoint
+        self.screens = [('Finder', DESKTOP_HASH), ('Google Chrome', CHROME_HASH)]
+
+        recorder = MacroRecorder('Open Chrome in a new tab')
+        recorder.record(DESKTOP_HASH, SPOTLIGHT, 1.5, 'Finder')
+        recorder.record(CHROME_HASH, NEW_TAB, 0.8, 'Google Chrome')
+        self.file_path = self.library.save(recorder.finish('Opened a new tab'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def play(self, **kwargs) -> tuple[bool, int]:
+        checkpoint = iter(range(len(self.screens)))
+        current = {}
+
+        def get_foreground_app():
+            current['index'] = next(checkpoint)
+            return self.screens[current['index']][0]
+
+        player = MacroPlayer(self.interpreter, lambda: self.screens[current['index']][1],
+                             get_foreground_app=get_foreground_app, **kwargs)
+        return player.play(self.library.find('  open chrome in a NEW tab. '))
+
+    def get_keys_sent(self) -> list[str]:
+        # The interpreter adds short sleeps for the UI to settle within a batch
+        return [name for name in self.backend.get_function_names() if name != 'sleep']
+
+    def test_recorded_macro_is_saved_and_found_by_normalized_request(self):
+        self.assertTrue(os.path.exists(self.file_path))
+        macro = self.library.find('Open Chrome in a new tab')
+        self.assertEqual(macro['done'], 'Opened a new tab')
+        self.assertEqual([checkpoint['app'] for checkpoint in macro['checkpoints']], ['Finder', 'Google Chrome'])
+        self.assertEqual(macro['checkpoints'][0]['steps'], SPOTLIGHT)
+        self.assertIsNone(self.library.find('Open Safari'))
+
+    def test_replay_runs_every_checkpoint_when_screens_match(self):
+        self.assertEqual(self.play(), (True, 2))
+        self.assertEqual(self.get_keys_sent(), ['hotkey', 'write', 'press', 'hotkey'])
+
+    def test_small_screen_differences_are_tolerated(self):
+        self.screens[1] = ('Google Chrome', flip_bits(CHROME_HASH, DEFAULT_CHECKPOINT_TOLERANCE))
+        self.assertEqual(self.play(), (True, 2))
+
+    def test_different_screen_hands_over_to_the_llm(self):
+        self.screens[1] = ('Google Chrome', flip_bits(CHROME_HASH, DEFAULT_CHECKPOINT_TOLERANCE + 1))
+        self.assertEqual(self.play(), (False, 1))
+        # Only the first checkpoint's steps ran
+        self.assertEqual(self.get_keys_sent(), ['hotkey', 'write', 'press'])
+
+    def test_different_foreground_app_hands_over_to_the_llm(self):
+        # Looks the same, but keystrokes would go to another application
+        self.screens[0] = ('Terminal', DESKTOP_HASH)
+        self.assertEqual(self.play(), (False, 0))
+        self.assertEqual(self.backend.events, [])
+
+    def test_unknown_foreground_app_hands_over_to_the_llm(self):
+        # E.g. Wayland, or Linux without xdotool
+        self.screens[0] = (None, DESKTOP_HASH)
+        self.assertEqual(self.play(), (False, 0))
+        self.assertEqual(self.backend.events, [])
+
+    def test_checkpoint_without_an_app_never_matches(self):
+        # Recorded before checkpoints had an app, saved as is
+        macro = self.library.find('Open Chrome in a new tab')
+        del macro['checkpoints'][0]['app']
+        player = MacroPlayer(self.interpreter, lambda: DESKTOP_HASH, get_foreground_app=lambda: None)
+        self.assertEqual(player.play(macro), (False, 0))
+        self.assertEqual(self.backend.events, [])
+
+    def test_stopping_before_a_checkpoint(self):
+        player = MacroPlayer(self.interpreter, lambda: DESKTOP_HASH, get_foreground_app=lambda: 'Finder')
+        self.assertEqual(player.play(self.library.find('Open Chrome in a new tab'), should_stop=lambda: True),
+                         (False, 0))
+        self.assertEqual(self.backend.events, [])
+
+    def test_macro_with_an_unverifiable_checkpoint_is_not_saved(self):
+        recorder = MacroRecorder('Open Safari')
+        recorder.record(DESKTOP_HASH, SPOTLIGHT, 1.0, 'Finder')
+        recorder.record(None, NEW_TAB, 1.0, 'Safari')
+        self.assertIsNone(self.library.save(recorder.finish('Opened Safari')))
+        self.assertIsNone(self.library.find('Open Safari'))
+
+    def test_macro_without_a_foreground_app_is_not_saved(self):
+        recorder = MacroRecorder('Open Safari')
+        recorder.record(DESKTOP_HASH, SPOTLIGHT, 1.0, None)
+        self.assertIsNone(self.library.save(recorder.finish('Opened Safari')))
+        self.assertIsNone(self.library.find('Open Safari'))
+
+    def test_delete(self):
+        self.library.delete('Open Chrome in a new tab')
+        self.assertIsNone(self.library.find('Open Chrome in a new tab'))
+
+
+if __name__ == '__main__':
+    unittest.main()
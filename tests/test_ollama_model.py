@@ -0,0 +1,96 @@
+# tests/test_ollama_model.py
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from models.ollama_model import OllamaModel
+from models.registry import model_registry
+from utils.settings import Settings
+
+
+class FakeOllamaClient:
+    # The parts of ollama.Client that OllamaModel.prepare() uses
+    def __init__(self, local_models=None, pull_progress=None):
+        self.local_models = local_models
+        self.pull_progress = pull_progress or []
+        self.pulled = []
+        self.chats = []
+
+    def list(self):
+        if self.local_models is None:
+            raise ConnectionError('Server not running')
+        return {'models': self.local_models}
+
+    def pull(self, model_name, stream=False):
+        self.pulled.append(model_name)
+        return iter(self.pull_progress)
+
+    def chat(self, **kwargs):
+        self.chats.append(kwargs)
+        return {'message': {'role': 'assistant', 'content': ''}}
+
+
+class TestOllamaModelPrepare(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(Settings, 'get_dict', return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(model_registry.close)
+        self.model = OllamaModel('llama3', 'http://localhost:11434/', 'Test context')
+        self.progress = []
+
+    def prepare(self, client: FakeOllamaClient) -> FakeOllamaClient:
+        self.model.client = client
+        self.model.prepare(self.progress.append)
+        return client
+
+    def test_model_on_disk_is_only_warmed_up(self):
+        client = self.prepare(FakeOllamaClient([{'model': 'phi3:latest'}, {'model': 'llama3:latest'}]))
+
+        self.assertEqual(client.pulled, [])
+        self.assertEqual(self.progress, [])
+        self.assertEqual(len(client.chats), 1)
+        self.assertEqual(client.chats[0]['messages'], [{'role': 'system', 'content': 'Test context'}])
+
+    def test_model_names_match_with_or_without_a_tag(self):
+        self.model.client = FakeOllamaClient([{'name': 'llama3:latest'}, {'model': 'phi3:mini'}])
+
+        self.assertTrue(self.model.is_model_available('llama3'))
+        self.assertTrue(self.model.is_model_available('llama3:latest'))
+        self.assertTrue(self.model.is_model_available('phi3:mini'))
+        self.assertFalse(self.model.is_model_available('phi3'))
+        self.assertFalse(self.model.is_model_available('llama3:8b'))
+
+    def test_missing_model_is_pulled(self):
+        client = self.prepare(FakeOllamaClient([{'model': 'phi3:latest'}], [{'status': 'success'}]))
+
+        self.assertEqual(client.pulled, ['llama3'])
+        self.assertEqual(self.progress, ['Downloading llama3 - success', 'Downloaded llama3'])
+        self.assertEqual(len(client.chats), 1)
+
+    def test_pulls_when_models_cant_be_listed(self):
+        client = self.prepare(FakeOllamaClient(None))
+
+        self.assertEqual(client.pulled, ['llama3'])
+        self.assertEqual(self.progress, ['Downloaded llama3'])
+
+    def test_repeated_progress_is_reported_once(self):
+        progress = [{'status': 'pulling manifest'}, {'status': 'pulling manifest'},
+                    {'status': 'downloading', 'completed': 1, 'total': 200},
+                    {'status': 'downloading', 'completed': 2, 'total': 200},
+                    {'status': 'downloading', 'completed': 100, 'total': 200},
+                    {'status': 'downloading', 'completed': 200, 'total': 200},
+                    {'status': 'success'}, {'status': 'success'}]
+        self.prepare(FakeOllamaClient([], progress))
+
+        self.assertEqual(self.progress, ['Downloading llama3 - pulling manifest', 'Downloading llama3 - downloading 0%',
+                                         'Downloading llama3 - downloading 1%', 'Downloading llama3 - downloading 50%',
+                                         'Downloading llama3 - downloading 100%', 'Downloading llama3 - success',
+                                         'Downloaded llama3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from models.factory import ModelFactory
+from models.openai_compatible_model import OpenAICompatibleModel, get_api_base_url, to_openai_message
+from models.registry import ModelRegistry
+from stub_llm_server import StubLLMServer
+
+CONTEXT = 'You are now the backend for a program that is controlling my computer. ' * 50
+REPLY = '{"steps": [{"function": "write", "parameters": {"string": "Hello"}, ' \
+        '"human_readable_justification": "Greet"}, {"function": "press", "parameters": {"keys": ["enter"]}, "human_readable_justification": "Send"}], ' \
+        '"done": null}'
+
+
+class TestOpenAICompatibleModel(unittest.TestCase):
+    def setUp(self):
+        self.server = StubLLMServer([REPLY]).start()
+        self.registry = ModelRegistry()
+        self.model = OpenAICompatibleModel('stub', self.server.base_url, CONTEXT)
+        self.model.client = self.registry.get_http_client(self.model.base_url)
+
+    def tearDown(self):
+        self.registry.close()
+        self.server.stop()
+
+    def test_instructions(self):
+        instructions = self.model.get_instructions_for_objective('Say hello', 0)
+
+        self.assertEqual([step['function'] for step in instructions.steps], ['write', 'press'])
+        self.assertIsNone(instructions.done)
+        self.assertGreater(instructions.usage.prompt_tokens, 500)
+        self.assertEqual(self.server.requests[-1]['path'], '/v1/chat/completions')
+        self.assertEqual(self.server.requests[-1]['body']['response_format']['type'], 'json_schema')
+
+    def test_streamed_instructions(self):
+        stream = self.model.stream_instructions_for_objective('Say hello', 0)
+
+        self.assertEqual([step['function'] for step in stream], ['write', 'press'])
+        self.assertEqual(stream.get_instructions().usage.completion_tokens, 79)
+        self.assertTrue(self.server.requests[-1]['body']['stream'])
+
+    def test_connection_is_kept_alive_and_prompt_prefix_reused(self):
+        self.model.get_instructions_for_objective('Say hello', 0)
+        list(self.model.stream_instructions_for_objective('Say hello', 1))
+        list(self.model.stream_instructions_for_objective('Say hello', 2))
+        self.model.get_instructions_for_objective('Say hello', 3)
+
+        self.assertEqual(len({request['client_port'] for request in self.server.requests}), 1)
+        step_0, *later_steps = [count for _, count in self.model.session.prompt_eval_counts]
+        self.assertGreater(step_0, 500)
+        self.assertTrue(all(count < 50 for count in later_steps))
+
+    def test_prepare(self):
+        self.model.prepare()
+
+        self.assertEqual(self.server.requests[-1]['body']['max_tokens'], 1)
+
+
+class TestHelpers(unittest.TestCase):
+    def test_base_url(self):
+        self.assertEqual(get_api_base_url('http://localhost:8080'), 'http://localhost:8080/v1/')
+        self.assertEqual(get_api_base_url('http://localhost:8080/v1'), 'http://localhost:8080/v1/')
+        self.assertEqual(get_api_base_url('https://example.com/openai/v1/'), 'https://example.com/openai/v1/')
+
+    def test_images_become_data_urls(self):
+        message = to_openai_message({'role': 'user', 'content': 'step 1', 'images': ['UklGRabc', '/9j/abc']})
+
+        self.assertEqual(message['content'][0], {'type': 'text', 'text': 'step 1'})
+        self.assertEqual([part['image_url']['url'] for part in message['content'][1:]],
+                         ['data:image/webp;base64,UklGRabc', 'data:image/jpeg;base64,/9j/abc'])
+
+    def test_factory(self):
+        self.assertIsInstance(ModelFactory.create_model('stub', 'http://localhost:8080/', CONTEXT, 'openai'),
+                              OpenAICompatibleModel)
+        with self.assertRaises(ValueError):
+            ModelFactory.create_model('stub', 'http://localhost:8080/', CONTEXT, 'carrier-pigeon')
+
+
+if __name__ == '__main__':
+    unittest.main()
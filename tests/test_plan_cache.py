@@ -0,0 +1,64 @@
+# tests/test_plan_cache.py
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.plan_cache import PlanCache
+
+INSTRUCTIONS = {'steps': [{'function': 'press', 'parameters': {'keys': ['enter']}}], 'done': 'Done'}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPlanCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'plan_cache.json')
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_cache(self, **kwargs) -> PlanCache:
+        return PlanCache(self.file_path, clock=self.clock, **kwargs)
+
+    def test_hit_on_normalized_request_and_persisted(self):
+        self.make_cache().put_many([('Open Chrome', 0, 'llama3', 'abcd', INSTRUCTIONS)])
+
+        cache = self.make_cache()
+        self.assertEqual(cache.get('  open   chrome. ', 0, 'llama3', 'abcd'), INSTRUCTIONS)
+        self.assertIsNone(cache.get('open chrome', 0, 'llama3', 'other screen'))
+        self.assertIsNone(cache.get('open chrome', 0, 'gemma2', 'abcd'))
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        self.assertEqual(cache.get_stats()['misses'], 2)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = self.make_cache(max_entries=2)
+        cache.put_many([('a', 0, 'm', 'h', INSTRUCTIONS), ('b', 0, 'm', 'h', INSTRUCTIONS)])
+        cache.get('a', 0, 'm', 'h')
+        cache.put_many([('c', 0, 'm', 'h', INSTRUCTIONS)])
+
+        self.assertIsNone(cache.get('b', 0, 'm', 'h'))
+        self.assertIsNotNone(cache.get('a', 0, 'm', 'h'))
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = self.make_cache(ttl_secs=60)
+        cache.put_many([('Hello', 0, 'm', 'h', INSTRUCTIONS)])
+        self.clock.now += 61
+
+        self.assertIsNone(cache.get('Hello', 0, 'm', 'h'))
+        self.assertEqual(cache.get_stats()['expirations'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
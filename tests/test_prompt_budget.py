@@ -0,0 +1,85 @@
+# tests/test_prompt_budget.py
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.prompt_budget import (DEFAULT_NUM_CTX, ContextSection, assemble_prompt, estimate_tokens,
+                                 get_system_prompt_budget, parse_context_sections)
+
+CONTEXT_FILE = os.path.join(os.path.dirname(__file__), '../app/resources/context.txt')
+
+CONTEXT = """Intro.
+[[section core required]]
+Reply in JSON.
+[[section rules_macos required os=darwin]]
+Use spotlight.
+[[section keyboard_api priority=1]]
+Key names are enter, esc and tab.
+[[section mouse_api priority=3 when=mouse_actions]]
+click takes x and y.
+"""
+
+
+class TestPromptBudget(unittest.TestCase):
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(''), 0)
+        self.assertEqual(estimate_tokens('Open Chrome'), 3)
+        self.assertEqual(estimate_tokens('{"keys": ["enter"]}'), 12)
+        # A long word is more than one token
+        self.assertGreater(estimate_tokens('internationalization'), 1)
+
+    def test_parse_sections(self):
+        preamble, core, macos, keyboard, mouse = parse_context_sections(CONTEXT)
+
+        self.assertEqual((preamble.name, preamble.text, preamble.required), ('preamble', 'Intro.', True))
+        self.assertEqual((core.name, core.text, core.required), ('core', 'Reply in JSON.', True))
+        self.assertEqual((macos.os, macos.required), ('darwin', True))
+        self.assertEqual((keyboard.priority, keyboard.required), (1, False))
+        self.assertEqual((mouse.when, mouse.priority), ('mouse_actions', 3))
+
+    def test_only_relevant_sections_that_fit(self):
+        sections = parse_context_sections(CONTEXT)
+
+        prompt = assemble_prompt(sections, 1000, 'linux', lambda setting: False)
+        self.assertEqual([section.name for section in prompt.included], ['preamble', 'core', 'keyboard_api'])
+        self.assertEqual(prompt.left_out, {'rules_macos': 'not darwin', 'mouse_api': 'mouse_actions off'})
+        self.assertEqual(prompt.text, 'Intro.\n\nReply in JSON.\n\nKey names are enter, esc and tab.')
+
+        prompt = assemble_prompt(sections, 1000, 'darwin', lambda setting: setting == 'mouse_actions')
+        self.assertEqual([section.name for section in prompt.included],
+                         ['preamble', 'core', 'rules_macos', 'keyboard_api', 'mouse_api'])
+
+    def test_optional_sections_dropped_over_budget_by_priority(self):
+        sections = [ContextSection('core', 'Reply in JSON.', required=True),
+                    ContextSection('apps', 'Installed apps are ' + 'Calculator, ' * 50, priority=2),
+                    ContextSection('keys', 'Key names are enter and esc.', priority=1)]
+
+        prompt = assemble_prompt(sections, 20, 'linux', lambda setting: False)
+        self.assertEqual([section.name for section in prompt.included], ['core', 'keys'])
+        self.assertEqual(prompt.left_out, {'apps': 'over budget'})
+        self.assertLessEqual(prompt.tokens, 20)
+
+        # Required sections stay even when they alone are over budget
+        prompt = assemble_prompt(sections, 1, 'linux', lambda setting: False)
+        self.assertEqual([section.name for section in prompt.included], ['core'])
+
+    def test_context_txt_fits_default_budget(self):
+        with open(CONTEXT_FILE, 'r') as file:
+            sections = parse_context_sections(file.read())
+        names = [section.name for section in sections]
+        self.assertEqual(len(names), len(set(names)))
+
+        budget = get_system_prompt_budget(None)
+        self.assertEqual(budget, DEFAULT_NUM_CTX // 2)
+        for os_name in ('darwin', 'windows', 'linux'):
+            prompt = assemble_prompt(sections, budget, os_name, lambda setting: False)
+            self.assertEqual([section.name for section in prompt.included],
+                             ['core', 'functions', 'rules', f'rules_{"macos" if os_name == "darwin" else os_name}',
+                              'keyboard_api'])
+            self.assertLess(prompt.tokens, budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# tests/test_prompt_session.py
+import json
+import os
+import sys
+import unittest
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from models.responses import get_response_usage
+from models.session import PromptSession
+from stub_llm_server import StubLLMServer
+
+CONTEXT = 'You are now the backend for a program that is controlling my computer. ' * 200
+
+
+def request_step(server: StubLLMServer, session: PromptSession, user_request: str, step_num: int) -> dict:
+    body = json.dumps({
+        'model': 'stub',
+        'messages': session.get_messages_for_step(json.dumps({'original_user_request': user_request,
+                                                               'step_num': step_num}), step_num),
+        'keep_alive': session.keep_alive,
+        'stream': False
+    }).encode()
+    with urllib.request.urlopen(urllib.request.Request(server.base_url + 'api/chat', data=body)) as response:
+        response = json.loads(response.read())
+    session.record_usage(get_response_usage(response))
+    session.add_assistant_reply(response['message']['content'], session.turn_id)
+    return response
+
+
+class TestPromptSession(unittest.TestCase):
+    def setUp(self):
+        self.server = StubLLMServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_only_new_messages_are_evaluated_after_step_0(self):
+        session = PromptSession(CONTEXT)
+
+        for step_num in range(3):
+            request_step(self.server, session, 'Open Chrome', step_num)
+
+        step_0, step_1, step_2 = [count for _, count in session.prompt_eval_counts]
+        self.assertGreater(step_0, 2000)
+        self.assertLess(step_1, 50)
+        self.assertLess(step_2, 50)
+
+    def test_system_prompt_is_reused_across_requests(self):
+        session = PromptSession(CONTEXT)
+        request_step(self.server, session, 'Open Chrome', 0)
+        request_step(self.server, session, 'Hello', 0)
+
+        first_request, second_request = [count for _, count in session.prompt_eval_counts]
+        self.assertLess(second_request, 50)
+        self.assertIs(session.messages[0], session.system_message)
+
+    def test_unanswered_step_is_replaced(self):
+        session = PromptSession(CONTEXT)
+        session.get_messages_for_step('step 0', 0)
+        messages = session.get_messages_for_step('step 0 again', 0)
+        session.get_messages_for_step('retry', 1)
+
+        self.assertEqual([message['role'] for message in messages], ['system', 'user'])
+        self.assertEqual(session.messages[-1]['content'], 'retry')
+        self.assertEqual(len(session.messages), 2)
+
+    def test_discarded_step_leaves_conversation_as_before(self):
+        session = PromptSession(CONTEXT)
+        request_step(self.server, session, 'Open Chrome', 0)
+        before = list(session.messages)
+        request_step(self.server, session, 'Open Chrome', 1)
+
+        session.discard_step(0)
+        self.assertEqual(len(session.messages), len(before) + 2)
+        session.discard_step(1)
+        self.assertEqual(session.messages, before)
+        self.assertEqual(session.current_step_num, 0)
+
+    def test_replies_to_earlier_turns_are_ignored(self):
+        session = PromptSession(CONTEXT)
+        session.get_messages_for_step('request A step 0', 0)
+        stopped_turn_id = session.turn_id
+        session.get_messages_for_step('request B step 0', 0)
+        session.add_assistant_reply('{"steps": [], "done": "late reply to A"}', stopped_turn_id)
+        self.assertEqual(session.messages[-1]['content'], 'request B step 0')
+
+        session.add_assistant_reply('{"steps": [], "done": null}', session.turn_id)
+        session.get_messages_for_step('request B step 1', 1)
+        discarded_turn_id = session.turn_id
+        session.discard_step(1)
+        session.add_assistant_reply('{"steps": [], "done": "discarded"}', discarded_turn_id)
+        self.assertEqual(session.messages[-1], {'role': 'assistant', 'content': '{"steps":[],"done":null}'})
+
+    def test_prompt_sizes_per_request(self):
+        session = PromptSession(CONTEXT)
+        session.get_messages_for_step('step 0', 0)
+        session.add_assistant_reply('{"steps": [], "done": null}', session.turn_id)
+        session.get_messages_for_step('step 1', 1, images=['aGVsbG8='])
+        first_request = list(session.prompt_sizes)
+        session.get_messages_for_step('next request', 0)
+
+        (step_0, step_0_tokens, _), (step_1, step_1_tokens, step_1_images) = first_request
+        self.assertEqual((step_0, step_1, step_1_images), (0, 1, 1))
+        self.assertGreater(step_0_tokens, session.system_prompt_tokens)
+        self.assertGreater(step_1_tokens, step_0_tokens)
+        self.assertEqual([step_num for step_num, _, _ in session.prompt_sizes], [0])
+        self.assertIn('step 0 ~', session.get_prompt_size_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
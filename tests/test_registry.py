@@ -0,0 +1,49 @@
+# tests/test_registry.py
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from models.registry import ModelRegistry
+from utils.settings import Settings
+
+BASE_URL = 'http://localhost:8080/'
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(Settings, 'get_dict', return_value={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = ModelRegistry(max_models=2)
+        self.addCleanup(self.registry.close)
+
+    def get_model(self, model_name: str, context: str = 'context'):
+        return self.registry.get_model(model_name, BASE_URL, context, 'openai')
+
+    def test_same_model_is_reused(self):
+        model = self.get_model('phi3')
+        self.assertIs(self.get_model('phi3'), model)
+        self.assertIsNot(self.get_model('phi3', 'edited context'), model)
+
+    def test_keeps_only_the_most_recently_used_models(self):
+        phi3 = self.get_model('phi3')
+        self.get_model('gemma2')
+        self.get_model('phi3')  # Now the most recently used
+        self.get_model('llama3')
+
+        self.assertEqual(len(self.registry.models), 2)
+        self.assertIs(self.get_model('phi3'), phi3)
+        self.assertEqual([key[1] for key in self.registry.models], ['llama3', 'phi3'])
+
+    def test_context_edits_dont_pile_up(self):
+        for edit in range(10):
+            self.get_model('phi3', f'context {edit}')
+
+        self.assertEqual(len(self.registry.models), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
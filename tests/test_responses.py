@@ -0,0 +1,82 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from models.instructions import Instructions
+from models.instructions_parser import InstructionStream
+from models.responses import OllamaChatAdapter, OllamaGenerateAdapter, OpenAIAdapter, get_response_adapter, \
+    get_response_text, to_instructions
+
+REPLY = '{"steps": [{"function": "press", "parameters": {"keys": ["enter"]}, ' \
+        '"human_readable_justification": "Confirm"}], "done": "Confirmed"}'
+
+
+class AttributeResponse:
+    # Stands in for the ollama client's response objects, which expose fields as attributes
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class TestResponseAdapters(unittest.TestCase):
+    def test_ollama_chat(self):
+        response = {'message': {'role': 'assistant', 'content': REPLY}, 'done': True, 'prompt_eval_count': 12,
+                    'eval_count': 30, 'prompt_eval_duration': 40_000_000, 'eval_duration': 600_000_000,
+                    'total_duration': 700_000_000}
+
+        instructions = to_instructions(response)
+        self.assertIs(get_response_adapter(response), OllamaChatAdapter)
+        self.assertEqual(instructions.done, 'Confirmed')
+        self.assertEqual(instructions.steps[0]['parameters'], {'keys': ['enter']})
+        self.assertEqual(instructions.usage.prompt_tokens, 12)
+        self.assertEqual(instructions.usage.eval_ms, 600.0)
+        self.assertEqual(instructions.usage.tokens_per_sec, 50.0)
+
+    def test_ollama_chat_response_object(self):
+        response = AttributeResponse(message=AttributeResponse(content=REPLY), prompt_eval_count=5, eval_count=None)
+
+        self.assertEqual(to_instructions(response).usage.prompt_tokens, 5)
+
+    def test_ollama_generate(self):
+        response = {'response': REPLY, 'done': True, 'eval_count': 30}
+
+        self.assertIs(get_response_adapter(response), OllamaGenerateAdapter)
+        self.assertEqual(to_instructions(response).usage.completion_tokens, 30)
+
+    def test_openai(self):
+        chat = {'choices': [{'message': {'role': 'assistant', 'content': REPLY}}],
+                'usage': {'prompt_tokens': 100, 'completion_tokens': 30},
+                'timings': {'prompt_n': 8, 'prompt_ms': 20.0, 'predicted_ms': 300.0}}
+        completion = {'choices': [{'text': REPLY}]}
+        stream_chunk = {'choices': [{'delta': {'content': '{"steps"'}}]}
+
+        self.assertIs(get_response_adapter(chat), OpenAIAdapter)
+        usage = to_instructions(chat).usage
+        self.assertEqual((usage.prompt_tokens, usage.completion_tokens, usage.total_ms), (8, 30, 320.0))
+        self.assertEqual(to_instructions(completion).done, 'Confirmed')
+        self.assertIsNone(to_instructions(completion).usage)
+        self.assertEqual(get_response_text(stream_chunk), '{"steps"')
+
+    def test_invalid_responses(self):
+        self.assertIsNone(to_instructions({'error': 'model not found'}))
+        self.assertIsNone(to_instructions({'message': {'content': 'Sorry, I can not do that'}}))
+
+
+class TestInstructions(unittest.TestCase):
+    def test_slots(self):
+        instructions = Instructions([], 'done')
+
+        self.assertFalse(hasattr(instructions, '__dict__'))
+        self.assertEqual(Instructions.from_dict(instructions.to_dict()), instructions)
+
+    def test_stream_picks_up_usage(self):
+        usage = to_instructions({'message': {'content': REPLY}, 'eval_count': 3}).usage
+        stream = InstructionStream([REPLY[:40], REPLY[40:], usage])
+
+        self.assertEqual(len(list(stream)), 1)
+        self.assertIs(stream.get_instructions().usage, usage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# tests/test_screen.py
+import base64
+import io
+import os
+import sys
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.screen import EncodedScreenshot, Screen
+
+# Noisy enough that the encoders can't shrink it to nothing, so quality makes a difference
+SCREENSHOT = Image.effect_noise((2560, 1600), 64).convert('RGB')
+
+
+class TestEncodeForLLM(unittest.TestCase):
+    def setUp(self):
+        self.screen = Screen()
+
+    def decode(self, screenshot: EncodedScreenshot) -> Image.Image:
+        return Image.open(io.BytesIO(screenshot.data))
+
+    def test_downscales_to_max_edge_keeping_aspect_ratio(self):
+        screenshot = self.screen.encode_for_llm(SCREENSHOT, max_edge=1280)
+
+        self.assertEqual(screenshot.size, (1280, 800))
+        self.assertEqual(screenshot.original_size, (2560, 1600))
+        self.assertEqual(self.decode(screenshot).size, (1280, 800))
+        self.assertEqual(set(screenshot.timings_ms), {'resize', 'encode'})
+
+    def test_small_screens_are_not_upscaled(self):
+        screenshot = self.screen.encode_for_llm(SCREENSHOT.resize((800, 500)), max_edge=1280)
+        self.assertEqual(screenshot.size, (800, 500))
+
+    def test_formats(self):
+        jpeg = self.screen.encode_for_llm(SCREENSHOT, image_format='JPEG')
+        webp = self.screen.encode_for_llm(SCREENSHOT, image_format='webp')
+        unknown = self.screen.encode_for_llm(SCREENSHOT, image_format='bmp')
+
+        self.assertEqual((jpeg.format, self.decode(jpeg).format), ('jpeg', 'JPEG'))
+        self.assertEqual((webp.format, self.decode(webp).format), ('webp', 'WEBP'))
+        self.assertEqual((unknown.format, self.decode(unknown).format), ('jpeg', 'JPEG'))
+
+    def test_lower_quality_is_smaller(self):
+        low = self.screen.encode_for_llm(SCREENSHOT, quality=30)
+        high = self.screen.encode_for_llm(SCREENSHOT, quality=90)
+        self.assertLess(len(low.data), len(high.data))
+
+    def test_crops_to_region_before_downscaling(self):
+        screenshot = self.screen.encode_for_llm(SCREENSHOT.convert('RGBA'), max_edge=400, region=(100, 200, 900, 600))
+
+        self.assertEqual(screenshot.region, (100, 200, 900, 600))
+        self.assertEqual(screenshot.size, (400, 200))
+        self.assertEqual(screenshot.original_size, (2560, 1600))
+        self.assertEqual(self.decode(screenshot).mode, 'RGB')
+
+
+class TestEncodedScreenshot(unittest.TestCase):
+    def test_to_base64(self):
+        screenshot = Screen().encode_for_llm(SCREENSHOT)
+        self.assertEqual(base64.b64decode(screenshot.to_base64()), screenshot.data)
+
+    def test_describe(self):
+        full = Screen().encode_for_llm(SCREENSHOT)
+        cropped = Screen().encode_for_llm(SCREENSHOT, region=(0, 0, 640, 400))
+        unchanged = EncodedScreenshot(b'', '', (0, 0), (2560, 1600), {})
+
+        self.assertEqual(full.describe(), 'attached image')
+        self.assertIn('(0, 0, 640, 400)', cropped.describe())
+        self.assertIn('unchanged', unchanged.describe())
+
+
+if __name__ == '__main__':
+    unittest.main()
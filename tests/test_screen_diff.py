@@ -0,0 +1,104 @@
+# tests/test_screen_diff.py
+import os
+import sys
+import unittest
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.screen_diff import BRIGHTNESS_BITS, ScreenChangeDetector, hash_distance
+
+SCREEN_SIZE = (1280, 800)
+# Most bits two hashes of the same screen may differ by for Core's speculative prefetch to count it as the same
+PREFETCH_HASH_TOLERANCE = 6
+
+
+def make_screen(windows: list[tuple[int, int, int, int]], background: int = 230) -> Image.Image:
+    # A desktop with dark windows at the given (left, top, right, bottom), each with a lighter title bar
+    img = Image.new('RGB', SCREEN_SIZE, (background,) * 3)
+    draw = ImageDraw.Draw(img)
+    for left, top, right, bottom in windows:
+        draw.rectangle((left, top, right, bottom), fill=(40, 40, 40))
+        draw.rectangle((left, top, right, top + 30), fill=(120, 120, 120))
+    return img
+
+
+def add_noise(img: Image.Image, amplitude: int, seed: int = 0) -> Image.Image:
+    pixels = np.asarray(img, dtype=np.int16)
+    noise = np.random.default_rng(seed).integers(-amplitude, amplitude + 1, pixels.shape)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+
+class TestScreenChangeDetector(unittest.TestCase):
+    def setUp(self):
+        self.detector = ScreenChangeDetector()
+        self.screen = make_screen([(100, 100, 700, 600)])
+
+    def compare(self, before: Image.Image, after: Image.Image):
+        return self.detector.compare(self.detector.get_signature(before), self.detector.get_signature(after))
+
+    def test_identical_screens_are_unchanged(self):
+        change = self.compare(self.screen, self.screen.copy())
+        self.assertFalse(change.changed)
+        self.assertIsNone(change.dirty_region)
+        self.assertEqual(change.changed_fraction, 0.0)
+
+    def test_noise_below_threshold_is_unchanged(self):
+        self.assertFalse(self.compare(self.screen, add_noise(self.screen, 2)).changed)
+
+    def test_dirty_region_covers_the_change(self):
+        dialog = (900, 300, 1100, 450)
+        change = self.compare(self.screen, make_screen([(100, 100, 700, 600), dialog]))
+
+        self.assertTrue(change.changed)
+        left, top, right, bottom = change.dirty_region
+        # Rounded out to whole tiles, so it contains the dialog but not much more
+        self.assertTrue(left <= dialog[0] and top <= dialog[1] and right >= dialog[2] and bottom >= dialog[3])
+        self.assertLess((right - left) * (bottom - top), 2 * (dialog[2] - dialog[0]) * (dialog[3] - dialog[1]))
+        self.assertLess(change.changed_fraction, 0.1)
+        self.assertTrue(change.changed_tiles.any())
+
+    def test_resolution_change_marks_everything_dirty(self):
+        change = self.compare(self.screen, self.screen.resize((1280, 1024)))
+        self.assertEqual(change.dirty_region, (0, 0, 1280, 1024))
+        self.assertEqual(change.changed_fraction, 1.0)
+
+
+class TestPerceptualHash(unittest.TestCase):
+    def setUp(self):
+        self.detector = ScreenChangeDetector()
+
+    def hash(self, img: Image.Image) -> str:
+        return self.detector.get_signature(img).perceptual_hash()
+
+    def test_stable_under_small_noise(self):
+        screen = make_screen([(100, 100, 700, 600), (800, 200, 1200, 500)])
+        for seed in range(5):
+            self.assertLessEqual(hash_distance(self.hash(screen), self.hash(add_noise(screen, 6, seed))), 2)
+
+    def test_different_layouts_are_over_the_tolerance(self):
+        one_window = self.hash(make_screen([(100, 100, 700, 600)]))
+        two_windows = self.hash(make_screen([(100, 100, 700, 600), (800, 200, 1200, 500)]))
+        moved_window = self.hash(make_screen([(500, 150, 1100, 650)]))
+
+        self.assertGreater(hash_distance(one_window, two_windows), PREFETCH_HASH_TOLERANCE)
+        self.assertGreater(hash_distance(one_window, moved_window), PREFETCH_HASH_TOLERANCE)
+
+    def test_blank_screens_of_different_brightness_hash_differently(self):
+        black, gray, white = (self.hash(Image.new('RGB', SCREEN_SIZE, (level,) * 3)) for level in (0, 128, 255))
+
+        self.assertEqual(black, self.hash(Image.new('RGB', (640, 400), (0, 0, 0))))
+        self.assertEqual(hash_distance(black, white), BRIGHTNESS_BITS)
+        self.assertGreater(hash_distance(black, gray), PREFETCH_HASH_TOLERANCE)
+        self.assertGreater(hash_distance(gray, white), PREFETCH_HASH_TOLERANCE)
+
+    def test_hash_distance(self):
+        self.assertEqual(hash_distance('00ff', '00ff'), 0)
+        self.assertEqual(hash_distance('00ff', '00fe'), 1)
+        self.assertEqual(hash_distance('0000', 'ffff'), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
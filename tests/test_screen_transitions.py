@@ -0,0 +1,52 @@
+# tests/test_screen_transitions.py
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.screen_transitions import ScreenTransitions
+
+STEPS = [{'function': 'press', 'parameters': {'keys': ['enter']}, 'human_readable_justification': 'Submit'}]
+
+
+class TestScreenTransitions(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'screen_transitions.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_predicts_recorded_transition(self):
+        transitions = ScreenTransitions(self.file_path)
+        self.assertIsNone(transitions.predict('aaaa', STEPS))
+        transitions.record('aaaa', STEPS, 'bbbb')
+        self.assertEqual(transitions.predict('aaaa', STEPS), 'bbbb')
+        self.assertIsNone(transitions.predict('cccc', STEPS))
+
+    def test_justification_does_not_matter(self):
+        transitions = ScreenTransitions(self.file_path)
+        transitions.record('aaaa', STEPS, 'bbbb')
+        reworded = [{**STEPS[0], 'human_readable_justification': 'Press enter to submit'}]
+        self.assertEqual(transitions.predict('aaaa', reworded), 'bbbb')
+
+    def test_least_recently_used_is_evicted(self):
+        transitions = ScreenTransitions(self.file_path, max_entries=2)
+        transitions.record('1111', STEPS, 'aaaa')
+        transitions.record('2222', STEPS, 'bbbb')
+        transitions.predict('1111', STEPS)
+        transitions.record('3333', STEPS, 'cccc')
+        self.assertEqual(transitions.predict('1111', STEPS), 'aaaa')
+        self.assertIsNone(transitions.predict('2222', STEPS))
+
+    def test_survives_save_and_load(self):
+        transitions = ScreenTransitions(self.file_path)
+        transitions.record('aaaa', STEPS, 'bbbb')
+        transitions.save()
+        self.assertEqual(ScreenTransitions(self.file_path).predict('aaaa', STEPS), 'bbbb')
+
+
+if __name__ == '__main__':
+    unittest.main()
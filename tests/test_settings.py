@@ -0,0 +1,110 @@
+# tests/test_settings.py
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.settings import Settings, SettingsStore, settings_stores
+
+
+class TestSettings(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        directory_path = self.directory.name + '/'
+        patcher = patch.object(Settings, 'get_settings_directory_path', return_value=directory_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(os.environ.pop, 'BASE_URL', None)
+        self.file_path = directory_path + 'settings.json'
+
+    def tearDown(self):
+        settings_stores.pop(self.file_path, None)
+        self.directory.cleanup()
+
+    def test_instances_share_one_store(self):
+        Settings().save_settings_to_file({'model': 'gemma2'})
+
+        self.assertIs(Settings().store, Settings().store)
+        self.assertEqual(Settings().get_str('model'), 'gemma2')
+
+    def test_saves_atomically_and_round_trips_base_url(self):
+        Settings().save_settings_to_file({'base_url': 'http://localhost:8080/', 'model': 'phi3', 'theme': None})
+
+        with open(self.file_path, 'r') as file:
+            on_disk = json.load(file)
+        self.assertNotEqual(on_disk['base_url'], 'http://localhost:8080/')  # Stored base64 encoded
+        self.assertNotIn('theme', on_disk)
+        self.assertEqual(os.listdir(self.directory.name), ['settings.json'])  # No temporary files left behind
+
+        self.assertEqual(SettingsStore(self.file_path).settings, {'base_url': 'http://localhost:8080/', 'model': 'phi3'})
+        self.assertEqual(os.environ['BASE_URL'], 'http://localhost:8080/')
+
+    def test_typed_accessors(self):
+        settings = Settings()
+        settings.save_settings_to_file({'max_steps': '12', 'scale': 'abc', 'tracing': 'True', 'macros': False,
+                                        'default_browser': ''})
+
+        self.assertEqual(settings.get_int('max_steps'), 12)
+        self.assertEqual(settings.get_float('scale', 0.5), 0.5)
+        self.assertTrue(settings.get_bool('tracing'))
+        self.assertFalse(settings.get_bool('macros', True))
+        self.assertTrue(settings.get_bool('unset', True))
+        self.assertEqual(settings.get_str('default_browser', 'Chrome'), 'Chrome')
+
+    def test_subscribers_get_only_changed_settings(self):
+        settings = Settings()
+        settings.save_settings_to_file({'model': 'gemma2', 'theme': 'darkly'})
+        changes = []
+        unsubscribe = settings.subscribe(changes.append)
+
+        Settings().save_settings_to_file({'model': 'phi3', 'theme': 'darkly'})
+        Settings().save_settings_to_file({'theme': 'darkly'})
+        unsubscribe()
+        Settings().save_settings_to_file({'model': 'llama3'})
+        settings.store.wait_for_subscribers()
+
+        self.assertEqual(changes, [{'model': 'phi3'}])
+
+    def test_subscriber_errors_dont_stop_the_save(self):
+        settings = Settings()
+        changes = []
+        settings.subscribe(lambda changed: 1 / 0)
+        settings.subscribe(changes.append)
+
+        settings.save_settings_to_file({'model': 'phi3'})
+        settings.store.wait_for_subscribers()
+
+        self.assertEqual(changes, [{'model': 'phi3'}])
+        self.assertEqual(SettingsStore(self.file_path).settings, {'model': 'phi3'})
+
+    def test_slow_subscribers_dont_block_the_save(self):
+        settings = Settings()
+        release = threading.Event()
+        threads = []
+        changes = []
+
+        def slow_subscriber(changed):
+            threads.append(threading.current_thread())
+            release.wait(5)
+            changes.append(changed)
+        settings.subscribe(slow_subscriber)
+
+        settings.save_settings_to_file({'model': 'phi3'})
+        settings.save_settings_to_file({'model': 'llama3'})
+        # Both saves returned while the subscriber is still busy with the first
+        self.assertEqual(settings.get_str('model'), 'llama3')
+        self.assertEqual(changes, [])
+        release.set()
+        settings.store.wait_for_subscribers()
+
+        self.assertEqual(changes, [{'model': 'phi3'}, {'model': 'llama3'}])
+        self.assertNotIn(threading.current_thread(), threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
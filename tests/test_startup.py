@@ -0,0 +1,30 @@
+# tests/test_startup.py
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../benchmarks')))
+
+# Loaded once the window is up or on first use, see App.run(). The benchmark checks the same list.
+from startup_benchmark import APP_DIRECTORY, DEFERRED_MODULES
+
+
+class TestStartup(unittest.TestCase):
+    def test_heavy_modules_are_not_imported_before_the_window(self):
+        check = f'import sys, app; print(",".join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))'
+        completed = subprocess.run([sys.executable, '-c', check], cwd=APP_DIRECTORY, capture_output=True, text=True)
+        if completed.returncode != 0:
+            self.skipTest(f'app is not importable here - {completed.stderr.strip().splitlines()[-1]}')
+
+        self.assertEqual(completed.stdout.strip(), '')
+
+    def test_system_probing_is_deferred(self):
+        check = 'import utils.local_info as local_info; print(local_info.get_locally_installed_apps.cache_info().misses)'
+        completed = subprocess.run([sys.executable, '-c', check], cwd=APP_DIRECTORY, capture_output=True, text=True)
+
+        self.assertEqual(completed.stdout.strip(), '0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# tests/test_tracing.py
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+from utils.tracing import Tracer, percentile, read_span_records, save_trace, summarize
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+        self.tracer.enabled = True
+
+    def test_spans_are_only_recorded_inside_a_trace(self):
+        with self.tracer.span('capture'):
+            pass
+        self.tracer.start_trace('Open Chrome')
+        with self.tracer.span('capture'):
+            pass
+        thread = threading.Thread(target=lambda: self.tracer.record('generation', 0.0, 1.0))
+        thread.start()
+        thread.join()
+        trace = self.tracer.finish_trace()
+
+        self.assertEqual([span.name for span in trace.spans], ['capture', 'generation'])
+        self.assertEqual(trace.spans[1].duration_ms, 1000.0)
+        self.assertIsNone(self.tracer.finish_trace())
+
+    def test_disabled_tracer_records_nothing(self):
+        self.tracer.enabled = False
+        self.tracer.start_trace('Open Chrome')
+        with self.tracer.span('capture'):
+            pass
+        self.assertIsNone(self.tracer.finish_trace())
+
+    def test_saved_trace_is_chrome_trace_and_jsonl(self):
+        self.tracer.start_trace('Open Chrome')
+        with self.tracer.span('execute.press', keys=['enter']):
+            pass
+        trace = self.tracer.finish_trace()
+
+        with tempfile.TemporaryDirectory() as directory:
+            trace_path = save_trace(trace, directory)
+            with open(trace_path) as file:
+                chrome_trace = json.load(file)
+            records = read_span_records(os.path.join(directory, 'spans.jsonl'))
+
+        complete_events = [event for event in chrome_trace['traceEvents'] if event['ph'] == 'X']
+        self.assertEqual(complete_events[0]['name'], 'execute.press')
+        self.assertEqual(complete_events[0]['args'], {'keys': ['enter']})
+        self.assertEqual([(record['request'], record['name']) for record in records], [('Open Chrome', 'execute.press')])
+
+    def test_summary_percentiles(self):
+        records = [{'name': 'generation', 'duration_ms': ms} for ms in range(1, 101)]
+        summary = summarize(records)
+
+        self.assertEqual(summary['generation']['count'], 100)
+        self.assertAlmostEqual(summary['generation']['p50'], 50.5)
+        self.assertAlmostEqual(summary['generation']['p95'], 95.05)
+        self.assertEqual(percentile([7.0], 0.95), 7.0)
+
+
+if __name__ == '__main__':
+    unittest.main()